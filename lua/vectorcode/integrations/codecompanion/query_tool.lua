@@ -61,6 +61,9 @@ return check_cli_wrap(function(opts)
         else
           vim.list_extend(args, { "--include", "path", "document" })
         end
+        if type(opts.char_budget) == "number" and opts.char_budget > 0 then
+          vim.list_extend(args, { "--char-budget", tostring(opts.char_budget) })
+        end
         if action.project_root == "" then
           action.project_root = nil
         end
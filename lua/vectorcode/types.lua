@@ -92,6 +92,10 @@
 --- Whether to send chunks instead of full files to the LLM. Default: `false`
 --- > Make sure you adjust `max_num` and `default_num` accordingly.
 ---@field chunk_mode boolean?
+--- Maximum number of characters of the results provided to the LLM.
+--- Files that don't fit are replaced by their most relevant lines.
+--- Default: `nil` (unlimited)
+---@field char_budget integer?
 
 ---@class VectorCode.CodeCompanion.VectoriseToolOpts: VectorCode.CodeCompanion.ToolOpts
 
@@ -0,0 +1 @@
+__version__ = '0.1.dev1+g3106be8' # pragma: no cover
\ No newline at end of file
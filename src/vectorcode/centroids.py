@@ -0,0 +1,139 @@
+import logging
+from typing import Iterable, Optional, Sequence
+
+import numpy
+
+from vectorcode.cli_utils import Config
+from vectorcode.sqlite_index import SQLiteIndex, open_index
+
+logger = logging.getLogger(name=__name__)
+
+CENTROID_INDEX_FILE = "centroids.sqlite3"
+
+
+class CentroidIndex(SQLiteIndex):
+    """
+    A small vector index that holds one embedding per file (the mean of its chunk embeddings),
+    backed by SQLite. Searches are brute-force cosine similarity over all files,
+    which is cheap because there are far fewer files than chunks.
+    With `float16`, the centroids are stored (and held in memory) in half precision.
+    """
+
+    SCHEMA = "CREATE TABLE IF NOT EXISTS centroids (path TEXT PRIMARY KEY, vector BLOB NOT NULL, dtype TEXT NOT NULL DEFAULT 'float32')"
+
+    def __init__(self, db_path: str, float16: bool = False):
+        super().__init__(db_path)
+        self.dtype = numpy.dtype(numpy.float16 if float16 else numpy.float32)
+        with self._lock, self._conn:
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(centroids)")
+            ]
+            if "dtype" not in columns:
+                # created before the centroids could be stored in half precision.
+                self._conn.execute(
+                    "ALTER TABLE centroids ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'"
+                )
+        self.__paths: Optional[list[str]] = None
+        self.__matrix: Optional[numpy.ndarray] = None
+
+    def add(self, path: str, embeddings: Sequence[Sequence[float]] | numpy.ndarray):
+        """
+        Save the mean of the chunk `embeddings` as the centroid of `path`.
+        """
+        centroid = numpy.mean(numpy.asarray(embeddings, dtype=numpy.float32), axis=0)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO centroids (path, vector, dtype) VALUES (?, ?, ?)",
+                (path, centroid.astype(self.dtype).tobytes(), self.dtype.name),
+            )
+            self.__matrix = None
+
+    def delete(self, paths: Iterable[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM centroids WHERE path = ?", ((i,) for i in paths)
+            )
+            self.__matrix = None
+
+    def has_path(self, path: str) -> bool:
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM centroids WHERE path = ?", (path,)
+                ).fetchone()
+                is not None
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM centroids").fetchone()[0]
+
+    def __load(self) -> tuple[list[str], numpy.ndarray]:
+        with self._lock:
+            if self.__matrix is None:
+                rows = self._conn.execute(
+                    "SELECT path, vector, dtype FROM centroids"
+                ).fetchall()
+                self.__paths = [row[0] for row in rows]
+                if rows:
+                    matrix = numpy.stack(
+                        [
+                            numpy.frombuffer(row[1], dtype=row[2]).astype(numpy.float32)
+                            for row in rows
+                        ]
+                    )
+                    norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+                    self.__matrix = (matrix / numpy.where(norms == 0, 1, norms)).astype(
+                        self.dtype
+                    )
+                else:
+                    self.__matrix = numpy.empty((0, 0), dtype=self.dtype)
+            assert self.__paths is not None
+            return self.__paths, self.__matrix
+
+    def search(
+        self,
+        query_embeddings: Sequence[Sequence[float]] | numpy.ndarray,
+        n_results: int,
+        exclude_paths: Sequence[str] = (),
+    ) -> list[str]:
+        """
+        Return the paths of at most `n_results` files whose centroids are the most similar
+        to any of the `query_embeddings`, ordered by decreasing cosine similarity.
+        """
+        paths, matrix = self.__load()
+        if n_results <= 0 or len(paths) == 0:
+            return []
+        queries = numpy.asarray(query_embeddings, dtype=numpy.float32).reshape(
+            -1, matrix.shape[1]
+        )
+        norms = numpy.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / numpy.where(norms == 0, 1, norms)
+        # half precision is only for storage: numpy has no fast float16 matmul.
+        scores = (matrix.astype(numpy.float32, copy=False) @ queries.T).max(axis=1)
+        if exclude_paths:
+            excluded = set(exclude_paths)
+            scores[[i for i, path in enumerate(paths) if path in excluded]] = -numpy.inf
+        n_results = min(n_results, len(paths))
+        top = numpy.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[numpy.argsort(-scores[top], kind="stable")]
+        return [paths[i] for i in top if numpy.isfinite(scores[i])]
+
+
+def get_centroid_index(
+    configs: Config, make_if_missing: bool = False
+) -> Optional[CentroidIndex]:
+    """
+    Return the file-level centroid index of the collection for `configs.project_root`.
+    Return None if `configs.centroid_index` is disabled,
+    or if the index doesn't exist and `make_if_missing` is False.
+    """
+    if not configs.centroid_index:
+        return None
+    return open_index(
+        configs,
+        CENTROID_INDEX_FILE,
+        lambda db_path: CentroidIndex(db_path, float16=configs.float16_vectors),
+        make_if_missing,
+        "Centroid index",
+    )
@@ -1,3 +1,4 @@
+import copy
 import logging
 import os
 import re
@@ -5,7 +6,7 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from functools import cache
 from io import TextIOWrapper
-from typing import Generator, Optional, cast
+from typing import Any, Generator, Hashable, Optional, Sequence, cast
 
 from pygments.lexer import Lexer
 from pygments.lexers import get_lexer_for_filename
@@ -14,6 +15,8 @@ from tree_sitter import Node, Point
 from tree_sitter_language_pack import SupportedLanguage, get_parser
 
 from vectorcode.cli_utils import Config
+from vectorcode.embedding_batcher import get_max_length, get_tokenizer, load_tokenizer
+from vectorcode.embedding_registry import make_embedding_key
 
 logger = logging.getLogger(name=__name__)
 
@@ -47,6 +50,154 @@ class ChunkOpts:
     start_pos: Point
 
 
+@dataclass
+class Symbol:
+    """
+    A definition (function, class, method, type) found by the treesitter parser.
+    rows are 1-indexed.
+    """
+
+    name: str
+    kind: str
+    path: str
+    start: int
+    end: int
+
+    def export_dict(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "path": self.path,
+            "start": self.start,
+            "end": self.end,
+        }
+
+
+_DEFINITION_SUFFIXES = ("_definition", "_declaration", "_item", "_spec")
+_DEFINITION_KINDS = (
+    ("method", "method"),
+    ("function", "function"),
+    ("class", "class"),
+    ("struct", "type"),
+    ("enum", "type"),
+    ("interface", "type"),
+    ("trait", "type"),
+    ("impl", "type"),
+    ("type", "type"),
+)
+
+
+def get_definition_kind(node_type: str) -> Optional[str]:
+    """
+    Guess the kind of definition from the type of a treesitter node, such as
+    `function_definition` (python), `method_declaration` (go) or `struct_item` (rust).
+    Return None if the node is not a definition.
+    """
+    if not node_type.endswith(_DEFINITION_SUFFIXES):
+        return None
+    for keyword, kind in _DEFINITION_KINDS:
+        if keyword in node_type:
+            return kind
+    return None
+
+
+def get_definition_name(node: Node) -> Optional[str]:
+    name_node = node.child_by_field_name("name")
+    declarator = node
+    while name_node is None:
+        # C-like languages put the name in (nested) declarators.
+        declarator = declarator.child_by_field_name("declarator")
+        if declarator is None:
+            return None
+        if declarator.type.endswith("identifier"):
+            name_node = declarator
+    if name_node.text is None:  # pragma: nocover
+        return None
+    return name_node.text.decode()
+
+
+class TokenCounter:
+    """
+    Measures texts with the (fast) tokenizer of the embedding model.
+    The texts are tokenized in batches, and the counts are cached because the
+    treesitter chunker measures the same nodes repeatedly.
+    """
+
+    def __init__(
+        self, tokenizer: Any, max_length: Optional[int] = None, cache_size: int = 65536
+    ):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.num_special_tokens = int(tokenizer.num_special_tokens_to_add())
+        self.cache_size = cache_size
+        self.__cache: dict[str, int] = {}
+
+    def count(self, texts: Sequence[str]) -> list[int]:
+        """The number of tokens of each text, excluding the special tokens."""
+        missing = [i for i in dict.fromkeys(texts) if i not in self.__cache]
+        if missing:
+            if len(self.__cache) + len(missing) > self.cache_size:
+                self.__cache.clear()
+            input_ids = self.tokenizer(
+                missing, add_special_tokens=False, verbose=False
+            )["input_ids"]
+            self.__cache.update(zip(missing, (len(i) for i in input_ids)))
+        return [self.__cache[i] for i in texts]
+
+    def offsets(self, text: str) -> list[tuple[int, int]]:
+        """The character spans of the tokens in `text`."""
+        return [
+            (int(start), int(end))
+            for start, end in self.tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                verbose=False,
+            )["offset_mapping"]
+        ]
+
+    def get_budget(self, chunk_size: int) -> int:
+        """
+        The maximum number of tokens in a chunk, so that the chunk (with the special tokens)
+        fits in the maximum sequence length of the model.
+        """
+        budget = chunk_size
+        if self.max_length is not None:
+            budget = min(budget, self.max_length - self.num_special_tokens)
+        return max(budget, 1)
+
+
+__token_counters: dict[Hashable, Optional[TokenCounter]] = {}
+
+
+def get_token_counter(configs: Config) -> Optional[TokenCounter]:
+    """
+    Return a `TokenCounter` for the embedding function in the configs (shared by the chunkers),
+    or None if the embedding function doesn't expose a fast tokenizer.
+    """
+    key = make_embedding_key(configs)
+    if key not in __token_counters:
+        from vectorcode.common import get_embedding_function
+
+        embedding_function = get_embedding_function(configs)
+        tokenizer = get_tokenizer(embedding_function)
+        max_length = get_max_length(embedding_function)
+        if tokenizer is not None:
+            # a copy, because the model uses its tokenizer when it embeds the chunks
+            # in another thread, and fast tokenizers can't be used by several threads at once.
+            tokenizer = copy.deepcopy(tokenizer)
+        else:
+            tokenizer, max_length = load_tokenizer(configs)
+        if tokenizer is None or not tokenizer.is_fast:
+            logger.warning(
+                f"{configs.embedding_function} doesn't provide a fast tokenizer. Chunk sizes are measured in characters."
+            )
+            __token_counters[key] = None
+        else:
+            __token_counters[key] = TokenCounter(tokenizer, max_length)
+    return __token_counters[key]
+
+
 class ChunkerBase(ABC):  # pragma: nocover
     def __init__(self, config: Optional[Config] = None) -> None:
         if config is None:
@@ -55,6 +206,20 @@ class ChunkerBase(ABC):  # pragma: nocover
             "Overlap ratio has to be a float between 0 (inclusive) and 1 (exclusive)."
         )
         self.config = config
+        self.__token_counter: Optional[TokenCounter] = None
+        self.__token_counter_loaded = False
+
+    @property
+    def token_counter(self) -> Optional[TokenCounter]:
+        """
+        The `TokenCounter` that measures the chunks when `chunk_by_tokens` is enabled.
+        It's loaded on first use.
+        """
+        if not self.__token_counter_loaded:
+            if self.config.chunk_by_tokens and self.config.chunk_size >= 0:
+                self.__token_counter = get_token_counter(self.config)
+            self.__token_counter_loaded = True
+        return self.__token_counter
 
     @abstractmethod
     def chunk(
@@ -85,38 +250,58 @@ class StringChunker(ChunkerBase):
                     column=len(data.split("\n")[-1]) - 1,
                 ),
             )
+        elif self.token_counter is not None:
+            yield from self.__chunk_by_tokens(data, start_pos, self.token_counter)
         else:
             step_size = max(
                 1, int(self.config.chunk_size * (1 - self.config.overlap_ratio))
             )
             i = 0
             while i < len(data):
-                chunk_text = data[i : i + self.config.chunk_size]
-
-                start_lines_before_chunk = data[:i].count("\n")
-                chunk_start_row = start_pos.row + start_lines_before_chunk
-                if start_lines_before_chunk == 0:
-                    chunk_start_column = start_pos.column + i
-                else:
-                    last_newline_idx_before_i = data.rfind("\n", 0, i)
-                    chunk_start_column = i - (last_newline_idx_before_i + 1)
-
-                chunk_end_row = chunk_start_row + chunk_text.count("\n")
-
-                if "\n" in chunk_text:
-                    chunk_end_column = len(chunk_text.split("\n")[-1]) - 1
-                else:
-                    chunk_end_column = chunk_start_column + len(chunk_text) - 1
-
-                yield Chunk(
-                    text=chunk_text,
-                    start=Point(row=chunk_start_row, column=chunk_start_column),
-                    end=Point(row=chunk_end_row, column=chunk_end_column),
+                yield self.__make_chunk(
+                    data, i, data[i : i + self.config.chunk_size], start_pos
                 )
                 if i + self.config.chunk_size >= len(data):
                     break
                 i += step_size
 
+    def __make_chunk(self, data: str, i: int, chunk_text: str, start_pos: Point):
+        start_lines_before_chunk = data[:i].count("\n")
+        chunk_start_row = start_pos.row + start_lines_before_chunk
+        if start_lines_before_chunk == 0:
+            chunk_start_column = start_pos.column + i
+        else:
+            last_newline_idx_before_i = data.rfind("\n", 0, i)
+            chunk_start_column = i - (last_newline_idx_before_i + 1)
+
+        chunk_end_row = chunk_start_row + chunk_text.count("\n")
+
+        if "\n" in chunk_text:
+            chunk_end_column = len(chunk_text.split("\n")[-1]) - 1
+        else:
+            chunk_end_column = chunk_start_column + len(chunk_text) - 1
+
+        return Chunk(
+            text=chunk_text,
+            start=Point(row=chunk_start_row, column=chunk_start_column),
+            end=Point(row=chunk_end_row, column=chunk_end_column),
+        )
+
+    def __chunk_by_tokens(self, data: str, start_pos: Point, counter: TokenCounter):
+        """Slide a window of `counter.get_budget(chunk_size)` tokens over the string."""
+        budget = counter.get_budget(self.config.chunk_size)
+        step_size = max(1, int(budget * (1 - self.config.overlap_ratio)))
+        offsets = counter.offsets(data)
+        i = 0
+        while i < len(offsets):
+            start = 0 if i == 0 else offsets[i][0]
+            is_last = i + budget >= len(offsets)
+            end = len(data) if is_last else offsets[i + budget - 1][1]
+            yield self.__make_chunk(data, start, data[start:end], start_pos)
+            if is_last:
+                break
+            i += step_size
+
 
 class FileChunker(ChunkerBase):
     def __init__(self, config: Optional[Config] = None) -> None:
@@ -184,6 +369,31 @@ class TreeSitterChunker(ChunkerBase):
             config = Config()
         super().__init__(config)
         self._fallback_chunker = StringChunker(config)
+        self.symbols: list[Symbol] = []
+
+    def __extract_symbols(self, root: Node, path: str) -> list[Symbol]:
+        symbols: list[Symbol] = []
+        # (node, whether the node is nested in a class-like definition)
+        stack: list[tuple[Node, bool]] = [(root, False)]
+        while stack:
+            node, in_class = stack.pop()
+            kind = get_definition_kind(node.type)
+            name = get_definition_name(node) if kind is not None else None
+            if kind is not None and name is not None:
+                if kind == "function" and in_class:
+                    kind = "method"
+                symbols.append(
+                    Symbol(
+                        name=name,
+                        kind=kind,
+                        path=path,
+                        start=node.start_point.row + 1,
+                        end=node.end_point.row + 1,
+                    )
+                )
+            child_in_class = (kind in {"class", "type"}) or (in_class and kind is None)
+            stack.extend((child, child_in_class) for child in reversed(node.children))
+        return symbols
 
     def __chunk_node(
         self, node: Node, text_bytes: bytes
@@ -204,12 +414,25 @@ class TreeSitterChunker(ChunkerBase):
                 node.text.decode(), ChunkOpts(start_pos=node.start_point)
             )
 
-        for child in node.children:
-            child_bytes = text_bytes[child.start_byte : child.end_byte]
-            child_text = child_bytes.decode()
-            child_length = len(child_text)
-
-            if child_length > self.config.chunk_size:
+        child_texts = [
+            text_bytes[child.start_byte : child.end_byte].decode()
+            for child in node.children
+        ]
+        counter = self.token_counter
+        if counter is None:
+            chunk_size = self.config.chunk_size
+            child_lengths = [len(i) for i in child_texts]
+        else:
+            # the children are measured in one batch. The token count of a chunk is
+            # the sum of its children because they're joined by whitespaces.
+            chunk_size = counter.get_budget(self.config.chunk_size)
+            child_lengths = counter.count(child_texts)
+        current_length = 0
+
+        for child, child_text, child_length in zip(
+            node.children, child_texts, child_lengths
+        ):
+            if child_length > chunk_size:
                 # Yield current chunk if exists
                 if current_chunk:
                     assert current_start is not None
@@ -231,13 +454,14 @@ class TreeSitterChunker(ChunkerBase):
 
             elif not current_chunk:
                 # Start new chunk
-                current_chunk = child_bytes.decode()
+                current_chunk = child_text
+                current_length = child_length
                 current_start = Point(
                     row=child.start_point.row + 1, column=child.start_point.column
                 )
                 prev_node = child
 
-            elif len(current_chunk) + child_length + 1 <= self.config.chunk_size:
+            elif current_length + child_length + 1 <= chunk_size:
                 # Add to current chunk
                 if prev_node:
                     if prev_node.end_point.row != child.start_point.row:
@@ -246,7 +470,11 @@ class TreeSitterChunker(ChunkerBase):
                         current_chunk += " " * (
                             child.start_point.column - prev_node.end_point.column
                         )
-                current_chunk += child_bytes.decode()
+                current_chunk += child_text
+                if counter is None:
+                    current_length = len(current_chunk)
+                else:
+                    current_length += child_length
                 prev_node = child
 
             else:
@@ -262,7 +490,8 @@ class TreeSitterChunker(ChunkerBase):
                         else current_start.column + len(current_chunk) - 1,
                     ),
                 )
-                current_chunk = child_bytes.decode()
+                current_chunk = child_text
+                current_length = child_length
                 current_start = Point(
                     row=child.start_point.row + 1, column=child.start_point.column
                 )
@@ -369,7 +598,11 @@ class TreeSitterChunker(ChunkerBase):
     ) -> Generator[Chunk, None, None]:
         """
         data: path to the file
+
+        When `symbol_index` is enabled in the config, the definitions found
+        in the file will be saved to `self.symbols`.
         """
+        self.symbols = []
         lines = self.__load_file_lines(data)
         content = "".join(lines)
         if self.config.chunk_size < 0 and content:
@@ -409,6 +642,9 @@ class TreeSitterChunker(ChunkerBase):
             pattern_str = self.__build_pattern(language=language)
             content_bytes = content.encode()
             tree = parser.parse(content_bytes)
+            if self.config.symbol_index:
+                self.symbols = self.__extract_symbols(tree.root_node, data)
+                logger.debug(f"Found {len(self.symbols)} symbols in {data}.")
             chunks_gen = self.__chunk_node(tree.root_node, content_bytes)
             if pattern_str:
                 re_pattern = re.compile(pattern_str)
@@ -65,6 +65,7 @@ class CliAction(Enum):
     clean = "clean"
     prompts = "prompts"
     chunks = "chunks"
+    prepare = "prepare"
 
 
 @dataclass
@@ -103,6 +104,26 @@ class Config:
     encoding: str = "utf8"
     hooks: bool = False
     prompt_categories: Optional[list[str]] = None
+    lexical_index: bool = False
+    symbol_index: bool = False
+    centroid_index: bool = False
+    query_projects: list[Union[str, os.PathLike]] = field(default_factory=list)
+    query_all_projects: bool = False
+    stream: bool = False
+    char_budget: int = 0
+    reranker_cache: bool = False
+    reranker_timeout: float = 0
+    embedding_worker: bool = False
+    embedding_batch_tokens: int = 0
+    chunk_by_tokens: bool = False
+    embedding_dimensions: int = 0
+    embedding_reduction: str = "truncate"
+    float16_vectors: bool = False
+    embedding_processes: int = 0
+    embedding_threads: int = 0
+    background_indexing: bool = False
+    background_threads: int = 0
+    dedup_threshold: float = 0
 
     @classmethod
     async def import_from(cls, config_dict: dict[str, Any]) -> "Config":
@@ -153,6 +174,63 @@ class Config:
                     "filetype_map", default_config.filetype_map
                 ),
                 "encoding": config_dict.get("encoding", default_config.encoding),
+                "lexical_index": config_dict.get(
+                    "lexical_index", default_config.lexical_index
+                ),
+                "symbol_index": config_dict.get(
+                    "symbol_index", default_config.symbol_index
+                ),
+                "centroid_index": config_dict.get(
+                    "centroid_index", default_config.centroid_index
+                ),
+                "query_projects": config_dict.get(
+                    "query_projects", default_config.query_projects
+                ),
+                "query_all_projects": config_dict.get(
+                    "query_all_projects", default_config.query_all_projects
+                ),
+                "char_budget": config_dict.get(
+                    "char_budget", default_config.char_budget
+                ),
+                "reranker_cache": config_dict.get(
+                    "reranker_cache", default_config.reranker_cache
+                ),
+                "reranker_timeout": config_dict.get(
+                    "reranker_timeout", default_config.reranker_timeout
+                ),
+                "embedding_worker": config_dict.get(
+                    "embedding_worker", default_config.embedding_worker
+                ),
+                "embedding_batch_tokens": config_dict.get(
+                    "embedding_batch_tokens", default_config.embedding_batch_tokens
+                ),
+                "chunk_by_tokens": config_dict.get(
+                    "chunk_by_tokens", default_config.chunk_by_tokens
+                ),
+                "embedding_dimensions": config_dict.get(
+                    "embedding_dimensions", default_config.embedding_dimensions
+                ),
+                "embedding_reduction": config_dict.get(
+                    "embedding_reduction", default_config.embedding_reduction
+                ),
+                "float16_vectors": config_dict.get(
+                    "float16_vectors", default_config.float16_vectors
+                ),
+                "embedding_processes": config_dict.get(
+                    "embedding_processes", default_config.embedding_processes
+                ),
+                "embedding_threads": config_dict.get(
+                    "embedding_threads", default_config.embedding_threads
+                ),
+                "background_indexing": config_dict.get(
+                    "background_indexing", default_config.background_indexing
+                ),
+                "background_threads": config_dict.get(
+                    "background_threads", default_config.background_threads
+                ),
+                "dedup_threshold": config_dict.get(
+                    "dedup_threshold", default_config.dedup_threshold
+                ),
             }
         )
 
@@ -303,6 +381,30 @@ def get_cli_parser():
         help="What to include in the final output.",
         default=__default_config.include,
     )
+    query_parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=False,
+        help="Print each result as a line of JSON (NDJSON) as soon as it is retrieved.",
+    )
+    query_parser.add_argument(
+        "--projects",
+        nargs="+",
+        default=None,
+        help="Other project roots to be queried together with the current project.",
+    ).complete = shtab.DIRECTORY  # type:ignore
+    query_parser.add_argument(
+        "--all-projects",
+        action="store_true",
+        default=False,
+        help="Query all projects indexed by VectorCode together with the current project.",
+    )
+    query_parser.add_argument(
+        "--char-budget",
+        type=int,
+        default=__default_config.char_budget,
+        help="Pack the results into this many characters. Files that don't fit are replaced by their most relevant lines.",
+    )
 
     subparsers.add_parser("drop", parents=[shared_parser], help="Remove a collection.")
 
@@ -373,6 +475,19 @@ def get_cli_parser():
     chunks_parser.add_argument(
         "file_paths", nargs="*", help="Paths to files to be chunked."
     ).complete = shtab.FILE  # type:ignore
+
+    prepare_parser = subparsers.add_parser(
+        "prepare",
+        parents=[shared_parser],
+        help="Save load-optimised local copies of the embedding and reranker models.",
+    )
+    prepare_parser.add_argument(
+        "--force",
+        "-f",
+        action="store_true",
+        default=False,
+        help="Overwrite the existing copies.",
+    )
     return main_parser
 
 
@@ -406,6 +521,10 @@ async def parse_cli_args(args: Optional[Sequence[str]] = None):
             configs_items["use_absolute_path"] = main_args.absolute
             configs_items["include"] = [QueryInclude(i) for i in main_args.include]
             configs_items["encoding"] = main_args.encoding
+            configs_items["query_projects"] = main_args.projects or []
+            configs_items["query_all_projects"] = main_args.all_projects
+            configs_items["stream"] = main_args.stream
+            configs_items["char_budget"] = main_args.char_budget
         case "check":
             configs_items["check_item"] = main_args.check_item
         case "init":
@@ -415,6 +534,8 @@ async def parse_cli_args(args: Optional[Sequence[str]] = None):
             configs_items["chunk_size"] = main_args.chunk_size
             configs_items["overlap_ratio"] = main_args.overlap
             configs_items["encoding"] = main_args.encoding
+        case "prepare":
+            configs_items["force"] = main_args.force
         case "prompts":
             configs_items["prompt_categories"] = main_args.prompt_categories
     return Config(**configs_items)
@@ -2,10 +2,12 @@ import asyncio
 import hashlib
 import logging
 import os
+import shutil
 import socket
 import subprocess
 import sys
-from typing import Any, AsyncGenerator
+import time
+from typing import Any, AsyncGenerator, Hashable
 from urllib.parse import urlparse
 
 import chromadb
@@ -16,10 +18,28 @@ from chromadb.api.types import IncludeEnum
 from chromadb.config import APIVersion, Settings
 from chromadb.utils import embedding_functions
 
+from vectorcode import embedding_worker
 from vectorcode.cli_utils import Config, expand_path
+from vectorcode.embedding_registry import (
+    embedding_function_registry,
+    make_embedding_key,
+)
+from vectorcode.model_artifacts import resolve_embedding_params
+from vectorcode.reduction import (
+    PROJECTION_DIGEST_KEY,
+    ReducedEmbeddingFunction,
+    get_base_configs,
+    get_calibration_digest,
+    get_calibration_path,
+)
+from vectorcode.remote_embedding import RemoteEmbeddingFunction
 
 logger = logging.getLogger(name=__name__)
 
+GLOBAL_INDEX_DIR = os.path.join(
+    os.path.expanduser("~"), ".local", "share", "vectorcode", "indices"
+)
+
 
 async def get_collections(
     client: AsyncClientAPI,
@@ -150,10 +170,66 @@ def get_collection_name(full_path: str) -> str:
     return collection_id
 
 
+def get_index_dir(collection_name: str, make_if_missing: bool = False) -> str:
+    """
+    Return the directory that holds the local auxiliary indices (full-text
+    index, etc.) of a collection. These live beside the chromadb data.
+    """
+    index_dir = os.path.join(GLOBAL_INDEX_DIR, collection_name)
+    if make_if_missing:
+        os.makedirs(index_dir, exist_ok=True)
+    return index_dir
+
+
+def remove_index_dir(collection_name: str):
+    index_dir = get_index_dir(collection_name)
+    if os.path.isdir(index_dir):
+        logger.debug(f"Removing local indices at {index_dir}.")
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+__EMBEDDING_FUNCTIONS: dict[str, type[chromadb.EmbeddingFunction]] = {
+    "RemoteEmbeddingFunction": RemoteEmbeddingFunction,
+}
+"""Embedding functions that are provided by VectorCode (instead of Chromadb)."""
+
+
 def get_embedding_function(configs: Config) -> chromadb.EmbeddingFunction | None:
+    """
+    Return the embedding function in `configs`. Instances are shared by everything
+    in this process that uses the same embedding function and parameters.
+    With `configs.embedding_worker`, the documents are embedded by the embedding worker.
+    With `configs.embedding_dimensions`, the embeddings are reduced by `ReducedEmbeddingFunction`.
+    """
+    if configs.embedding_dimensions > 0:
+        # resolved first, so that the reduced function holds a reference to it.
+        base_configs = get_base_configs(configs)
+        base_function = get_embedding_function(base_configs)
+        return embedding_function_registry.get(
+            make_embedding_key(configs),
+            lambda: ReducedEmbeddingFunction(configs, base_function),
+            dependencies=[make_embedding_key(base_configs)],
+        )
+    if configs.embedding_worker and embedding_worker.is_supported():
+        return embedding_function_registry.get(
+            make_embedding_key(configs),
+            lambda: embedding_worker.WorkerEmbeddingFunction(configs),
+        )
+    return embedding_function_registry.get(
+        make_embedding_key(configs), lambda: _make_embedding_function(configs)
+    )
+
+
+def _make_embedding_function(configs: Config) -> chromadb.EmbeddingFunction | None:
     try:
+        if configs.embedding_function in __EMBEDDING_FUNCTIONS:
+            return __EMBEDDING_FUNCTIONS[configs.embedding_function](
+                **configs.embedding_params
+            )
         return getattr(embedding_functions, configs.embedding_function)(
-            **configs.embedding_params
+            **resolve_embedding_params(
+                configs.embedding_function, configs.embedding_params
+            )
         )
     except AttributeError:
         logger.warning(
@@ -171,6 +247,8 @@ def get_embedding_function(configs: Config) -> chromadb.EmbeddingFunction | None
 
 
 __COLLECTION_CACHE: dict[str, AsyncCollection] = {}
+__COLLECTION_EF_KEYS: dict[str, Hashable] = {}
+__COLLECTION_LAST_USED: dict[str, float] = {}
 
 
 async def get_collection(
@@ -182,6 +260,7 @@ async def get_collection(
     """
     assert configs.project_root is not None
     full_path = str(expand_path(str(configs.project_root), absolute=True))
+    evict_idle_collections(embedding_function_registry.ttl)
     if __COLLECTION_CACHE.get(full_path) is None:
         collection_name = get_collection_name(full_path)
         embedding_function = get_embedding_function(configs)
@@ -196,6 +275,9 @@ async def get_collection(
             "embedding_function": configs.embedding_function,
             "hnsw:M": 64,
         }
+        if configs.embedding_dimensions > 0:
+            collection_meta["embedding_dimensions"] = configs.embedding_dimensions
+            collection_meta["embedding_reduction"] = configs.embedding_reduction
         if configs.hnsw:
             for key in configs.hnsw.keys():
                 target_key = key
@@ -232,9 +314,39 @@ async def get_collection(
                     "Failed to create the collection due to hash collision. Please file a bug report."
                 )
             __COLLECTION_CACHE[full_path] = collection
+        # the cached collection holds a reference to its embedding function.
+        __COLLECTION_EF_KEYS[full_path] = make_embedding_key(configs)
+        embedding_function_registry.retain(__COLLECTION_EF_KEYS[full_path])
+    __COLLECTION_LAST_USED[full_path] = time.monotonic()
     return __COLLECTION_CACHE[full_path]
 
 
+def evict_collection(project_root: str):
+    """
+    Remove the collection of `project_root` from the cache, and release
+    its reference to the embedding function.
+    """
+    full_path = str(expand_path(str(project_root), absolute=True))
+    __COLLECTION_CACHE.pop(full_path, None)
+    last_used = __COLLECTION_LAST_USED.pop(full_path, None)
+    ef_key = __COLLECTION_EF_KEYS.pop(full_path, None)
+    if ef_key is not None:
+        embedding_function_registry.release(ef_key, last_used)
+
+
+def evict_idle_collections(ttl: float):
+    """
+    Evict the cached collections that haven't been used for `ttl` seconds, so that
+    the long-running servers can unload the embedding functions of the projects that
+    they no longer work on.
+    """
+    now = time.monotonic()
+    for full_path, last_used in list(__COLLECTION_LAST_USED.items()):
+        if now - last_used > ttl:
+            logger.info(f"Evicting idle collection for {full_path}.")
+            evict_collection(full_path)
+
+
 def verify_ef(collection: AsyncCollection, configs: Config):
     collection_ef = collection.metadata.get("embedding_function")
     collection_ep = collection.metadata.get("embedding_params")
@@ -244,7 +356,28 @@ def verify_ef(collection: AsyncCollection, configs: Config):
             "Embeddings and query must use the same embedding function and parameters. Please double-check your config."
         )
         return False
-    elif collection_ep and collection_ep != configs.embedding_params:
+    collection_dims = collection.metadata.get("embedding_dimensions")
+    if collection_dims is not None and (
+        collection_dims != configs.embedding_dimensions
+        or collection.metadata.get("embedding_reduction") != configs.embedding_reduction
+    ):
+        logger.error(
+            f"The collection was embedded with {collection_dims}-dimensional ({collection.metadata.get('embedding_reduction')}) embeddings."
+        )
+        logger.error(
+            "Embeddings and query must use the same embedding_dimensions and embedding_reduction. Please double-check your config."
+        )
+        return False
+    projection_digest = collection.metadata.get(PROJECTION_DIGEST_KEY)
+    if projection_digest is not None and projection_digest != get_calibration_digest(
+        get_calibration_path(configs)
+    ):
+        logger.error(
+            "The PCA projection that the collection was embedded with is missing or has been replaced."
+        )
+        logger.error("Please drop and re-vectorise the project.")
+        return False
+    if collection_ep and collection_ep != configs.embedding_params:
         logger.warning(
             f"The collection was embedded with a different set of configurations: {collection_ep}. The result may be inaccurate.",
         )
@@ -0,0 +1,350 @@
+import hashlib
+import logging
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Mapping, Optional, Sequence
+
+import numpy
+
+from vectorcode.cli_utils import Config
+from vectorcode.sqlite_index import SQLiteIndex, open_index
+
+logger = logging.getLogger(name=__name__)
+
+DEDUP_INDEX_FILE = "dedup.sqlite3"
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+SHINGLE_SIZE = 5
+REFERENCE_ID_PREFIX = "dedup:"
+
+# the hash functions of the sketches are (a * x + b) mod p.
+# they're seeded because the sketches are persisted.
+_PRIME = numpy.uint64((1 << 31) - 1)
+_rng = numpy.random.default_rng(0)
+_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=numpy.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=numpy.uint64)
+
+
+def get_shingles(text: str) -> set[str]:
+    """The set of `SHINGLE_SIZE`-token windows of `text`, ignoring the whitespaces."""
+    tokens = re.findall(r"\w+|[^\w\s]", text)
+    if len(tokens) <= SHINGLE_SIZE:
+        return {" ".join(tokens)} if tokens else set()
+    return {
+        " ".join(tokens[i : i + SHINGLE_SIZE])
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(text: str) -> Optional[numpy.ndarray]:
+    """
+    The MinHash sketch of the shingles of `text`, or None if `text` is blank.
+    The fraction of equal values in 2 sketches estimates the Jaccard similarity of the texts.
+    """
+    shingles = get_shingles(text)
+    if not shingles:
+        return None
+    hashes = numpy.fromiter(
+        (zlib.crc32(i.encode()) for i in shingles),
+        dtype=numpy.uint64,
+        count=len(shingles),
+    )
+    # a, b < 2**31 and the hashes < 2**32, so this doesn't overflow.
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0).astype(numpy.uint32)
+
+
+def estimate_similarity(sketch1: numpy.ndarray, sketch2: numpy.ndarray) -> float:
+    return float(numpy.mean(sketch1 == sketch2))
+
+
+def get_band_hashes(sketch: numpy.ndarray) -> list[int]:
+    """
+    Locality-sensitive hashes of the `NUM_BANDS` bands of a sketch. Similar texts
+    are likely to share at least one of them.
+    """
+    rows = NUM_PERMUTATIONS // NUM_BANDS
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                sketch[i * rows : (i + 1) * rows].tobytes(), digest_size=8
+            ).digest(),
+            "little",
+            signed=True,
+        )
+        for i in range(NUM_BANDS)
+    ]
+
+
+@dataclass
+class DuplicateReference:
+    """The location of a chunk that was collapsed into the stored chunk `canonical`."""
+
+    id: str
+    path: str
+    start: Optional[int]
+    end: Optional[int]
+    canonical: str
+
+
+@dataclass
+class DedupPlan:
+    """
+    The result of `DedupIndex.plan` for the chunks of a file: whether each chunk should be
+    stored (`keep`), the sketches of the kept chunks and the locations of the collapsed ones.
+    """
+
+    path: str
+    keep: list[bool] = field(default_factory=list)
+    sketches: list[tuple[str, numpy.ndarray]] = field(default_factory=list)
+    duplicates: list[tuple[Optional[int], Optional[int], str]] = field(
+        default_factory=list
+    )
+
+
+class DedupIndex(SQLiteIndex):
+    """
+    MinHash sketches of the chunks that are stored in a collection, backed by SQLite.
+    A chunk whose estimated Jaccard similarity with a stored chunk is at least `threshold`
+    is not stored again. Instead, its location is recorded as a reference to the stored chunk.
+    The chunks of a file are checked by `plan`, and recorded by `add` once the kept chunks
+    have been stored in the collection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS sketches (
+            id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            sketch BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sketches_path ON sketches(path);
+        CREATE TABLE IF NOT EXISTS bands (
+            band INTEGER NOT NULL,
+            hash INTEGER NOT NULL,
+            id TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS bands_hash ON bands(band, hash);
+        CREATE INDEX IF NOT EXISTS bands_id ON bands(id);
+        CREATE TABLE IF NOT EXISTS duplicates (
+            path TEXT NOT NULL,
+            start INTEGER,
+            end INTEGER,
+            canonical TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS duplicates_path ON duplicates(path);
+        CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates(canonical);
+        """
+
+    def __init__(self, db_path: str, threshold: float):
+        super().__init__(db_path)
+        self.threshold = threshold
+        # the reference IDs of different collections (which are merged when several
+        # projects are queried) shouldn't collide.
+        self.namespace = hashlib.blake2b(db_path.encode(), digest_size=4).hexdigest()
+
+    def __find(
+        self,
+        sketch: numpy.ndarray,
+        pending: Sequence[tuple[str, numpy.ndarray]] = (),
+    ) -> Optional[str]:
+        candidates: dict[str, numpy.ndarray] = {}
+        band_hashes = get_band_hashes(sketch)
+        for band, band_hash in enumerate(band_hashes):
+            for row in self._conn.execute(
+                "SELECT b.id, s.sketch FROM bands AS b JOIN sketches AS s ON b.id = s.id WHERE b.band = ? AND b.hash = ?",
+                (band, band_hash),
+            ):
+                candidates[row[0]] = numpy.frombuffer(row[1], dtype=numpy.uint32)
+        for chunk_id, pending_sketch in pending:
+            if any(
+                i == j for i, j in zip(band_hashes, get_band_hashes(pending_sketch))
+            ):
+                candidates[chunk_id] = pending_sketch
+        best_id, best_similarity = None, self.threshold
+        for chunk_id, candidate in candidates.items():
+            similarity = estimate_similarity(sketch, candidate)
+            if similarity >= best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+        return best_id
+
+    def plan(
+        self,
+        path: str,
+        ids: Sequence[str],
+        documents: Sequence[str],
+        metadatas: Sequence[Mapping[str, Any]],
+    ) -> DedupPlan:
+        """
+        Decide which chunks of `path` should be stored, without recording anything.
+        Only the chunks with line ranges are deduplicated.
+        """
+        assert len(ids) == len(documents) == len(metadatas), (
+            "ids, documents and metadatas should have the same length."
+        )
+        plan = DedupPlan(path)
+        with self._lock:
+            for chunk_id, document, meta in zip(ids, documents, metadatas):
+                sketch = minhash(document) if meta.get("start") is not None else None
+                if sketch is None:
+                    plan.keep.append(True)
+                    continue
+                # the earlier chunks of the same file count too.
+                canonical = self.__find(sketch, plan.sketches)
+                if canonical is not None:
+                    plan.duplicates.append(
+                        (meta.get("start"), meta.get("end"), canonical)
+                    )
+                    plan.keep.append(False)
+                    continue
+                plan.sketches.append((chunk_id, sketch))
+                plan.keep.append(True)
+        return plan
+
+    def add(self, plan: DedupPlan):
+        """
+        Record a plan after the kept chunks have been stored in the collection.
+        If a chunk that the plan refers to has been removed in the meantime, the file is
+        not marked as indexed, so that it's vectorised again the next time.
+        """
+        with self._lock, self._conn:
+            for chunk_id, sketch in plan.sketches:
+                self._conn.execute(
+                    "INSERT INTO sketches (id, path, sketch) VALUES (?, ?, ?)",
+                    (chunk_id, plan.path, sketch.tobytes()),
+                )
+                self._conn.executemany(
+                    "INSERT INTO bands (band, hash, id) VALUES (?, ?, ?)",
+                    (
+                        (band, band_hash, chunk_id)
+                        for band, band_hash in enumerate(get_band_hashes(sketch))
+                    ),
+                )
+            complete = True
+            for start, end, canonical in plan.duplicates:
+                if (
+                    self._conn.execute(
+                        "SELECT 1 FROM sketches WHERE id = ?", (canonical,)
+                    ).fetchone()
+                    is None
+                ):
+                    complete = False
+                    continue
+                self._conn.execute(
+                    "INSERT INTO duplicates (path, start, end, canonical) VALUES (?, ?, ?, ?)",
+                    (plan.path, start, end, canonical),
+                )
+            if complete:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO files (path) VALUES (?)", (plan.path,)
+                )
+            else:
+                logger.debug(
+                    f"Some chunks that {plan.path} duplicates have been removed."
+                )
+
+    def delete(self, paths: Iterable[str]) -> list[str]:
+        """
+        Remove the chunks of `paths`. The other files that referenced them lose their
+        entries too, and are returned so that they can be vectorised again.
+        """
+        all_dependents: set[str] = set()
+        paths = set(paths)
+        with self._lock, self._conn:
+            for path in paths:
+                dependents = [
+                    row[0]
+                    for row in self._conn.execute(
+                        "SELECT DISTINCT d.path FROM duplicates AS d JOIN sketches AS s ON d.canonical = s.id WHERE s.path = ? AND d.path != ?",
+                        (path, path),
+                    )
+                ]
+                if dependents:
+                    logger.debug(
+                        f"{len(dependents)} file(s) referenced the chunks of {path}."
+                    )
+                self._conn.execute(
+                    "DELETE FROM bands WHERE id IN (SELECT id FROM sketches WHERE path = ?)",
+                    (path,),
+                )
+                self._conn.execute("DELETE FROM sketches WHERE path = ?", (path,))
+                for file in [path, *dependents]:
+                    self._conn.execute("DELETE FROM duplicates WHERE path = ?", (file,))
+                    self._conn.execute("DELETE FROM files WHERE path = ?", (file,))
+                all_dependents.update(dependents)
+        return sorted(all_dependents - paths)
+
+    def has_path(self, path: str) -> bool:
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM files WHERE path = ?", (path,)
+                ).fetchone()
+                is not None
+            )
+
+    def get_references(self, chunk_id: str) -> list[DuplicateReference]:
+        """
+        The near-duplicates of a stored chunk. Their IDs are `dedup:<namespace>:<rowid>`.
+        """
+        with self._lock:
+            return [
+                DuplicateReference(
+                    f"{REFERENCE_ID_PREFIX}{self.namespace}:{row[0]}",
+                    row[1],
+                    row[2],
+                    row[3],
+                    chunk_id,
+                )
+                for row in self._conn.execute(
+                    "SELECT rowid, path, start, end FROM duplicates WHERE canonical = ? ORDER BY path, start",
+                    (chunk_id,),
+                )
+            ]
+
+    def get_reference(self, reference_id: str) -> Optional[DuplicateReference]:
+        """
+        Look up a reference by its ID, or return None if it's not a (valid) reference ID
+        of this index.
+        """
+        prefix = f"{REFERENCE_ID_PREFIX}{self.namespace}:"
+        if not reference_id.startswith(prefix):
+            return None
+        try:
+            rowid = int(reference_id[len(prefix) :])
+        except ValueError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, start, end, canonical FROM duplicates WHERE rowid = ?",
+                (rowid,),
+            ).fetchone()
+        if row is None:
+            return None
+        return DuplicateReference(reference_id, row[0], row[1], row[2], row[3])
+
+    def count_duplicates(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM duplicates").fetchone()[0]
+
+
+def get_dedup_index(
+    configs: Config, make_if_missing: bool = False
+) -> Optional[DedupIndex]:
+    """
+    Return the near-duplicate index of the collection for `configs.project_root`.
+    Return None if `configs.dedup_threshold` is not positive,
+    or if the index doesn't exist and `make_if_missing` is False.
+    """
+    if configs.dedup_threshold <= 0:
+        return None
+    index = open_index(
+        configs,
+        DEDUP_INDEX_FILE,
+        lambda db_path: DedupIndex(db_path, configs.dedup_threshold),
+        make_if_missing,
+        "Near-duplicate index",
+    )
+    if index is not None:
+        index.threshold = configs.dedup_threshold
+    return index
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+from vectorcode.cli_utils import Config
+from vectorcode.embedding_registry import embed, embedding_function_registry
+from vectorcode.model_artifacts import (
+    DEFAULT_SENTENCE_TRANSFORMER,
+    resolve_embedding_params,
+)
+from vectorcode.reduction import ReducedEmbeddingFunction
+
+logger = logging.getLogger(name=__name__)
+
+CHARS_PER_TOKEN = 4
+"""A rough estimate that is used when the tokenizer of the embedding model is not available."""
+
+
+def _get_base_function(embedding_function: Any) -> Any:
+    """The embedding function that holds the model (and its tokenizer)."""
+    if isinstance(embedding_function, ReducedEmbeddingFunction):
+        return embedding_function.base_function
+    return embedding_function
+
+
+def _get_model(embedding_function: Any) -> Any:
+    return getattr(_get_base_function(embedding_function), "_model", None)
+
+
+def get_tokenizer(embedding_function: Any) -> Optional[Any]:
+    """
+    Return the Hugging Face tokenizer of a SentenceTransformer-based embedding function,
+    or None if it doesn't have one.
+    """
+    tokenizer = getattr(_get_model(embedding_function), "tokenizer", None)
+    if tokenizer is None:
+        return None
+    try:
+        from transformers import PreTrainedTokenizerBase
+    except ImportError:  # pragma: nocover
+        return None
+    if isinstance(tokenizer, PreTrainedTokenizerBase):
+        return tokenizer
+    return None
+
+
+def get_max_length(embedding_function: Any) -> Optional[int]:
+    """Return the maximum sequence length (in tokens) of the embedding model, if known."""
+    max_length = getattr(_get_model(embedding_function), "max_seq_length", None)
+    if isinstance(max_length, int) and max_length > 0:
+        return max_length
+    return None
+
+
+def get_model_name(configs: Config) -> Optional[str]:
+    """
+    The Hugging Face name (or the local path) of the SentenceTransformer model in the configs,
+    or None if the embedding function isn't `SentenceTransformerEmbeddingFunction`.
+    """
+    if configs.embedding_function != "SentenceTransformerEmbeddingFunction":
+        return None
+    embedding_params = resolve_embedding_params(
+        configs.embedding_function, configs.embedding_params
+    )
+    model_name = str(embedding_params.get("model_name", DEFAULT_SENTENCE_TRANSFORMER))
+    if "/" not in model_name and not os.path.isdir(model_name):
+        # the same lookup as `SentenceTransformer`.
+        model_name = f"sentence-transformers/{model_name}"
+    return model_name
+
+
+def load_tokenizer(configs: Config) -> tuple[Optional[Any], Optional[int]]:
+    """
+    Load the tokenizer (and the maximum sequence length) of the SentenceTransformer model
+    in the configs without loading the model, for the embedding functions that don't
+    hold the model in this process (`WorkerEmbeddingFunction`).
+    """
+    model_name = get_model_name(configs)
+    if model_name is None:
+        return None, None
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        logger.warning(f"Failed to load the tokenizer of {model_name}: {e}")
+        return None, None
+    max_length = None
+    try:
+        if os.path.isdir(model_name):
+            config_path = os.path.join(model_name, "sentence_bert_config.json")
+        else:
+            from huggingface_hub import hf_hub_download
+
+            config_path = hf_hub_download(model_name, "sentence_bert_config.json")
+        with open(config_path) as fin:
+            max_length = json.load(fin).get("max_seq_length")
+    except Exception as e:
+        logger.debug(f"Failed to read the maximum sequence length of {model_name}: {e}")
+    if not (isinstance(max_length, int) and max_length > 0):
+        max_length = None
+    return tokenizer, max_length
+
+
+def count_tokens(texts: Sequence[str], embedding_function: Any = None) -> list[int]:
+    """
+    Count the tokens of the texts (capped at the maximum sequence length of the model),
+    with the tokenizer of the embedding model if available.
+    """
+    tokenizer = get_tokenizer(embedding_function)
+    if tokenizer is None:
+        return [len(text) // CHARS_PER_TOKEN + 1 for text in texts]
+    max_length = get_max_length(embedding_function)
+    # the model uses the same tokenizer when `embed` calls it (under this lock) in
+    # another thread, and fast tokenizers can't be used by several threads at once.
+    with embedding_function_registry.lock_of(_get_base_function(embedding_function)):
+        input_ids = tokenizer(
+            list(texts),
+            truncation=max_length is not None,
+            max_length=max_length,
+            add_special_tokens=True,
+        )["input_ids"]
+    return [len(i) for i in input_ids]
+
+
+def make_batches(
+    lengths: Sequence[int], token_budget: int, max_batch_size: Optional[int] = None
+) -> list[list[int]]:
+    """
+    Group the indices of the items into batches of similar lengths.
+    Each batch costs `len(batch) * max(lengths in batch)` tokens after padding,
+    which stays within `token_budget` (unless a single item is longer than that).
+    """
+    batches: list[list[int]] = []
+    current: list[int] = []
+    for idx in sorted(range(len(lengths)), key=lambda x: lengths[x]):
+        # the items are sorted, so the new item is the longest one of the batch.
+        if current and (
+            (len(current) + 1) * lengths[idx] > token_budget
+            or (max_batch_size is not None and len(current) >= max_batch_size)
+        ):
+            batches.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        batches.append(current)
+    return batches
+
+
+@dataclass
+class _PendingItem:
+    text: str
+    num_tokens: int
+    future: asyncio.Future
+
+
+class EmbeddingBatcher:
+    """
+    Collects the documents that are sent by concurrent `embed` calls (for example,
+    the chunks of the files that are vectorised at the same time), and embeds them in
+    batches of similar lengths, so that little compute is wasted on padding.
+    A batch is sent when the pending documents reach `token_budget` tokens, or
+    `max_delay` seconds after the first pending document.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Any,
+        token_budget: int,
+        max_batch_size: Optional[int] = None,
+        max_delay: float = 0.05,
+        tokenizer_function: Any = None,
+    ):
+        self.embedding_function = embedding_function
+        # the embedding function whose tokenizer counts the tokens of the documents.
+        self.tokenizer_function = (
+            embedding_function if tokenizer_function is None else tokenizer_function
+        )
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.__pending: list[_PendingItem] = []
+        self.__pending_tokens = 0
+        self.__flush_handle: Optional[asyncio.TimerHandle] = None
+        self.__tasks: set[asyncio.Task] = set()
+
+    async def embed(self, texts: Sequence[str]) -> list[Any]:
+        """Return the embeddings of `texts`, in the same order."""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        lengths = await asyncio.to_thread(count_tokens, texts, self.tokenizer_function)
+        futures: list[asyncio.Future] = []
+        for text, num_tokens in zip(texts, lengths):
+            futures.append(loop.create_future())
+            self.__pending.append(_PendingItem(text, num_tokens, futures[-1]))
+            self.__pending_tokens += num_tokens
+        if self.__pending_tokens >= self.token_budget:
+            self.__flush()
+        elif self.__flush_handle is None:
+            self.__flush_handle = loop.call_later(self.max_delay, self.__flush)
+        return list(await asyncio.gather(*futures))
+
+    def __flush(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        items, self.__pending, self.__pending_tokens = self.__pending, [], 0
+        if items:
+            task = asyncio.create_task(self.__run(items))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    async def __run(self, items: list[_PendingItem]):
+        batches = make_batches(
+            [i.num_tokens for i in items], self.token_budget, self.max_batch_size
+        )
+        logger.debug(f"Embedding {len(items)} documents in {len(batches)} batches.")
+        for batch in batches:
+            try:
+                embeddings = await asyncio.to_thread(
+                    embed, self.embedding_function, [items[i].text for i in batch]
+                )
+            except Exception as e:
+                for i in batch:
+                    if not items[i].future.done():
+                        items[i].future.set_exception(e)
+                continue
+            for i, embedding in zip(batch, embeddings):
+                if not items[i].future.done():
+                    items[i].future.set_result(embedding)
+
+
+def make_embedding_batcher(configs: Config) -> Optional[EmbeddingBatcher]:
+    """
+    Return an `EmbeddingBatcher` for the ingestion path, or None if it's disabled.
+    With `configs.embedding_processes`, the batches are embedded by the process pool,
+    and the tokens are still counted with the model in this process.
+    """
+    if configs.embedding_batch_tokens <= 0:
+        if configs.embedding_processes > 1:
+            logger.warning(
+                "`embedding_processes` only applies when `embedding_batch_tokens` is set."
+            )
+        return None
+    from vectorcode.common import get_embedding_function
+    from vectorcode.embedding_pool import get_embedding_pool
+
+    embedding_function = get_embedding_function(configs)
+    pool = get_embedding_pool(configs)
+    if pool is None:
+        return EmbeddingBatcher(embedding_function, configs.embedding_batch_tokens)
+    return EmbeddingBatcher(
+        ReducedEmbeddingFunction(configs, pool)
+        if configs.embedding_dimensions > 0
+        else pool,
+        configs.embedding_batch_tokens,
+        tokenizer_function=embedding_function,
+    )
@@ -0,0 +1,188 @@
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence
+
+import numpy
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from vectorcode.cli_utils import Config
+from vectorcode.embedding_registry import (
+    embedding_function_registry,
+    make_embedding_key,
+)
+
+logger = logging.getLogger(name=__name__)
+
+_worker_function: Optional[Any] = None
+
+
+def make_worker_function(embedding_function: str, embedding_params: dict[str, Any]):
+    """Create the embedding function in a worker process."""
+    from vectorcode.common import get_embedding_function
+
+    return get_embedding_function(
+        Config(embedding_function=embedding_function, embedding_params=embedding_params)
+    )
+
+
+def _init_worker(factory: Callable[[], Any], num_threads: int):
+    global _worker_function
+    if num_threads > 0:
+        # pin the size of the intra-op thread pools so that the workers don't compete for the cores.
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = str(num_threads)
+        try:
+            import torch
+
+            torch.set_num_threads(num_threads)
+        except ImportError:  # pragma: nocover
+            pass
+    _worker_function = factory()
+
+
+def _embed_shard(texts: list[str]) -> tuple[int, float, numpy.ndarray]:
+    assert _worker_function is not None, "The worker hasn't been initialised."
+    start = time.perf_counter()
+    embeddings = numpy.asarray(_worker_function(texts), dtype=numpy.float32)
+    return os.getpid(), time.perf_counter() - start, embeddings
+
+
+def split_shards(texts: Sequence[str], num_shards: int) -> list[list[str]]:
+    """
+    Split `texts` into at most `num_shards` contiguous shards of about the same
+    number of characters.
+    """
+    texts = list(texts)
+    num_shards = max(1, min(num_shards, len(texts)))
+    target = sum(len(i) for i in texts) / num_shards
+    shards: list[list[str]] = [[]]
+    size = 0
+    for idx, text in enumerate(texts):
+        remaining_texts = len(texts) - idx
+        remaining_shards = num_shards - len(shards)
+        if (
+            shards[-1]
+            and remaining_shards > 0
+            and (size >= target * len(shards) or remaining_texts <= remaining_shards)
+        ):
+            shards.append([])
+        shards[-1].append(text)
+        size += len(text)
+    return shards
+
+
+@dataclass
+class WorkerStats:
+    documents: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.documents / self.seconds if self.seconds > 0 else 0.0
+
+
+class ProcessPoolEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Shards each batch of documents across `configs.embedding_processes` worker processes,
+    each of which holds its own copy of the embedding model and uses
+    `configs.embedding_threads` threads (default: the CPU cores divided by the number of processes).
+    The workers are started on the first call, and stopped by `close` when the
+    registry evicts the pool (or when the process shuts down).
+    """
+
+    thread_safe = True
+
+    def __init__(
+        self,
+        configs: Config,
+        factory: Optional[Callable[[], Any]] = None,
+        start_method: str = "spawn",
+    ):
+        self.num_processes = max(1, configs.embedding_processes)
+        self.num_threads = configs.embedding_threads or max(
+            1, (os.cpu_count() or 1) // self.num_processes
+        )
+        if factory is None:
+            factory = functools.partial(
+                make_worker_function,
+                configs.embedding_function,
+                dict(configs.embedding_params),
+            )
+        self.factory = factory
+        self.start_method = start_method
+        self.stats: dict[int, WorkerStats] = {}
+        self.__lock = threading.Lock()
+        self.__executor: Optional[ProcessPoolExecutor] = None
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__executor is None:
+                logger.info(
+                    f"Starting {self.num_processes} embedding processes with {self.num_threads} threads each."
+                )
+                self.__executor = ProcessPoolExecutor(
+                    max_workers=self.num_processes,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker,
+                    initargs=(self.factory, self.num_threads),
+                )
+            return self.__executor
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if not input:
+            return []
+        executor = self.__get_executor()
+        futures = [
+            executor.submit(_embed_shard, shard)
+            for shard in split_shards(input, self.num_processes)
+        ]
+        embeddings: list[numpy.ndarray] = []
+        for future in futures:
+            pid, seconds, shard_embeddings = future.result()
+            with self.__lock:
+                stats = self.stats.setdefault(pid, WorkerStats())
+                stats.documents += len(shard_embeddings)
+                stats.seconds += seconds
+            embeddings.extend(shard_embeddings)
+        return embeddings
+
+    def report(self) -> str:
+        """The throughput of each worker process."""
+        with self.__lock:
+            return "\n".join(
+                f"Embedding worker {pid}: {stats.documents} documents in {stats.seconds:.2f}s ({stats.throughput:.1f} documents/s)"
+                for pid, stats in sorted(self.stats.items())
+            )
+
+    def close(self):
+        """Stop the worker processes. They're started again by the next call."""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def get_embedding_pool(configs: Config) -> Optional[ProcessPoolEmbeddingFunction]:
+    """
+    Return the `ProcessPoolEmbeddingFunction` that embeds the documents for `configs`
+    when they're vectorised, or None if `configs.embedding_processes` is not set.
+    The pool produces the full embeddings, and it's shared like the other embedding functions.
+    """
+    if configs.embedding_processes <= 1:
+        return None
+    from vectorcode.reduction import get_base_configs
+
+    base_configs = get_base_configs(configs)
+    return embedding_function_registry.get(
+        (
+            *make_embedding_key(base_configs),
+            f"processes:{configs.embedding_processes}:{configs.embedding_threads}",
+        ),
+        lambda: ProcessPoolEmbeddingFunction(base_configs),
+    )
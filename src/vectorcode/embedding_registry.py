@@ -0,0 +1,207 @@
+import contextlib
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Optional, Sequence
+
+from vectorcode.cli_utils import Config, expand_path
+
+logger = logging.getLogger(name=__name__)
+
+
+def make_embedding_key(configs: Config) -> tuple[str, ...]:
+    """Make a hashable key from the embedding function and its parameters."""
+    key = (
+        configs.embedding_function,
+        json.dumps(configs.embedding_params, sort_keys=True, default=str),
+    )
+    if configs.embedding_dimensions > 0:
+        key = (*key, f"{configs.embedding_reduction}:{configs.embedding_dimensions}")
+        if configs.project_root is not None:
+            # the projection belongs to the collection of the project.
+            key = (*key, str(expand_path(str(configs.project_root), absolute=True)))
+    if configs.embedding_worker:
+        return (*key, "embedding_worker")
+    return key
+
+
+@dataclass
+class _Entry:
+    function: Any
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    refcount: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    dependencies: tuple[Hashable, ...] = ()
+
+
+class EmbeddingFunctionRegistry:
+    """
+    A process-wide registry of embedding functions, so that the collections that use
+    the same embedding function and parameters share one instance (and one copy of the model weights).
+    Collections hold a reference (`retain`/`release`) to the embedding function that they use,
+    and an embedding function that wraps another one holds a reference to it (`dependencies`).
+    An embedding function is evicted when nothing references it and it hasn't been used
+    for `ttl` seconds, and its `close` method (if any) is called.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__entries: dict[Hashable, _Entry] = {}
+        # held while an embedding function is loaded, so that the same model is never
+        # loaded twice and only the callers of the same model wait for it.
+        self.__load_locks: dict[Hashable, threading.Lock] = {}
+
+    @staticmethod
+    def __close(functions: Sequence[Any]):
+        """
+        Release the resources (connections, threads, processes) of the embedding
+        functions that are removed from the registry. They're closed after the registry
+        lock is released, because closing may wait for the background work to finish.
+        """
+        for function in functions:
+            close = getattr(function, "close", None)
+            if not callable(close):
+                continue
+            try:
+                close()
+            except Exception as e:  # pragma: nocover
+                logger.warning(f"Failed to close the embedding function: {e!r}")
+
+    def __evict(self, now: float) -> list[Any]:
+        """Remove the idle embedding functions and return them, so that they can be closed."""
+        evicted: list[Any] = []
+        idle = [
+            key
+            for key, entry in self.__entries.items()
+            if entry.refcount <= 0 and now - entry.last_used > self.ttl
+        ]
+        while idle:
+            key = idle.pop()
+            entry = self.__entries.pop(key, None)
+            if entry is None:
+                continue
+            logger.info(f"Evicting idle embedding function {key}.")
+            evicted.append(entry.function)
+            for dependency in entry.dependencies:
+                dependency_entry = self.__entries.get(dependency)
+                if dependency_entry is None:
+                    continue
+                dependency_entry.refcount = max(dependency_entry.refcount - 1, 0)
+                dependency_entry.last_used = max(
+                    dependency_entry.last_used, entry.last_used
+                )
+                if (
+                    dependency_entry.refcount <= 0
+                    and now - dependency_entry.last_used > self.ttl
+                ):
+                    idle.append(dependency)
+        return evicted
+
+    def get(
+        self,
+        key: Hashable,
+        factory: Callable[[], Any],
+        dependencies: Sequence[Hashable] = (),
+    ) -> Any:
+        """
+        Return the embedding function saved under `key`. If it's not in the registry,
+        it'll be created by calling `factory`, and it'll hold a reference to the
+        (already registered) embedding functions under `dependencies` until it's evicted.
+        """
+        with self.__lock:
+            load_lock = self.__load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self.__lock:
+                now = time.monotonic()
+                evicted = self.__evict(now)
+                entry = self.__entries.get(key)
+                if entry is not None:
+                    entry.last_used = now
+            self.__close(evicted)
+            if entry is not None:
+                logger.debug(f"Reusing embedding function {key}.")
+                return entry.function
+            logger.info(f"Loading embedding function {key}.")
+            function = factory()
+            with self.__lock:
+                entry = self.__entries[key] = _Entry(
+                    function,
+                    last_used=time.monotonic(),
+                    dependencies=tuple(i for i in dependencies if i in self.__entries),
+                )
+                for dependency in entry.dependencies:
+                    self.__entries[dependency].refcount += 1
+                return function
+
+    def retain(self, key: Hashable):
+        """Add a reference to the embedding function under `key` (if it's registered)."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                entry.refcount += 1
+
+    def release(self, key: Hashable, last_used: Optional[float] = None):
+        """
+        Remove a reference that was added by `retain`. `last_used` is the (monotonic) time
+        when the holder of the reference last used the embedding function (default: now).
+        """
+        with self.__lock:
+            now = time.monotonic()
+            entry = self.__entries.get(key)
+            if entry is not None:
+                entry.refcount = max(entry.refcount - 1, 0)
+                entry.last_used = max(
+                    entry.last_used, now if last_used is None else last_used
+                )
+            evicted = self.__evict(now)
+        self.__close(evicted)
+
+    def refcount(self, key: Hashable) -> int:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return 0 if entry is None else entry.refcount
+
+    def lock_of(self, function: Any) -> contextlib.AbstractContextManager:
+        """
+        The lock that serialises the calls to a shared embedding function.
+        Some tokenizers can't be used by several threads at the same time.
+        Only the calls that take this lock (like `embed`) are serialised. Chromadb calls
+        the embedding function of a collection directly when it's given `query_texts`.
+        """
+        with self.__lock:
+            for entry in self.__entries.values():
+                if entry.function is function:
+                    return entry.lock
+        return contextlib.nullcontext()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.__lock:
+            return key in self.__entries
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__entries)
+
+    def clear(self):
+        """Close and remove all embedding functions, like when the process shuts down."""
+        with self.__lock:
+            functions = [i.function for i in self.__entries.values()]
+            self.__entries.clear()
+        self.__close(functions)
+
+
+embedding_function_registry = EmbeddingFunctionRegistry()
+
+
+def embed(embedding_function: Any, texts: Sequence[str]) -> Any:
+    """
+    Call a (possibly shared) embedding function in a thread-safe way.
+    Embedding functions that set `thread_safe = True` are called without the lock.
+    """
+    if getattr(embedding_function, "thread_safe", False) is True:
+        return embedding_function(texts)
+    with embedding_function_registry.lock_of(embedding_function):
+        return embedding_function(texts)
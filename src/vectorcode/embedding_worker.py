@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Optional
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from vectorcode.cli_utils import Config, config_logging
+
+logger = logging.getLogger(name=__name__)
+
+WORKER_SOCKET_PATH = os.path.join(
+    os.path.expanduser("~"), ".local", "share", "vectorcode", "embedding_worker.sock"
+)
+WORKER_IDLE_TIMEOUT = 600
+WORKER_CONNECT_TIMEOUT = 1.0
+WORKER_REQUEST_TIMEOUT = 120.0
+"""How long to wait for the embeddings (including the model loading in a new worker)."""
+
+
+def is_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+def spawn_worker(
+    socket_path: str = WORKER_SOCKET_PATH, idle_timeout: float = WORKER_IDLE_TIMEOUT
+):
+    """Start the embedding worker in the background. It outlives the current process."""
+    logger.info(f"Starting the embedding worker at {socket_path}.")
+    subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "vectorcode.embedding_worker",
+            "--socket",
+            socket_path,
+            "--idle-timeout",
+            str(idle_timeout),
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def request_embeddings(
+    socket_path: str,
+    embedding_function: str,
+    embedding_params: dict[str, Any],
+    texts: list[str],
+) -> list[list[float]]:
+    """
+    Send an embedding request to the worker at `socket_path`.
+    Raise OSError if the worker can't be reached (TimeoutError if it doesn't respond within
+    `WORKER_REQUEST_TIMEOUT`), or RuntimeError if it failed to embed the texts.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(WORKER_CONNECT_TIMEOUT)
+        sock.connect(socket_path)
+        # embedding a large batch may take a while, but a hung worker shouldn't block the caller.
+        sock.settimeout(WORKER_REQUEST_TIMEOUT)
+        with sock.makefile("rwb") as stream:
+            stream.write(
+                json.dumps(
+                    {
+                        "embedding_function": embedding_function,
+                        "embedding_params": embedding_params,
+                        "input": texts,
+                    },
+                    default=str,
+                ).encode()
+                + b"\n"
+            )
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise ConnectionError("The embedding worker closed the connection.")
+    response = json.loads(line)
+    if response.get("error") is not None:
+        raise RuntimeError(f"The embedding worker failed: {response['error']}")
+    return response["embeddings"]
+
+
+class WorkerEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Embeds the documents with the embedding worker, which keeps the model loaded between
+    CLI invocations. If the worker isn't running, it's started in the background and
+    the documents are embedded in this process (which is also used for the rest of its lifetime).
+    """
+
+    def __init__(self, configs: Config, socket_path: str = WORKER_SOCKET_PATH):
+        self.configs = dataclasses.replace(configs, embedding_worker=False)
+        self.socket_path = socket_path
+        self.__fallback: Optional[EmbeddingFunction] = None
+
+    def __get_fallback(self) -> EmbeddingFunction:
+        if self.__fallback is None:
+            from vectorcode.common import get_embedding_function
+
+            self.__fallback = get_embedding_function(self.configs)
+            assert self.__fallback is not None
+        return self.__fallback
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if self.__fallback is None:
+            try:
+                return request_embeddings(
+                    self.socket_path,
+                    self.configs.embedding_function,
+                    self.configs.embedding_params,
+                    list(input),
+                )
+            except (RuntimeError, TimeoutError) as e:
+                # the worker is running, so starting another one wouldn't help.
+                logger.warning(
+                    f"The embedding worker failed to embed the documents ({e}). Embedding in this process."
+                )
+            except (OSError, ValueError) as e:
+                logger.info(
+                    f"The embedding worker is not available ({e.__class__.__name__}). Embedding in this process."
+                )
+                try:
+                    spawn_worker(self.socket_path)
+                except OSError as e:  # pragma: nocover
+                    logger.warning(f"Failed to start the embedding worker: {e}")
+        from vectorcode.embedding_registry import embed
+
+        return embed(self.__get_fallback(), input)
+
+
+class EmbeddingWorker:
+    """
+    Serves embedding requests (one JSON object per line) on a Unix socket.
+    The embedding functions are shared through the embedding function registry,
+    and the worker shuts down after `idle_timeout` seconds without a request.
+    """
+
+    def __init__(self, socket_path: str, idle_timeout: float = WORKER_IDLE_TIMEOUT):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.last_request = time.monotonic()
+        self.num_active = 0
+
+    async def handle_request(self, request: dict[str, Any]) -> dict[str, Any]:
+        from vectorcode.common import get_embedding_function
+        from vectorcode.embedding_registry import embed
+
+        try:
+            configs = Config(
+                embedding_function=str(request["embedding_function"]),
+                embedding_params=dict(request.get("embedding_params") or {}),
+            )
+            embedding_function = get_embedding_function(configs)
+            assert embedding_function is not None
+            embeddings = await asyncio.to_thread(
+                embed, embedding_function, list(request["input"])
+            )
+            return {"embeddings": [[float(i) for i in row] for row in embeddings]}
+        except Exception as e:
+            logger.error(f"Failed to embed the documents: {e!r}")
+            return {"error": f"{e.__class__.__name__}: {e}"}
+
+    async def __handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self.num_active += 1
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except json.JSONDecodeError as e:
+                    response = {"error": f"Invalid request: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:  # pragma: nocover
+            pass
+        finally:
+            self.num_active -= 1
+            self.last_request = time.monotonic()
+            writer.close()
+
+    def __is_running(self) -> bool:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(WORKER_CONNECT_TIMEOUT)
+                sock.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+
+    async def serve(self) -> int:
+        if os.path.exists(self.socket_path):
+            if self.__is_running():
+                logger.info(
+                    f"An embedding worker is already running at {self.socket_path}."
+                )
+                return 0
+            # left behind by a worker that didn't shut down cleanly.
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        server = await asyncio.start_unix_server(
+            self.__handle_connection, path=self.socket_path
+        )
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"Embedding worker listening at {self.socket_path}.")
+        try:
+            async with server:
+                while (
+                    self.num_active > 0
+                    or time.monotonic() - self.last_request < self.idle_timeout
+                ):
+                    await asyncio.sleep(min(self.idle_timeout, 5))
+            logger.info("Shutting down the idle embedding worker.")
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        return 0
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(prog="vectorcode-embedding-worker")
+    parser.add_argument(
+        "--socket",
+        default=WORKER_SOCKET_PATH,
+        help="Path to the Unix socket.",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=WORKER_IDLE_TIMEOUT,
+        help="Shut down after this many seconds without a request.",
+    )
+    return parser
+
+
+def main():  # pragma: nocover
+    config_logging("vectorcode-embedding-worker", stdio=False)
+    args = get_arg_parser().parse_args()
+    return asyncio.run(EmbeddingWorker(args.socket, args.idle_timeout).serve())
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
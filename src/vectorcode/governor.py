@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+
+import psutil
+
+from vectorcode.cli_utils import Config
+
+logger = logging.getLogger(name=__name__)
+
+BACKGROUND_NICENESS = 10
+QUERY_POLL_INTERVAL = 0.05
+MAX_QUERY_PAUSE = 30.0
+
+
+def get_background_threads(configs: Config) -> int:
+    """
+    The number of threads that background indexing may use
+    (default: a quarter of the CPU cores).
+    """
+    return configs.background_threads or max(1, (os.cpu_count() or 1) // 4)
+
+
+def get_indexing_concurrency(configs: Config) -> int:
+    """The number of files that are chunked and embedded concurrently."""
+    if configs.background_indexing:
+        return get_background_threads(configs)
+    return os.cpu_count() or 1
+
+
+def limit_threads(num_threads: int):
+    """
+    Cap the thread pools of torch, the BLAS libraries and the (rust) tokenizers.
+    The environment variables only apply to libraries that haven't been loaded yet,
+    so torch is also capped directly if it's already imported.
+    """
+    for var in (
+        "OMP_NUM_THREADS",
+        "MKL_NUM_THREADS",
+        "OPENBLAS_NUM_THREADS",
+        "RAYON_NUM_THREADS",
+    ):
+        os.environ[var] = str(num_threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+
+
+def lower_priority():
+    """
+    Lower the CPU and IO priority of the current process,
+    like `nice -n 10 ionice -c 3` on Linux.
+    """
+    process = psutil.Process()
+    try:
+        if psutil.WINDOWS:  # pragma: nocover
+            process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            process.ionice(psutil.IOPRIO_LOW)
+        else:
+            process.nice(max(process.nice(), BACKGROUND_NICENESS))
+            if psutil.LINUX:
+                process.ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (psutil.Error, OSError) as e:  # pragma: nocover
+        logger.warning(f"Failed to lower the priority of the process: {e!r}")
+
+
+def apply_governor(configs: Config) -> bool:
+    """
+    Throttle the current process for background indexing if `configs.background_indexing`
+    is enabled, and return whether it was.
+    This changes the thread pools and the priority of the whole process for good, so it's
+    only for the CLI. The LSP and MCP servers would slow down their own queries with it;
+    they only limit the concurrency of the indexing and pause it for the queries.
+    """
+    if not configs.background_indexing:
+        return False
+    num_threads = get_background_threads(configs)
+    logger.info(f"Background indexing with {num_threads} thread(s).")
+    limit_threads(num_threads)
+    lower_priority()
+    return True
+
+
+class QueryTracker:
+    """
+    Counts the queries that are in flight in this process,
+    so that background indexing can step aside for them.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__count = 0
+        self.__idle = threading.Event()
+        self.__idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        with self.__lock:
+            return self.__count
+
+    @contextlib.contextmanager
+    def track(self):
+        with self.__lock:
+            self.__count += 1
+            self.__idle.clear()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__count -= 1
+                if self.__count == 0:
+                    self.__idle.set()
+
+    async def wait_until_idle(self, max_pause: float = MAX_QUERY_PAUSE) -> float:
+        """
+        Wait until no query is in flight, or for at most `max_pause` seconds so that
+        indexing can't be starved. Return the number of seconds that it waited.
+        """
+        # give the queries that are waiting on the event loop a chance to start first.
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        while not self.__idle.is_set() and time.perf_counter() - start < max_pause:
+            await asyncio.sleep(QUERY_POLL_INTERVAL)
+        return time.perf_counter() - start
+
+
+query_tracker = QueryTracker()
+
+
+async def yield_to_queries(configs: Config):
+    """Pause background indexing while a query is in flight."""
+    if not configs.background_indexing:
+        return
+    paused = await query_tracker.wait_until_idle()
+    if paused >= QUERY_POLL_INTERVAL:
+        logger.debug(f"Paused indexing for {paused:.2f}s for the queries.")
@@ -0,0 +1,154 @@
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Mapping, Optional, Sequence
+
+from vectorcode.cli_utils import Config
+from vectorcode.sqlite_index import SQLiteIndex, open_index
+
+logger = logging.getLogger(name=__name__)
+
+LEXICAL_INDEX_FILE = "lexical.sqlite3"
+
+
+@dataclass
+class LexicalHit:
+    id: str
+    path: str
+    document: str
+    score: float
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+
+def build_match_expression(query: str) -> str:
+    """
+    Convert a free-form query into a FTS5 MATCH expression.
+    Each whitespace-separated term becomes a quoted phrase so that identifiers
+    like `get_reranker` or `foo.bar` match their tokens in order,
+    and the terms are OR-ed so that BM25 ranks documents that contain more of them higher.
+    """
+    phrases = []
+    for term in query.split():
+        tokens = re.findall(r"[^\W_]+", term)
+        if tokens:
+            phrases.append(f'"{" ".join(tokens)}"')
+    return " OR ".join(phrases)
+
+
+class LexicalIndex(SQLiteIndex):
+    """
+    A BM25 full-text index over the chunks of a collection, backed by a SQLite FTS5 table.
+    Chunks are keyed by the same IDs as in the chromadb collection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chunk_meta (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            path TEXT NOT NULL,
+            start INTEGER,
+            end INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS chunk_meta_path ON chunk_meta(path);
+        CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text USING fts5(document);
+    """
+
+    def add(
+        self,
+        ids: Sequence[str],
+        documents: Sequence[str],
+        metadatas: Sequence[Mapping[str, Any]],
+    ):
+        assert len(ids) == len(documents) == len(metadatas), (
+            "ids, documents and metadatas should have the same length."
+        )
+        with self._lock, self._conn:
+            for chunk_id, document, meta in zip(ids, documents, metadatas):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunk_meta (id, path, start, end) VALUES (?, ?, ?, ?)",
+                    (chunk_id, meta["path"], meta.get("start"), meta.get("end")),
+                )
+                self._conn.execute(
+                    "INSERT INTO chunk_text (rowid, document) VALUES (?, ?)",
+                    (cursor.lastrowid, document),
+                )
+
+    def delete(self, paths: Iterable[str]):
+        with self._lock, self._conn:
+            for path in paths:
+                self._conn.execute(
+                    "DELETE FROM chunk_text WHERE rowid IN (SELECT rowid FROM chunk_meta WHERE path = ?)",
+                    (path,),
+                )
+                self._conn.execute("DELETE FROM chunk_meta WHERE path = ?", (path,))
+
+    def has_path(self, path: str) -> bool:
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM chunk_meta WHERE path = ? LIMIT 1", (path,)
+                ).fetchone()
+                is not None
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunk_meta").fetchone()[0]
+
+    def search(
+        self,
+        query: str,
+        n_results: int,
+        exclude_paths: Sequence[str] = (),
+        chunk_only: bool = False,
+    ) -> list[LexicalHit]:
+        """
+        Return at most `n_results` chunks ordered by decreasing BM25 relevance.
+        When `chunk_only` is True, the entries without line ranges (file names) are skipped.
+        """
+        match_expression = build_match_expression(query)
+        if not match_expression or n_results <= 0:
+            return []
+        sql = """
+            SELECT m.id, m.path, m.start, m.end, t.document, bm25(chunk_text)
+            FROM chunk_text AS t JOIN chunk_meta AS m ON m.rowid = t.rowid
+            WHERE chunk_text MATCH ?
+        """
+        params: list[Any] = [match_expression]
+        if exclude_paths:
+            sql += f" AND m.path NOT IN ({', '.join('?' for _ in exclude_paths)})"
+            params.extend(exclude_paths)
+        if chunk_only:
+            sql += " AND m.start IS NOT NULL"
+        sql += " ORDER BY bm25(chunk_text) LIMIT ?"
+        params.append(n_results)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        # sqlite's bm25() is negated so that smaller is better.
+        return [
+            LexicalHit(
+                id=row[0],
+                path=row[1],
+                start=row[2],
+                end=row[3],
+                document=row[4],
+                score=-float(row[5]),
+            )
+            for row in rows
+        ]
+
+
+def get_lexical_index(
+    configs: Config, make_if_missing: bool = False
+) -> Optional[LexicalIndex]:
+    """
+    Return the lexical index of the collection for `configs.project_root`.
+    Return None if `configs.lexical_index` is disabled,
+    or if the index doesn't exist and `make_if_missing` is False.
+    """
+    if not configs.lexical_index:
+        return None
+    return open_index(
+        configs, LEXICAL_INDEX_FILE, LexicalIndex, make_if_missing, "Lexical index"
+    )
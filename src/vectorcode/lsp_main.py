@@ -44,13 +44,30 @@ from vectorcode.cli_utils import (
     parse_cli_args,
 )
 from vectorcode.common import get_client, get_collection, try_server
+from vectorcode.embedding_batcher import make_embedding_batcher
+from vectorcode.embedding_registry import embedding_function_registry
+from vectorcode.governor import get_indexing_concurrency, query_tracker
+from vectorcode.reduction import calibrate_from_files
 from vectorcode.subcommands.ls import get_collection_list
-from vectorcode.subcommands.query import build_query_results
+from vectorcode.subcommands.query import (
+    build_query_results,
+    get_packed_results,
+    iter_packed_results,
+    iter_query_results,
+)
+from vectorcode.subcommands.query.projects import (
+    get_multi_project_results,
+    iter_multi_project_results,
+)
+from vectorcode.subcommands.query.reranker import warm_up_reranker
 
 cached_project_configs: dict[str, Config] = {}
 DEFAULT_PROJECT_ROOT: str | None = None
 logger = logging.getLogger(__name__)
 
+# the notification that carries each result of a `query --stream` command.
+QUERY_RESULT_NOTIFICATION = "vectorcode/queryResult"
+
 
 async def make_caches(project_root: str):
     assert os.path.isabs(project_root)
@@ -76,6 +93,12 @@ def get_arg_parser():
         type=str,
         default="",
     )
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        default=False,
+        help="Load the reranker model of the default project when the server starts.",
+    )
     shtab.add_argument_to(
         parser,
         ["-s", "--print-completion"],
@@ -139,20 +162,52 @@ async def execute_command(ls: LanguageServer, args: list[str]):
                     ),
                 )
                 final_results = []
-                try:
-                    assert collection is not None, (
-                        "Failed to find the correct collection."
-                    )
-                    final_results.extend(
-                        await build_query_results(collection, final_configs)
-                    )
-                finally:
-                    log_message = f"Retrieved {len(final_results)} result{'s' if len(final_results) > 1 else ''} in {round(time.time() - start_time, 2)}s."
-                    ls.progress.end(
-                        progress_token,
-                        types.WorkDoneProgressEnd(message=log_message),
-                    )
-                    logger.info(log_message)
+                num_results = 0
+                with query_tracker.track():
+                    try:
+                        is_multi_project = (
+                            final_configs.query_projects
+                            or final_configs.query_all_projects
+                        )
+                        if not is_multi_project:
+                            assert collection is not None, (
+                                "Failed to find the correct collection."
+                            )
+                        if final_configs.stream:
+                            # send each result in a notification as soon as it's
+                            # ready. the final response will be empty.
+                            if is_multi_project:
+                                results = iter_multi_project_results(final_configs)
+                            elif final_configs.char_budget > 0:
+                                results = iter_packed_results(collection, final_configs)
+                            else:
+                                results = iter_query_results(collection, final_configs)
+                            async for result in results:
+                                ls.send_notification(
+                                    QUERY_RESULT_NOTIFICATION,
+                                    {"token": progress_token, "result": result},
+                                )
+                                num_results += 1
+                        elif is_multi_project:
+                            final_results.extend(
+                                await get_multi_project_results(final_configs)
+                            )
+                        elif final_configs.char_budget > 0:
+                            final_results.extend(
+                                await get_packed_results(collection, final_configs)
+                            )
+                        else:
+                            final_results.extend(
+                                await build_query_results(collection, final_configs)
+                            )
+                        num_results = max(num_results, len(final_results))
+                    finally:
+                        log_message = f"Retrieved {num_results} result{'s' if num_results > 1 else ''} in {round(time.time() - start_time, 2)}s."
+                        ls.progress.end(
+                            progress_token,
+                            types.WorkDoneProgressEnd(message=log_message),
+                        )
+                        logger.info(log_message)
                 return final_results
             case CliAction.ls:
                 ls.progress.begin(
@@ -196,7 +251,11 @@ async def execute_command(ls: LanguageServer, args: list[str]):
                 collection_lock = asyncio.Lock()
                 stats_lock = asyncio.Lock()
                 max_batch_size = await client.get_max_batch_size()
-                semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+                semaphore = asyncio.Semaphore(get_indexing_concurrency(final_configs))
+                batcher = make_embedding_batcher(final_configs)
+                await calibrate_from_files(
+                    final_configs, [str(i) for i in files], collection
+                )
                 tasks = [
                     asyncio.create_task(
                         chunked_add(
@@ -208,6 +267,7 @@ async def execute_command(ls: LanguageServer, args: list[str]):
                             final_configs,
                             max_batch_size,
                             semaphore,
+                            batcher,
                         )
                     )
                     for file in files
@@ -222,7 +282,20 @@ async def execute_command(ls: LanguageServer, args: list[str]):
                         ),
                     )
 
-                await remove_orphanes(collection, collection_lock, stats, stats_lock)
+                for file in await remove_orphanes(
+                    collection, collection_lock, stats, stats_lock, final_configs
+                ):
+                    await chunked_add(
+                        file,
+                        collection,
+                        collection_lock,
+                        stats,
+                        stats_lock,
+                        final_configs,
+                        max_batch_size,
+                        semaphore,
+                        batcher,
+                    )
 
                 ls.progress.end(
                     progress_token,
@@ -264,9 +337,20 @@ async def lsp_start() -> int:
         logger.warning("DEFAULT_PROJECT_ROOT is empty.")
     else:
         logger.info(f"{DEFAULT_PROJECT_ROOT=}")
+        if args.warm_up:
+            cached_project_configs[DEFAULT_PROJECT_ROOT] = await get_project_config(
+                DEFAULT_PROJECT_ROOT
+            )
+            await asyncio.to_thread(
+                warm_up_reranker, cached_project_configs[DEFAULT_PROJECT_ROOT]
+            )
 
     logger.info("Parsed LSP server CLI arguments: %s", args)
-    await asyncio.to_thread(server.start_io)
+    try:
+        await asyncio.to_thread(server.start_io)
+    finally:
+        # stop the connections, threads and processes of the embedding functions.
+        embedding_function_registry.clear()
 
     return 0
 
@@ -12,6 +12,7 @@ from vectorcode.cli_utils import (
     get_project_config,
     parse_cli_args,
 )
+from vectorcode.embedding_registry import embedding_function_registry
 
 logger = logging.getLogger(name=__name__)
 
@@ -62,6 +63,10 @@ async def async_main():
             from vectorcode.subcommands import chunks
 
             return await chunks(final_configs)
+        case CliAction.prepare:
+            from vectorcode.subcommands import prepare
+
+            return await prepare(final_configs)
 
     from vectorcode.common import start_server, try_server
 
@@ -105,6 +110,7 @@ async def async_main():
         return_val = 1
         logger.error(traceback.format_exc())
     finally:
+        embedding_function_registry.clear()
         if server_process is not None:
             logger.info("Shutting down the bundled Chromadb instance.")
             server_process.terminate()
@@ -40,8 +40,20 @@ from vectorcode.cli_utils import (
     load_config_file,
 )
 from vectorcode.common import get_client, get_collection, get_collections
+from vectorcode.embedding_batcher import make_embedding_batcher
+from vectorcode.embedding_registry import embedding_function_registry
+from vectorcode.governor import get_indexing_concurrency, query_tracker
+from vectorcode.reduction import calibrate_from_files
 from vectorcode.subcommands.prompt import prompt_by_categories
-from vectorcode.subcommands.query import get_query_result_files
+from vectorcode.subcommands.query import (
+    blend_results,
+    get_exact_symbols,
+    get_packed_results,
+    get_query_result_files,
+    get_symbol_results,
+)
+from vectorcode.subcommands.query.projects import get_multi_project_results
+from vectorcode.subcommands.query.reranker import warm_up_reranker
 
 logger = logging.getLogger(name=__name__)
 
@@ -50,6 +62,7 @@ logger = logging.getLogger(name=__name__)
 class MCPConfig:
     n_results: int = 10
     ls_on_start: bool = False
+    warm_up: bool = False
 
 
 mcp_config = MCPConfig()
@@ -70,6 +83,12 @@ def get_arg_parser():
         default=False,
         help="Whether to include the output of `vectorcode ls` in the tool description.",
     )
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        default=False,
+        help="Load the reranker model of the current project when the server starts.",
+    )
     shtab.add_argument_to(
         parser,
         ["-s", "--print-completion"],
@@ -140,7 +159,9 @@ async def vectorise_files(paths: list[str], project_root: str) -> dict[str, int]
     collection_lock = asyncio.Lock()
     stats_lock = asyncio.Lock()
     max_batch_size = await client.get_max_batch_size()
-    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    semaphore = asyncio.Semaphore(get_indexing_concurrency(final_config))
+    batcher = make_embedding_batcher(final_config)
+    await calibrate_from_files(final_config, [str(i) for i in paths], collection)
     tasks = [
         asyncio.create_task(
             chunked_add(
@@ -152,6 +173,7 @@ async def vectorise_files(paths: list[str], project_root: str) -> dict[str, int]
                 final_config,
                 max_batch_size,
                 semaphore,
+                batcher,
             )
         )
         for file in paths
@@ -159,21 +181,40 @@ async def vectorise_files(paths: list[str], project_root: str) -> dict[str, int]
     for i, task in enumerate(asyncio.as_completed(tasks), start=1):
         await task
 
-    await remove_orphanes(collection, collection_lock, stats, stats_lock)
+    for file in await remove_orphanes(
+        collection, collection_lock, stats, stats_lock, final_config
+    ):
+        await chunked_add(
+            file,
+            collection,
+            collection_lock,
+            stats,
+            stats_lock,
+            final_config,
+            max_batch_size,
+            semaphore,
+            batcher,
+        )
 
     return stats.to_dict()
 
 
 async def query_tool(
-    n_query: int, query_messages: list[str], project_root: str
+    n_query: int,
+    query_messages: list[str],
+    project_root: str,
+    other_project_roots: Optional[list[str]] = None,
+    char_budget: Optional[int] = None,
 ) -> list[str]:
     """
     n_query: number of files to retrieve;
     query_messages: keywords to query.
     collection_path: Directory to the repository;
+    other_project_roots: Directories to other repositories to be queried together with `project_root`;
+    char_budget: Maximum number of characters of the retrieved content. Files that don't fit are replaced by their most relevant lines;
     """
     logger.info(
-        f"query tool called with the following args: {n_query=}, {query_messages=}, {project_root=}"
+        f"query tool called with the following args: {n_query=}, {query_messages=}, {project_root=}, {other_project_roots=}, {char_budget=}"
     )
     project_root = os.path.expanduser(project_root)
     if not os.path.isdir(project_root):
@@ -204,24 +245,65 @@ async def query_tool(
                 message=f"Failed to access the collection at {project_root}. Use `list_collections` tool to get a list of valid paths for this field.",
             )
         )
-    query_config = await config.merge_from(
-        Config(n_result=n_query, query=query_messages)
-    )
-    logger.info("Built the final config: %s", query_config)
-    result_paths = await get_query_result_files(
-        collection=collection,
-        configs=query_config,
-    )
-    results: list[str] = []
-    for path in result_paths:
-        if os.path.isfile(path):
-            with open(path) as fin:
-                rel_path = os.path.relpath(path, config.project_root)
-                results.append(
-                    f"<path>{rel_path}</path>\n<content>{fin.read()}</content>",
+    with query_tracker.track():
+        query_config = await config.merge_from(
+            Config(n_result=n_query, query=query_messages)
+        )
+        logger.info("Built the final config: %s", query_config)
+        if other_project_roots:
+            query_config.query_projects = [
+                os.path.expanduser(i) for i in other_project_roots
+            ]
+            project_results = await get_multi_project_results(query_config)
+            logger.info(
+                "Retrieved the following files: %s",
+                [(i["project"], i["path"]) for i in project_results],
+            )
+            return [
+                f"<project>{i['project']}</project>\n<path>{i['path']}</path>\n<content>{i['document']}</content>"
+                for i in project_results
+            ]
+        if char_budget is not None and char_budget > 0:
+            query_config.char_budget = char_budget
+            packed_results = await get_packed_results(collection, query_config)
+            logger.info(
+                "Packed the following results: %s",
+                [
+                    (i["path"], i.get("start_line"), i.get("end_line"))
+                    for i in packed_results
+                ],
+            )
+            return [
+                f"<path>{i['path']}</path>\n<content>{i['document']}</content>"
+                if "document" in i
+                else f"<path>{i['path']}</path>\n<lines>{i['start_line']}-{i['end_line']}</lines>\n<content>{i['chunk']}</content>"
+                for i in packed_results
+            ]
+        symbols = await get_symbol_results(query_config)
+        exact_symbols = get_exact_symbols(symbols, query_config)
+        result_paths = [i.path for i in exact_symbols]
+        if len(result_paths) < n_query:
+            # the prefix matches take turns with the vector search results.
+            result_paths.extend(
+                blend_results(
+                    await get_query_result_files(
+                        collection=collection,
+                        configs=query_config,
+                    ),
+                    [i.path for i in symbols if i not in exact_symbols],
                 )
-    logger.info("Retrieved the following files: %s", result_paths)
-    return results
+            )
+        result_paths = list(dict.fromkeys(result_paths))[:n_query]
+        results: list[str] = []
+        for path in result_paths:
+            if os.path.isfile(path):
+                with open(path) as fin:
+                    rel_path = os.path.relpath(path, config.project_root)
+                    results.append(
+                        f"<path>{rel_path}</path>\n<content>{fin.read()}</content>",
+                    )
+        logger.info("Retrieved the following files: %s", result_paths)
+        return results
 
 
 async def mcp_server():
@@ -241,6 +323,8 @@ async def mcp_server():
             logger.info("Collection initialised for %s.", project_root)
         except InvalidCollectionException:  # pragma: nocover
             default_collection = None
+        if mcp_config.warm_up:
+            await asyncio.to_thread(warm_up_reranker, default_config)
 
     default_instructions = "\n".join(
         "\n".join(i) for i in prompt_by_categories.values()
@@ -288,12 +372,20 @@ async def mcp_server():
 def parse_cli_args(args: Optional[list[str]] = None) -> MCPConfig:
     parser = get_arg_parser()
     parsed_args = parser.parse_args(args or sys.argv[1:])
-    return MCPConfig(n_results=parsed_args.number, ls_on_start=parsed_args.ls_on_start)
+    return MCPConfig(
+        n_results=parsed_args.number,
+        ls_on_start=parsed_args.ls_on_start,
+        warm_up=parsed_args.warm_up,
+    )
 
 
 async def run_server():  # pragma: nocover
     mcp = await mcp_server()
-    await mcp.run_stdio_async()
+    try:
+        await mcp.run_stdio_async()
+    finally:
+        # stop the connections, threads and processes of the embedding functions.
+        embedding_function_registry.clear()
     return 0
 
 
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(name=__name__)
+
+ARTIFACT_DIR = os.path.join(
+    os.path.expanduser("~"), ".local", "share", "vectorcode", "models"
+)
+ARTIFACT_MARKER = "vectorcode_artifact.json"
+
+SENTENCE_TRANSFORMER = "sentence_transformer"
+CROSS_ENCODER = "cross_encoder"
+ONNX_CROSS_ENCODER = "onnx_cross_encoder"
+
+# the default model of chromadb's `SentenceTransformerEmbeddingFunction`.
+DEFAULT_SENTENCE_TRANSFORMER = "all-MiniLM-L6-v2"
+
+
+def get_artifact_path(kind: str, model_name: str) -> str:
+    slug = re.sub(r"[^\w.-]+", "--", model_name).strip("-")
+    digest = hashlib.sha256(model_name.encode()).hexdigest()[:8]
+    return os.path.join(ARTIFACT_DIR, kind, f"{slug}-{digest}")
+
+
+def find_artifact(kind: str, model_name: str) -> Optional[str]:
+    """
+    Return the directory of the prepared artifact of a model, or None if it hasn't been
+    prepared (or the preparation didn't finish).
+    """
+    path = get_artifact_path(kind, model_name)
+    if os.path.isfile(os.path.join(path, ARTIFACT_MARKER)):
+        return path
+    return None
+
+
+def prepare_artifact(
+    kind: str, model_name: str, save: Callable[[str], None], force: bool = False
+) -> str:
+    """
+    Call `save` with a temporary directory that should be populated with the artifact
+    of the model, and move it into place when it's finished.
+    The existing artifact is kept unless `force` is True.
+    """
+    path = get_artifact_path(kind, model_name)
+    if not force and find_artifact(kind, model_name) is not None:
+        logger.info(f"{model_name} has already been prepared at {path}.")
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(path))
+    try:
+        save(tmp_dir)
+        with open(os.path.join(tmp_dir, ARTIFACT_MARKER), "w") as fout:
+            json.dump({"kind": kind, "model_name": model_name}, fout)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_dir, path)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return path
+
+
+def prepare_sentence_transformer(
+    model_name: str, force: bool = False, trust_remote_code: bool = False
+) -> str:
+    """Save a `SentenceTransformer` model with its weights in safetensors."""
+
+    def save(path: str):
+        from sentence_transformers import SentenceTransformer
+
+        SentenceTransformer(
+            model_name, device="cpu", trust_remote_code=trust_remote_code
+        ).save(path, safe_serialization=True)
+
+    return prepare_artifact(SENTENCE_TRANSFORMER, model_name, save, force)
+
+
+def prepare_cross_encoder(
+    model_name: str, force: bool = False, trust_remote_code: bool = False
+) -> str:
+    """Save a `CrossEncoder` model with its weights in safetensors."""
+
+    def save(path: str):
+        from sentence_transformers import CrossEncoder
+
+        CrossEncoder(
+            model_name, device="cpu", trust_remote_code=trust_remote_code
+        ).save(path, safe_serialization=True)
+
+    return prepare_artifact(CROSS_ENCODER, model_name, save, force)
+
+
+def get_onnx_artifact_name(model_name: str, file_name: str) -> str:
+    return f"{model_name}:{file_name}"
+
+
+def prepare_onnx_cross_encoder(
+    model_name: str, file_name: str, force: bool = False
+) -> str:
+    """Save the ONNX graph `file_name` of a cross-encoder with its tokenizer."""
+
+    def save(path: str):
+        from transformers import AutoTokenizer
+
+        if os.path.isdir(model_name):
+            source = os.path.join(model_name, file_name)
+        else:
+            from huggingface_hub import hf_hub_download
+
+            source = hf_hub_download(model_name, file_name)
+        destination = os.path.join(path, file_name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(path)
+
+    return prepare_artifact(
+        ONNX_CROSS_ENCODER,
+        get_onnx_artifact_name(model_name, file_name),
+        save,
+        force,
+    )
+
+
+def resolve_embedding_params(
+    embedding_function: str, embedding_params: dict[str, Any]
+) -> dict[str, Any]:
+    """
+    Point the embedding function to the prepared artifact of its model, if any.
+    """
+    if embedding_function != "SentenceTransformerEmbeddingFunction":
+        return embedding_params
+    model_name = str(embedding_params.get("model_name", DEFAULT_SENTENCE_TRANSFORMER))
+    path = find_artifact(SENTENCE_TRANSFORMER, model_name)
+    if path is None:
+        return embedding_params
+    logger.info(f"Loading {model_name} from {path}.")
+    return {**embedding_params, "model_name": path}
@@ -0,0 +1,314 @@
+import asyncio
+import dataclasses
+import hashlib
+import logging
+import os
+import random
+from typing import Any, Optional, Sequence
+
+import numpy
+from chromadb.api.models.AsyncCollection import AsyncCollection
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from vectorcode.cli_utils import Config, expand_path
+from vectorcode.embedding_registry import embed
+
+logger = logging.getLogger(name=__name__)
+
+PROJECTION_FILE = "projection.npz"
+PROJECTION_DIGEST_KEY = "embedding_projection"
+SUPPORTED_REDUCTIONS = ("truncate", "pca")
+CALIBRATION_SAMPLE_SIZE = 2048
+RECALL_K = 10
+
+
+class ProjectionMissingError(RuntimeError):
+    pass
+
+
+def normalize(vectors: numpy.ndarray) -> numpy.ndarray:
+    norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / numpy.where(norms == 0, 1, norms)
+
+
+def truncate(embeddings: numpy.ndarray, dimensions: int) -> numpy.ndarray:
+    """
+    [Matryoshka](https://arxiv.org/abs/2205.13147)-style truncation: keep the first `dimensions` dimensions
+    and re-normalise. This only works well for models that were trained for it.
+    """
+    return normalize(numpy.asarray(embeddings, dtype=numpy.float32)[:, :dimensions])
+
+
+@dataclasses.dataclass
+class Calibration:
+    """
+    The result of calibrating the dimensionality reduction for an embedding model:
+    the PCA projection (if any), and the recall of the reduced embeddings.
+    """
+
+    recall: float
+    mean: Optional[numpy.ndarray] = None
+    components: Optional[numpy.ndarray] = None
+
+    def transform(self, embeddings: numpy.ndarray) -> numpy.ndarray:
+        assert self.mean is not None and self.components is not None
+        return normalize(
+            (numpy.asarray(embeddings, dtype=numpy.float32) - self.mean)
+            @ self.components.T
+        )
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays: dict[str, Any] = {"recall": numpy.float32(self.recall)}
+        if self.mean is not None and self.components is not None:
+            arrays["mean"] = self.mean
+            arrays["components"] = self.components
+        with open(path, "wb") as fout:
+            numpy.savez(fout, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Calibration":
+        with numpy.load(path) as data:
+            return cls(
+                recall=float(data["recall"]),
+                mean=data["mean"] if "mean" in data else None,
+                components=data["components"] if "components" in data else None,
+            )
+
+
+def fit_pca(embeddings: numpy.ndarray, dimensions: int) -> Calibration:
+    """
+    Fit a PCA projection to `dimensions` dimensions. If there are fewer samples than
+    dimensions, the missing components are zeros so that the output size is still `dimensions`.
+    """
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float32)
+    mean = embeddings.mean(axis=0)
+    _, _, vt = numpy.linalg.svd(embeddings - mean, full_matrices=False)
+    components = numpy.zeros((dimensions, embeddings.shape[1]), dtype=numpy.float32)
+    num_components = min(dimensions, vt.shape[0])
+    if num_components < dimensions:
+        logger.warning(
+            f"Only {num_components} principal components can be fitted from {len(embeddings)} samples."
+        )
+    components[:num_components] = vt[:num_components]
+    return Calibration(recall=1.0, mean=mean, components=components)
+
+
+def measure_recall(
+    full: numpy.ndarray,
+    reduced: numpy.ndarray,
+    k: int = RECALL_K,
+    num_queries: int = 100,
+) -> float:
+    """
+    The mean recall@k of the nearest neighbours (by cosine similarity) in the reduced
+    space, using the nearest neighbours in the full space as the ground truth.
+    The first `num_queries` vectors are used as the queries.
+    """
+    num_queries = min(num_queries, len(full))
+    k = min(k, len(full) - 1)
+    if num_queries == 0 or k <= 0:
+        return 1.0
+    full = normalize(numpy.asarray(full, dtype=numpy.float32))
+    reduced = normalize(numpy.asarray(reduced, dtype=numpy.float32))
+    hits = 0
+    for scores_full, scores_reduced, i in zip(
+        full[:num_queries] @ full.T,
+        reduced[:num_queries] @ reduced.T,
+        range(num_queries),
+    ):
+        # a vector is not its own neighbour.
+        scores_full[i] = scores_reduced[i] = -numpy.inf
+        expected = set(numpy.argpartition(-scores_full, k - 1)[:k].tolist())
+        actual = set(numpy.argpartition(-scores_reduced, k - 1)[:k].tolist())
+        hits += len(expected & actual)
+    return hits / (num_queries * k)
+
+
+def get_base_configs(configs: Config) -> Config:
+    """The configs of the embedding function that produces the full embeddings."""
+    return dataclasses.replace(configs, embedding_dimensions=0)
+
+
+def get_calibration_path(configs: Config) -> Optional[str]:
+    """
+    The projection is saved with the local indices of the collection of `configs.project_root`,
+    so that it's removed together with the collection.
+    Return None if there's no project root.
+    """
+    if configs.project_root is None:
+        return None
+    from vectorcode.common import get_collection_name, get_index_dir
+
+    collection_name = get_collection_name(
+        str(expand_path(str(configs.project_root), absolute=True))
+    )
+    return os.path.join(get_index_dir(collection_name), PROJECTION_FILE)
+
+
+def get_calibration_digest(path: Optional[str]) -> Optional[str]:
+    """The digest of a saved projection, or None if it doesn't exist."""
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as fin:
+        return hashlib.sha256(fin.read()).hexdigest()[:32]
+
+
+class ReducedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Reduces the embeddings of `base_function` to `configs.embedding_dimensions` dimensions,
+    either by truncation or with a PCA projection that was fitted by `calibrate`.
+    The same reduction applies to the documents and the queries.
+    """
+
+    def __init__(self, configs: Config, base_function: Any):
+        if configs.embedding_reduction not in SUPPORTED_REDUCTIONS:
+            raise ValueError(
+                f"Unsupported embedding_reduction: {configs.embedding_reduction}. Supported: {list(SUPPORTED_REDUCTIONS)}"
+            )
+        self.base_function = base_function
+        self.dimensions = configs.embedding_dimensions
+        self.reduction = configs.embedding_reduction
+        self.calibration_path = get_calibration_path(configs)
+        self.__calibration: Optional[Calibration] = None
+        self.__calibration_mtime: Optional[int] = None
+
+    def __get_mtime(self) -> Optional[int]:
+        if self.calibration_path is None or not os.path.isfile(self.calibration_path):
+            return None
+        return os.stat(self.calibration_path).st_mtime_ns
+
+    @property
+    def calibration(self) -> Optional[Calibration]:
+        if self.calibration_path is None:
+            return self.__calibration
+        mtime = self.__get_mtime()
+        if mtime != self.__calibration_mtime:
+            # (re)load the projection if it was replaced or removed with the collection.
+            self.__calibration = (
+                None if mtime is None else Calibration.load(self.calibration_path)
+            )
+            self.__calibration_mtime = mtime
+        return self.__calibration
+
+    @calibration.setter
+    def calibration(self, value: Calibration):
+        if self.calibration_path is not None:
+            value.save(self.calibration_path)
+        self.__calibration = value
+        self.__calibration_mtime = self.__get_mtime()
+
+    def reduce(self, embeddings: Any) -> numpy.ndarray:
+        full = numpy.asarray(embeddings, dtype=numpy.float32)
+        if self.reduction == "truncate":
+            return truncate(full, self.dimensions)
+        calibration = self.calibration
+        if calibration is None or calibration.components is None:
+            raise ProjectionMissingError(
+                "The PCA projection hasn't been fitted. Please vectorise a project first."
+            )
+        return calibration.transform(full)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if not input:
+            return []
+        return list(self.reduce(embed(self.base_function, input)))
+
+
+async def calibrate(
+    embedding_function: ReducedEmbeddingFunction, documents: Sequence[str]
+) -> Optional[float]:
+    """
+    Set up the dimensionality reduction with a sample of `documents` (fit the PCA projection),
+    save it (if the embedding function belongs to a project), and return the recall of the reduced embeddings.
+    Return None if it was already calibrated or there are no documents.
+    """
+    if embedding_function.calibration is not None or not documents:
+        return None
+    sample = list(documents)
+    if len(sample) > CALIBRATION_SAMPLE_SIZE:
+        sample = random.Random(0).sample(sample, CALIBRATION_SAMPLE_SIZE)
+    logger.info(f"Calibrating the dimensionality reduction with {len(sample)} chunks.")
+    full = numpy.asarray(
+        await asyncio.to_thread(embed, embedding_function.base_function, sample),
+        dtype=numpy.float32,
+    )
+    if embedding_function.reduction == "pca":
+        calibration = fit_pca(full, embedding_function.dimensions)
+        reduced = calibration.transform(full)
+    else:
+        calibration = Calibration(recall=1.0)
+        reduced = truncate(full, embedding_function.dimensions)
+    calibration.recall = measure_recall(full, reduced)
+    embedding_function.calibration = calibration
+    logger.info(
+        f"Recall@{RECALL_K} of the {embedding_function.dimensions}-dimensional embeddings: {calibration.recall:.3f}"
+    )
+    return calibration.recall
+
+
+def sample_chunks(
+    configs: Config, files: Sequence[str], max_chunks: int = CALIBRATION_SAMPLE_SIZE
+) -> list[str]:
+    """Chunk randomly picked files until there are `max_chunks` chunks."""
+    from vectorcode.chunking import TreeSitterChunker
+
+    chunker = TreeSitterChunker(configs)
+    documents: list[str] = []
+    for path in random.Random(0).sample(list(files), len(files)):
+        try:
+            documents.extend(
+                str(i) for i in chunker.chunk(str(expand_path(path, True)))
+            )
+        except Exception as e:  # pragma: nocover
+            logger.debug(f"Skipping {path} for calibration: {e!r}")
+        if len(documents) >= max_chunks:
+            break
+    return documents[:max_chunks]
+
+
+async def save_projection_digest(
+    collection: AsyncCollection, embedding_function: ReducedEmbeddingFunction
+):
+    """
+    Record the digest of the PCA projection in the metadata of the collection (if it
+    isn't there yet), so that `verify_ef` can tell when the projection was replaced.
+    """
+    calibration = embedding_function.calibration
+    if calibration is None or calibration.components is None:
+        return
+    digest = get_calibration_digest(embedding_function.calibration_path)
+    if digest is None or collection.metadata.get(PROJECTION_DIGEST_KEY) is not None:
+        return
+    # the metadata is replaced as a whole, so the other keys (including the HNSW
+    # settings) are kept. `collection.modify` refuses any metadata with `hnsw:space`,
+    # even if it doesn't change, so the metadata is written by the client directly.
+    metadata = {**collection.metadata, PROJECTION_DIGEST_KEY: digest}
+    await collection._client._modify(id=collection.id, new_metadata=metadata)
+    collection._update_model_after_modify_success(None, metadata)
+
+
+async def calibrate_from_files(
+    configs: Config,
+    files: Sequence[str],
+    collection: Optional[AsyncCollection] = None,
+) -> Optional[float]:
+    """
+    Calibrate the dimensionality reduction in `configs` (if enabled and not calibrated yet)
+    with the chunks of some of the `files`, and return the recall of the reduced embeddings.
+    The digest of the projection is recorded in the metadata of `collection`.
+    """
+    if configs.embedding_dimensions <= 0 or not files:
+        return None
+    from vectorcode.common import get_embedding_function
+
+    embedding_function = get_embedding_function(configs)
+    if not isinstance(embedding_function, ReducedEmbeddingFunction):
+        return None
+    recall = None
+    if embedding_function.calibration is None:
+        documents = await asyncio.to_thread(sample_chunks, configs, files)
+        recall = await calibrate(embedding_function, documents)
+    if collection is not None:
+        await save_projection_digest(collection, embedding_function)
+    return recall
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Optional, Sequence
+
+import httpx
+import numpy
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+logger = logging.getLogger(name=__name__)
+
+SUPPORTED_API_TYPES = ("openai", "ollama")
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class RemoteEmbeddingError(Exception):
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse the `Retry-After` header (in seconds). HTTP dates are not supported."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class RemoteEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Embeds the documents with a remote embedding API
+    (an OpenAI-compatible `/embeddings` endpoint or Ollama's `/api/embed`).
+    The documents are split into batches of `batch_size`, and up to `max_concurrency`
+    requests are sent at the same time over a pool of keep-alive connections, so that
+    the throughput isn't bounded by the round-trip time of a single request.
+    Failed requests (connection errors, 429 and 5xx) are retried with jittered exponential backoff.
+    When the server asks to slow down (429 with `Retry-After`), all requests wait for the cooldown.
+
+    The requests run on an event loop in a background thread, so the embedding function
+    can be called by Chromadb (or the embedding batcher) from any thread.
+    """
+
+    thread_safe = True
+
+    def __init__(
+        self,
+        url: str = "http://127.0.0.1:11434/v1",
+        model_name: str = "nomic-embed-text",
+        api_type: str = "openai",
+        api_key: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        batch_size: int = 64,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        timeout: float = 60,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30,
+        extra_body: Optional[dict[str, Any]] = None,
+    ):
+        if api_type not in SUPPORTED_API_TYPES:
+            raise ValueError(
+                f"Unsupported api_type: {api_type}. Supported: {list(SUPPORTED_API_TYPES)}"
+            )
+        assert batch_size > 0, "'batch_size' should be a positive integer."
+        assert max_concurrency > 0, "'max_concurrency' should be a positive integer."
+        self.url = url.rstrip("/")
+        self.model_name = model_name
+        self.api_type = api_type
+        if api_key is None and api_key_env is not None:
+            api_key = os.environ.get(api_key_env)
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.extra_body = dict(extra_body or {})
+
+        self.__lock = threading.Lock()
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__client: Optional[httpx.AsyncClient] = None
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+        self.__cooldown_until = 0.0
+
+    @property
+    def endpoint(self) -> str:
+        if self.api_type == "ollama":
+            return f"{self.url}/api/embed"
+        return f"{self.url}/embeddings"
+
+    def __get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.__lock:
+            if self.__loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever,
+                    name="vectorcode-remote-embedding",
+                    daemon=True,
+                ).start()
+                self.__loop = loop
+            return self.__loop
+
+    def __get_client(self) -> httpx.AsyncClient:
+        # only accessed from the background loop.
+        if self.__client is None:
+            headers = {}
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+            self.__client = httpx.AsyncClient(
+                headers=headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.__client
+
+    def __make_body(self, texts: Sequence[str]) -> dict[str, Any]:
+        return {"model": self.model_name, "input": list(texts), **self.extra_body}
+
+    def __parse_response(self, data: dict[str, Any], num_texts: int) -> list[Any]:
+        if self.api_type == "ollama":
+            embeddings = data.get("embeddings")
+        else:
+            items = sorted(data.get("data") or [], key=lambda x: x.get("index", 0))
+            embeddings = [i.get("embedding") for i in items]
+        if not isinstance(embeddings, list) or len(embeddings) != num_texts:
+            raise RemoteEmbeddingError(
+                f"Expected {num_texts} embeddings from {self.endpoint}, got an invalid response."
+            )
+        return embeddings
+
+    async def __post_batch(self, texts: Sequence[str]) -> list[Any]:
+        client = self.__get_client()
+        assert self.__semaphore is not None
+        attempt = 0
+        while True:
+            cooldown = self.__cooldown_until - time.monotonic()
+            if cooldown > 0:
+                await asyncio.sleep(cooldown)
+            retry_after: Optional[float] = None
+            async with self.__semaphore:
+                try:
+                    response = await client.post(
+                        self.endpoint, json=self.__make_body(texts)
+                    )
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        response.raise_for_status()
+                        return self.__parse_response(response.json(), len(texts))
+                    error: Exception = RemoteEmbeddingError(
+                        f"{self.endpoint} responded with {response.status_code}."
+                    )
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                except httpx.TransportError as e:
+                    error = e
+                except httpx.HTTPStatusError as e:
+                    raise RemoteEmbeddingError(
+                        f"{self.endpoint} responded with {e.response.status_code}: {e.response.text}"
+                    ) from e
+            if attempt >= self.max_retries:
+                raise error
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+            if retry_after is not None:
+                # rate-limited: the other requests wait for the cooldown too.
+                delay = max(delay, retry_after)
+                self.__cooldown_until = max(
+                    self.__cooldown_until, time.monotonic() + delay
+                )
+            logger.warning(
+                f"Embedding request failed ({error}). Retrying in {delay:.2f} seconds."
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def __embed(self, texts: Sequence[str]) -> list[Any]:
+        batches = [
+            texts[i : i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        results = await asyncio.gather(*(self.__post_batch(i) for i in batches))
+        return [embedding for batch in results for embedding in batch]
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if not input:
+            return []
+        embeddings = asyncio.run_coroutine_threadsafe(
+            self.__embed(list(input)), self.__get_loop()
+        ).result()
+        return [numpy.asarray(i, dtype=numpy.float32) for i in embeddings]
+
+    def close(self):
+        """Close the connections and stop the background event loop."""
+        with self.__lock:
+            loop, self.__loop = self.__loop, None
+        if loop is None:
+            return
+        if self.__client is not None:
+            asyncio.run_coroutine_threadsafe(self.__client.aclose(), loop).result()
+            self.__client = None
+        loop.call_soon_threadsafe(loop.stop)
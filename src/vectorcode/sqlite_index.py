@@ -0,0 +1,71 @@
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable, Optional, TypeVar, cast
+
+from vectorcode.cli_utils import Config, expand_path
+from vectorcode.common import get_collection_name, get_index_dir
+
+logger = logging.getLogger(name=__name__)
+
+
+class SQLiteIndex:
+    """
+    The base class of the local indices of a collection that are stored in SQLite
+    databases under `get_index_dir`. `SCHEMA` is executed when the database is opened.
+    The connection is shared by the threads of the process, so it should only be used
+    while holding `_lock`.
+    """
+
+    SCHEMA: str = ""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+T = TypeVar("T", bound=SQLiteIndex)
+
+__INDEX_CACHE: dict[str, SQLiteIndex] = {}
+
+
+def open_index(
+    configs: Config,
+    file_name: str,
+    factory: Callable[[str], T],
+    make_if_missing: bool = False,
+    description: str = "Index",
+) -> Optional[T]:
+    """
+    Return the (cached) index that is stored in `file_name` for the collection
+    of `configs.project_root`, or None if it doesn't exist and `make_if_missing` is False.
+    """
+    assert configs.project_root is not None
+    collection_name = get_collection_name(
+        str(expand_path(str(configs.project_root), absolute=True))
+    )
+    db_path = os.path.join(get_index_dir(collection_name, make_if_missing), file_name)
+    if __INDEX_CACHE.get(db_path) is None:
+        if not make_if_missing and not os.path.isfile(db_path):
+            logger.warning(
+                f"{description} for {configs.project_root} doesn't exist. Please re-vectorise the project."
+            )
+            return None
+        logger.debug(f"Opening {description.lower()} at {db_path}.")
+        __INDEX_CACHE[db_path] = factory(db_path)
+    return cast(T, __INDEX_CACHE[db_path])
+
+
+def close_indices(collection_name: str):
+    """Close the cached indices of a collection (if any) before their files are removed."""
+    index_dir = get_index_dir(collection_name)
+    for db_path in [i for i in __INDEX_CACHE if os.path.dirname(i) == index_dir]:
+        __INDEX_CACHE.pop(db_path).close()
@@ -4,6 +4,7 @@ from vectorcode.subcommands.clean import clean
 from vectorcode.subcommands.drop import drop
 from vectorcode.subcommands.init import init
 from vectorcode.subcommands.ls import ls
+from vectorcode.subcommands.prepare import prepare
 from vectorcode.subcommands.prompt import prompts
 from vectorcode.subcommands.query import query
 from vectorcode.subcommands.update import update
@@ -16,6 +17,7 @@ __all__ = [
     "drop",
     "init",
     "ls",
+    "prepare",
     "prompts",
     "query",
     "update",
@@ -4,7 +4,13 @@ import os
 from chromadb.api import AsyncClientAPI
 
 from vectorcode.cli_utils import Config
-from vectorcode.common import get_client, get_collections
+from vectorcode.common import (
+    evict_collection,
+    get_client,
+    get_collections,
+    remove_index_dir,
+)
+from vectorcode.sqlite_index import close_indices
 
 logger = logging.getLogger(name=__name__)
 
@@ -15,6 +21,9 @@ async def run_clean_on_client(client: AsyncClientAPI, pipe_mode: bool):
         logger.debug(f"{meta.get('path')}: {await collection.count()} chunk(s)")
         if await collection.count() == 0 or not os.path.isdir(meta["path"]):
             await client.delete_collection(collection.name)
+            evict_collection(meta["path"])
+            close_indices(collection.name)
+            remove_index_dir(collection.name)
             logger.info(f"Deleted collection for {meta['path']}")
             if not pipe_mode:
                 print(f"Deleted {meta['path']}.")
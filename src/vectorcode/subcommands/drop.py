@@ -3,7 +3,13 @@ import logging
 from chromadb.errors import InvalidCollectionException
 
 from vectorcode.cli_utils import Config
-from vectorcode.common import get_client, get_collection
+from vectorcode.common import (
+    evict_collection,
+    get_client,
+    get_collection,
+    remove_index_dir,
+)
+from vectorcode.sqlite_index import close_indices
 
 logger = logging.getLogger(name=__name__)
 
@@ -14,6 +20,9 @@ async def drop(config: Config) -> int:
         collection = await get_collection(client, config)
         collection_path = collection.metadata["path"]
         await client.delete_collection(collection.name)
+        evict_collection(collection_path)
+        close_indices(collection.name)
+        remove_index_dir(collection.name)
         print(f"Collection for {collection_path} has been deleted.")
         logger.info(f"Deteted collection at {collection_path}.")
         return 0
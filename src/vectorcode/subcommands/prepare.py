@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+import sys
+
+from vectorcode.cli_utils import Config
+from vectorcode.model_artifacts import (
+    DEFAULT_SENTENCE_TRANSFORMER,
+    prepare_cross_encoder,
+    prepare_onnx_cross_encoder,
+    prepare_sentence_transformer,
+)
+from vectorcode.subcommands.query.reranker import (
+    CascadeReranker,
+    CrossEncoderReranker,
+    OnnxCrossEncoderReranker,
+    RerankerError,
+    get_reranker_class,
+)
+from vectorcode.subcommands.query.reranker.onnx_cross_encoder import (
+    DEFAULT_ONNX_FILE,
+)
+
+logger = logging.getLogger(name=__name__)
+
+
+async def prepare_embedding_model(configs: Config) -> str | None:
+    if configs.embedding_function != "SentenceTransformerEmbeddingFunction":
+        logger.info(f"{configs.embedding_function} doesn't have a local model.")
+        return None
+    params = configs.embedding_params
+    return await asyncio.to_thread(
+        prepare_sentence_transformer,
+        str(params.get("model_name", DEFAULT_SENTENCE_TRANSFORMER)),
+        configs.force,
+        bool(params.get("trust_remote_code", False)),
+    )
+
+
+async def prepare_reranker_model(configs: Config) -> str | None:
+    if not configs.reranker:
+        return None
+    try:
+        reranker_class = get_reranker_class(configs)
+    except RerankerError:
+        logger.warning(f"Unknown reranker: {configs.reranker}")
+        return None
+    params = configs.reranker_params
+    model_name = str(
+        params.get("model_name_or_path", CrossEncoderReranker.default_model)
+    )
+    if issubclass(reranker_class, OnnxCrossEncoderReranker):
+        return await asyncio.to_thread(
+            prepare_onnx_cross_encoder,
+            model_name,
+            str(params.get("file_name", DEFAULT_ONNX_FILE)),
+            configs.force,
+        )
+    if issubclass(reranker_class, (CrossEncoderReranker, CascadeReranker)):
+        return await asyncio.to_thread(
+            prepare_cross_encoder,
+            model_name,
+            configs.force,
+            bool(params.get("trust_remote_code", False)),
+        )
+    logger.info(f"{configs.reranker} doesn't have a local model.")
+    return None
+
+
+async def prepare(configs: Config) -> int:
+    """
+    Save load-optimised copies of the embedding model and the reranker model
+    (safetensors weights, or the ONNX graph of `OnnxCrossEncoderReranker`)
+    that are loaded instead of the Hugging Face cache.
+    """
+    result = {
+        "embedding_function": await prepare_embedding_model(configs),
+        "reranker": await prepare_reranker_model(configs),
+    }
+    if configs.pipe:
+        print(json.dumps(result))
+    else:
+        for name, path in result.items():
+            if path is None:
+                print(f"Skipped {name}: no local model to prepare.", file=sys.stderr)
+            else:
+                print(f"Prepared {name} at {path}")
+    return 0
@@ -1,14 +1,17 @@
+import asyncio
+import contextlib
 import json
 import logging
 import os
-from typing import Any, cast
+from typing import Any, AsyncGenerator, Optional, Sequence, TypeVar, cast
 
-from chromadb import GetResult, Where
+from chromadb import GetResult, QueryResult, Where
 from chromadb.api.models.AsyncCollection import AsyncCollection
 from chromadb.api.types import IncludeEnum
 from chromadb.errors import InvalidCollectionException, InvalidDimensionException
 
-from vectorcode.chunking import StringChunker
+from vectorcode.centroids import get_centroid_index
+from vectorcode.chunking import StringChunker, Symbol
 from vectorcode.cli_utils import (
     Config,
     QueryInclude,
@@ -19,25 +22,190 @@ from vectorcode.cli_utils import (
 from vectorcode.common import (
     get_client,
     get_collection,
+    get_embedding_function,
     verify_ef,
 )
+from vectorcode.dedup import DedupIndex, DuplicateReference, get_dedup_index
+from vectorcode.embedding_registry import embed
+from vectorcode.lexical import LexicalHit, get_lexical_index
+from vectorcode.subcommands.query.packing import (
+    Span,
+    get_chunk_spans,
+    get_file_spans,
+    pack_results,
+    read_lines,
+)
 from vectorcode.subcommands.query.reranker import (
+    RerankerBase,
     RerankerError,
     get_reranker,
+    partial_rerank,
+    require_embeddings,
 )
+from vectorcode.symbols import get_symbol_index, get_symbol_name
 
 logger = logging.getLogger(name=__name__)
 
+T = TypeVar("T")
 
-async def get_query_result_files(
-    collection: AsyncCollection, configs: Config
-) -> list[str]:
-    query_chunks = []
+
+def merge_lexical_hits(
+    results: QueryResult, lexical_hits: Sequence[Sequence[LexicalHit]]
+) -> QueryResult:
+    """
+    Append the lexical hits that the vector search missed to `results` so that
+    they can be scored by the reranker. The rank of each entry in the vector search and in the
+    lexical search are saved in `results["vector_ranks"]` and `results["lexical_ranks"]`
+    (`None` if the entry was not returned by that search).
+    Lexical-only entries take the largest distance of their query so that
+    distance-based rerankers put them behind the vector hits.
+    """
+    assert results["metadatas"] is not None
+    assert results["documents"] is not None
+    assert results["distances"] is not None
+    merged = cast(dict[str, Any], results)
+    merged["vector_ranks"] = []
+    merged["lexical_ranks"] = []
+    for query_idx, hits in enumerate(lexical_hits):
+        ids = results["ids"][query_idx]
+        distances = results["distances"][query_idx]
+        vector_ranks: list[int | None] = list(range(len(ids)))
+        lexical_ranks: list[int | None] = [None] * len(ids)
+        positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        fallback_distance = max(distances, default=0.0)
+        for rank, hit in enumerate(hits):
+            if hit.id in positions:
+                lexical_ranks[positions[hit.id]] = rank
+                continue
+            meta: dict[str, str | int] = {"path": hit.path}
+            if hit.start is not None and hit.end is not None:
+                meta["start"] = hit.start
+                meta["end"] = hit.end
+            ids.append(hit.id)
+            results["metadatas"][query_idx].append(meta)
+            results["documents"][query_idx].append(hit.document)
+            distances.append(fallback_distance)
+            vector_ranks.append(None)
+            lexical_ranks.append(rank)
+            positions[hit.id] = len(ids) - 1
+        merged["vector_ranks"].append(vector_ranks)
+        merged["lexical_ranks"].append(lexical_ranks)
+    return results
+
+
+def merge_duplicate_references(
+    results: QueryResult, dedup_index: DedupIndex, exclude_paths: Sequence[str] = ()
+) -> QueryResult:
+    """
+    Append the near-duplicates (see `dedup_threshold`) of the chunks in `results`,
+    so that the files that only consist of collapsed chunks can still be found.
+    A reference takes the document, the distance, the ranks and the embedding of its
+    stored chunk, and its ID can be resolved by `DedupIndex.get_reference`.
+    """
+    assert results["metadatas"] is not None
+    assert results["documents"] is not None
+    assert results["distances"] is not None
+    merged = cast(dict[str, Any], results)
+    num_references = 0
+    for query_idx, ids in enumerate(results["ids"]):
+        extra_keys = [
+            key
+            for key in ("vector_ranks", "lexical_ranks", "embeddings")
+            if merged.get(key) is not None
+        ]
+        for key in extra_keys:
+            # lexical-only hits don't have an embedding, so it may be shorter than `ids`.
+            values = list(merged[key][query_idx])
+            merged[key][query_idx] = values + [None] * (len(ids) - len(values))
+        for idx in range(len(ids)):
+            for reference in dedup_index.get_references(ids[idx]):
+                if reference.path in exclude_paths:
+                    continue
+                meta: dict[str, str | int] = {"path": reference.path}
+                if reference.start is not None and reference.end is not None:
+                    meta["start"] = reference.start
+                    meta["end"] = reference.end
+                ids.append(reference.id)
+                results["metadatas"][query_idx].append(meta)
+                results["documents"][query_idx].append(
+                    results["documents"][query_idx][idx]
+                )
+                results["distances"][query_idx].append(
+                    results["distances"][query_idx][idx]
+                )
+                for key in extra_keys:
+                    merged[key][query_idx].append(merged[key][query_idx][idx])
+                num_references += 1
+    if num_references:
+        logger.info(f"Found {num_references} near-duplicate(s) of the results.")
+    return results
+
+
+def get_duplicate_reference(
+    identifier: str, configs: Config
+) -> Optional[DuplicateReference]:
+    """Resolve a chunk ID that was added by `merge_duplicate_references`."""
+    dedup_index = get_dedup_index(configs)
+    if dedup_index is None:
+        return None
+    return dedup_index.get_reference(identifier)
+
+
+async def get_candidate_files(
+    query_chunks: list[str], configs: Config, query_embeddings: Any = None
+) -> tuple[Optional[list[str]], Any]:
+    """
+    Shortlist the files whose centroids are the closest to the query chunks,
+    so that the chunk search can be limited to these files.
+    Return `(None, None)` if the centroid index is disabled or if it's too small to
+    make a difference. Otherwise, return the shortlisted paths and the query embeddings,
+    which should be reused by the chunk search.
+    The query chunks are only embedded if `query_embeddings` is not provided.
+    """
+    centroid_index = get_centroid_index(configs)
+    if centroid_index is None or not query_chunks:
+        return None, None
+    num_files = configs.n_result * max(configs.query_multiplier, 1)
+    if centroid_index.count() <= num_files:
+        return None, None
+    if query_embeddings is None:
+        embedding_function = get_embedding_function(configs)
+        assert embedding_function is not None
+        query_embeddings = await asyncio.to_thread(
+            embed, embedding_function, query_chunks
+        )
+    candidates = await asyncio.to_thread(
+        centroid_index.search,
+        query_embeddings,
+        num_files,
+        [str(i) for i in configs.query_exclude],
+    )
+    logger.info(f"Shortlisted {len(candidates)} files from the centroid index.")
+    if not candidates:
+        return None, None
+    return candidates, query_embeddings
+
+
+def get_query_chunks(configs: Config) -> list[str]:
+    query_chunks: list[str] = []
     if configs.query:
         chunker = StringChunker(configs)
         for q in configs.query:
             query_chunks.extend(str(i) for i in chunker.chunk(q))
+    return query_chunks
 
+
+async def get_raw_query_results(
+    collection: AsyncCollection,
+    configs: Config,
+    query_chunks: list[str],
+    query_embeddings: Any = None,
+) -> Optional[QueryResult]:
+    """
+    Run the vector search (and the lexical search, if enabled) for the query chunks
+    and return the candidates before reranking, or None if nothing was found.
+    When `query_embeddings` is provided, it's used instead of embedding the query chunks again.
+    """
     configs.query_exclude = [
         expand_path(i, True)
         for i in await expand_globs(configs.query_exclude)
@@ -45,7 +213,7 @@ async def get_query_result_files(
     ]
     if (await collection.count()) == 0:
         logger.error("Empty collection!")
-        return []
+        return None
     try:
         if len(configs.query_exclude):
             logger.info(f"Excluding {len(configs.query_exclude)} files from the query.")
@@ -66,61 +234,273 @@ async def get_query_result_files(
                     await collection.count(),
                 )
                 logger.info(f"Querying {num_query} chunks for reranking.")
-        results = await collection.query(
-            query_texts=query_chunks,
+        query_input: dict[str, Any] = {"query_texts": query_chunks}
+        if query_embeddings is not None:
+            query_input = {"query_embeddings": query_embeddings}
+        if QueryInclude.chunk not in configs.include:
+            candidates, candidate_embeddings = await get_candidate_files(
+                query_chunks, configs, query_embeddings
+            )
+            if candidates is not None:
+                # the candidates already respect `query_exclude`.
+                filter = {"path": {"$in": candidates}}
+                query_input = {"query_embeddings": candidate_embeddings}
+        include = [
+            IncludeEnum.metadatas,
+            IncludeEnum.distances,
+            IncludeEnum.documents,
+        ]
+        if require_embeddings(configs):
+            include.append(IncludeEnum.embeddings)
+        vector_search = collection.query(
+            **query_input,
             n_results=num_query,
-            include=[
-                IncludeEnum.metadatas,
-                IncludeEnum.distances,
-                IncludeEnum.documents,
-            ],
+            include=include,
             where=cast(Where, filter) or None,
         )
+        lexical_index = get_lexical_index(configs)
+        if lexical_index is None:
+            results = await vector_search
+        else:
+            num_lexical = configs.n_result * max(configs.query_multiplier, 1)
+            results, lexical_hits = await asyncio.gather(
+                vector_search,
+                asyncio.gather(
+                    *(
+                        asyncio.to_thread(
+                            lexical_index.search,
+                            query_chunk,
+                            num_lexical,
+                            [str(i) for i in configs.query_exclude],
+                            QueryInclude.chunk in configs.include,
+                        )
+                        for query_chunk in query_chunks
+                    )
+                ),
+            )
+            logger.info(
+                f"Found {sum(len(i) for i in lexical_hits)} lexical hit(s) from the lexical index."
+            )
+            results = merge_lexical_hits(results, lexical_hits)
+        dedup_index = get_dedup_index(configs)
+        if dedup_index is not None:
+            results = await asyncio.to_thread(
+                merge_duplicate_references,
+                results,
+                dedup_index,
+                [str(i) for i in configs.query_exclude],
+            )
     except IndexError:
         # no results found
-        return []
+        return None
+    return results
 
-    reranker = get_reranker(configs)
-    return await reranker.rerank(results)
 
+async def start_reranker(
+    configs: Config, collections: Sequence[AsyncCollection]
+) -> Optional["asyncio.Task[RerankerBase]"]:
+    """
+    Initialise the reranker (and load its model) in a background thread, so that
+    it overlaps with the vector search. Cancelling the task wouldn't stop the thread,
+    so the reranker is only loaded if one of the collections has documents to rerank
+    (None is returned otherwise). Await the task when the results are ready to be
+    reranked, or pass it to `discard_reranker` if there's nothing to rerank.
+    """
+    counts = await asyncio.gather(*(i.count() for i in collections))
+    if not any(counts):
+        return None
+    return asyncio.create_task(asyncio.to_thread(get_reranker, configs))
 
-async def build_query_results(
+
+async def discard_reranker(reranker_task: "asyncio.Task[RerankerBase]"):
+    """
+    Wait for the reranker that turned out to be unnecessary to finish loading,
+    so that its thread doesn't outlive the query.
+    """
+    try:
+        await reranker_task
+    except Exception as e:
+        logger.debug(f"Discarded the reranker that failed to load: {e}")
+
+
+async def get_query_result_files(
     collection: AsyncCollection, configs: Config
-) -> list[dict[str, str | int]]:
-    structured_result = []
+) -> list[str]:
+    query_chunks = get_query_chunks(configs)
+    reranker_task = await start_reranker(configs, [collection])
+    if reranker_task is None:
+        logger.error("Empty collection!")
+        return []
+    try:
+        results = await get_raw_query_results(collection, configs, query_chunks)
+    except Exception:
+        await discard_reranker(reranker_task)
+        raise
+    if results is None:
+        await discard_reranker(reranker_task)
+        return []
+    reranker = await reranker_task
+    return await reranker.rerank(results)
+
+
+async def get_symbol_results(configs: Config) -> list[Symbol]:
+    """
+    Look up the query keywords that look like identifiers in the symbol index.
+    Exact matches are placed before prefix matches.
+    In document mode, at most 1 symbol is returned for each file.
+    """
+    symbol_index = get_symbol_index(configs)
+    if symbol_index is None or not configs.query:
+        return []
+    names = [i for i in (get_symbol_name(q) for q in configs.query) if i]
+    if not names:
+        return []
+    exclude_paths = [
+        str(expand_path(i, True))
+        for i in await expand_globs(configs.query_exclude)
+        if os.path.isfile(i)
+    ]
+    symbols: list[Symbol] = []
+    for name in names:
+        symbols.extend(symbol_index.lookup(name, configs.n_result, exclude_paths))
+    symbols.sort(key=lambda x: x.name not in names)
+
+    results: list[Symbol] = []
+    seen_paths: set[str] = set()
+    for symbol in symbols:
+        if not os.path.isfile(symbol.path):
+            continue
+        if QueryInclude.chunk not in configs.include:
+            if symbol.path in seen_paths:
+                continue
+            seen_paths.add(symbol.path)
+        results.append(symbol)
+        if len(results) == configs.n_result:
+            break
+    logger.info(f"Found {len(results)} symbol(s) from the symbol index.")
+    return results
+
+
+def format_output_path(path: str, configs: Config) -> str:
+    if configs.use_absolute_path:
+        return os.path.abspath(path)
+    return os.path.relpath(path, str(configs.project_root))
+
+
+def get_exact_symbols(symbols: list[Symbol], configs: Config) -> list[Symbol]:
+    """
+    The symbols that are named exactly like one of the query keywords.
+    Only these may take the place of the vector search results; the prefix matches
+    are blended into them instead.
+    """
+    names = {get_symbol_name(q) for q in configs.query or []}
+    return [i for i in symbols if i.name in names]
+
+
+def blend_results(primary: list[T], secondary: list[T]) -> list[T]:
+    """Interleave `secondary` into `primary`, starting with `primary`."""
+    blended: list[T] = []
+    for idx in range(max(len(primary), len(secondary))):
+        blended.extend(i[idx] for i in (primary, secondary) if idx < len(i))
+    return blended
+
+
+def __format_symbol(symbol: Symbol, configs: Config) -> dict[str, str | int]:
+    if QueryInclude.chunk in configs.include:
+        symbol_result: dict[str, str | int] = {
+            "chunk": read_lines(symbol.path, symbol.start, symbol.end),
+            "start_line": symbol.start,
+            "end_line": symbol.end,
+        }
+        if QueryInclude.path in configs.include:
+            symbol_result["path"] = format_output_path(symbol.path, configs)
+        return symbol_result
+    with open(symbol.path) as fin:
+        full_result = {
+            "path": format_output_path(symbol.path, configs),
+            "document": fin.read(),
+        }
+    return {str(key): full_result[str(key)] for key in configs.include}
+
+
+async def __iter_unbounded_results(
+    collection: Optional[AsyncCollection],
+    configs: Config,
+    symbols: Optional[list[Symbol]] = None,
+) -> AsyncGenerator[dict[str, str | int], None]:
+    if symbols is None:
+        symbols = await get_symbol_results(configs)
+    exact_symbols = get_exact_symbols(symbols, configs)
+    for symbol in exact_symbols:
+        yield __format_symbol(symbol, configs)
+
+    # the prefix matches take turns with the vector search results.
+    prefix_symbols = [i for i in symbols if i not in exact_symbols]
+    if len(exact_symbols) < configs.n_result:
+        assert collection is not None, "The collection is required for vector search."
+        async with contextlib.aclosing(
+            __iter_vector_results(collection, configs, symbols)
+        ) as results:
+            async for result in results:
+                yield result
+                if prefix_symbols:
+                    yield __format_symbol(prefix_symbols.pop(0), configs)
+    for symbol in prefix_symbols:
+        yield __format_symbol(symbol, configs)
+
+
+async def __iter_vector_results(
+    collection: AsyncCollection, configs: Config, symbols: list[Symbol]
+) -> AsyncGenerator[dict[str, str | int], None]:
+    """The vector search results that aren't covered by `symbols`."""
     for identifier in await get_query_result_files(collection, configs):
         if os.path.isfile(identifier):
-            if configs.use_absolute_path:
-                output_path = os.path.abspath(identifier)
-            else:
-                output_path = os.path.relpath(identifier, configs.project_root)
+            if any(os.path.samefile(identifier, i.path) for i in symbols):
+                continue
+            output_path = format_output_path(identifier, configs)
             full_result = {"path": output_path}
             with open(identifier) as fin:
                 document = fin.read()
                 full_result["document"] = document
 
-            structured_result.append(
-                {str(key): full_result[str(key)] for key in configs.include}
-            )
+            yield {str(key): full_result[str(key)] for key in configs.include}
         elif QueryInclude.chunk in configs.include:
-            chunks: GetResult = await collection.get(
-                identifier, include=[IncludeEnum.metadatas, IncludeEnum.documents]
-            )
-            meta = chunks.get(
-                "metadatas",
-            )
-            if meta is not None and len(meta) != 0:
+            reference = get_duplicate_reference(identifier, configs)
+            if reference is not None:
+                # a near-duplicate that is stored as a reference to another chunk.
+                meta = [
+                    {
+                        "path": reference.path,
+                        "start": reference.start,
+                        "end": reference.end,
+                    }
+                ]
+                chunk_texts = [""]
+            else:
+                chunks: GetResult = await collection.get(
+                    identifier,
+                    include=[IncludeEnum.metadatas, IncludeEnum.documents],
+                )
+                meta = chunks.get(
+                    "metadatas",
+                )
                 chunk_texts = chunks.get("documents")
+            if meta is not None and len(meta) != 0:
                 assert chunk_texts is not None, (
                     "QueryResult does not contain `documents`!"
                 )
                 full_result: dict[str, str | int] = {"chunk": str(chunk_texts[0])}
                 if meta[0].get("start") is not None and meta[0].get("end") is not None:
                     path = str(meta[0].get("path"))
-                    with open(path) as fin:
-                        start: int = int(meta[0]["start"])
-                        end: int = int(meta[0]["end"])
-                        full_result["chunk"] = "".join(fin.readlines()[start : end + 1])
+                    start: int = int(meta[0]["start"])
+                    end: int = int(meta[0]["end"])
+                    if any(
+                        i.path == path and i.start <= end and start <= i.end
+                        for i in symbols
+                    ):
+                        # overlaps with a definition that is already in the results.
+                        continue
+                    full_result["chunk"] = read_lines(path, start, end)
                     full_result["start_line"] = start
                     full_result["end_line"] = end
                     if QueryInclude.path in configs.include:
@@ -132,7 +512,7 @@ async def build_query_results(
                             )
                         )
 
-                    structured_result.append(full_result)
+                    yield full_result
             else:  # pragma: nocover
                 logger.error(
                     "This collection doesn't support chunk-mode output because it lacks the necessary metadata. Please re-vectorise it.",
@@ -142,10 +522,170 @@ async def build_query_results(
             logger.warning(
                 f"{identifier} is no longer a valid file! Please re-run vectorcode vectorise to refresh the database.",
             )
-    for result in structured_result:
-        if result.get("path") is not None:
-            result["path"] = cleanup_path(result["path"])
-    return structured_result
+
+
+async def iter_query_results(
+    collection: Optional[AsyncCollection],
+    configs: Config,
+    symbols: Optional[list[Symbol]] = None,
+) -> AsyncGenerator[dict[str, str | int], None]:
+    """
+    Yield the query results one by one, as soon as they're ranked and read from the disk.
+    Definitions from the symbol index (if enabled) that match a query keyword exactly
+    are placed before the results of the vector search, and the vector search is
+    skipped when they are enough to fill `configs.n_result`. Prefix matches are
+    interleaved with the vector search results.
+    """
+    if configs.n_result <= 0:
+        return
+    num_results = 0
+    partial_rerank.set(False)
+    async with contextlib.aclosing(
+        __iter_unbounded_results(collection, configs, symbols)
+    ) as results:
+        async for result in results:
+            if result.get("path") is not None:
+                result["path"] = cleanup_path(str(result["path"]))
+            if partial_rerank.get():
+                # the reranker ran out of `configs.reranker_timeout`.
+                result["partial_rerank"] = True
+            yield result
+            num_results += 1
+            if num_results >= configs.n_result:
+                break
+
+
+async def build_query_results(
+    collection: Optional[AsyncCollection],
+    configs: Config,
+    symbols: Optional[list[Symbol]] = None,
+) -> list[dict[str, str | int]]:
+    return [i async for i in iter_query_results(collection, configs, symbols)]
+
+
+async def get_packed_results(
+    collection: Optional[AsyncCollection],
+    configs: Config,
+    symbols: Optional[list[Symbol]] = None,
+) -> list[dict[str, str | int]]:
+    """
+    Pack the ranked results into `configs.char_budget` characters.
+    In document mode, a file that doesn't fit is replaced by its most relevant chunks
+    from the vector search. Overlapping or adjacent chunks of the same file are merged.
+    """
+    if symbols is None:
+        symbols = await get_symbol_results(configs)
+    # exact symbols go before the vector search results, and the prefix matches
+    # take turns with them.
+    exact_symbols = get_exact_symbols(symbols, configs)
+    prefix_symbols = [i for i in symbols if i not in exact_symbols]
+    symbol_spans = [
+        Span(symbol.path, symbol.start, symbol.end, idx - len(symbols))
+        for idx, symbol in enumerate([*exact_symbols, *prefix_symbols])
+    ]
+    exact_spans = symbol_spans[: len(exact_symbols)]
+    prefix_spans = symbol_spans[len(exact_symbols) :]
+    chunk_spans: dict[str, Span] = {}
+    identifiers: list[str] = []
+    partial_rerank.set(False)
+    if len(exact_symbols) < configs.n_result:
+        assert collection is not None, "The collection is required for vector search."
+        query_chunks = get_query_chunks(configs)
+        reranker_task = await start_reranker(configs, [collection])
+        if reranker_task is None:
+            logger.error("Empty collection!")
+        else:
+            try:
+                raw_results = await get_raw_query_results(
+                    collection, configs, query_chunks
+                )
+            except Exception:
+                await discard_reranker(reranker_task)
+                raise
+            if raw_results is not None:
+                chunk_spans = get_chunk_spans(raw_results)
+                identifiers = await (await reranker_task).rerank(raw_results)
+            else:
+                await discard_reranker(reranker_task)
+
+    ranked: list[str | Span]
+    if QueryInclude.chunk in configs.include:
+        ranked = [
+            *exact_spans,
+            *blend_results(
+                [chunk_spans[i] for i in identifiers if i in chunk_spans],
+                prefix_spans,
+            ),
+        ]
+    else:
+        ranked = list(
+            dict.fromkeys(
+                [
+                    *(i.path for i in exact_symbols),
+                    *blend_results(identifiers, [i.path for i in prefix_symbols]),
+                ]
+            )
+        )
+
+    outputs: list[dict[str, str | int]] = []
+    for result in pack_results(
+        ranked,
+        configs.char_budget,
+        get_file_spans([*symbol_spans, *chunk_spans.values()]),
+    ):
+        output: dict[str, str | int] = {}
+        if QueryInclude.path in configs.include:
+            output["path"] = cleanup_path(format_output_path(result.path, configs))
+        if result.start is None or result.end is None:
+            output["document"] = result.text
+        else:
+            output["chunk"] = result.text
+            output["start_line"] = result.start
+            output["end_line"] = result.end
+        if partial_rerank.get():
+            output["partial_rerank"] = True
+        outputs.append(output)
+    return outputs
+
+
+async def iter_packed_results(
+    collection: Optional[AsyncCollection],
+    configs: Config,
+    symbols: Optional[list[Symbol]] = None,
+) -> AsyncGenerator[dict[str, str | int], None]:
+    for result in await get_packed_results(collection, configs, symbols):
+        yield result
+
+
+def print_query_results(structured_result: list[dict[str, str | int]], configs: Config):
+    if configs.pipe:
+        print(json.dumps(structured_result))
+    else:
+        for idx, result in enumerate(structured_result):
+            if result.get("project") is not None:
+                print(f"Project: {result['project']}")
+            for include_item in configs.include:
+                if (
+                    include_item == QueryInclude.document
+                    and result.get("document") is None
+                    and result.get("chunk") is not None
+                ):
+                    # a file that was replaced by its lines to fit in `char_budget`.
+                    include_item = QueryInclude.chunk
+                print(f"{include_item.to_header()}{result.get(include_item.value)}")
+            if idx != len(structured_result) - 1:
+                print()
+
+
+async def stream_query_results(
+    results: AsyncGenerator[dict[str, str | int], None],
+):
+    """
+    Print each result as a line of JSON (NDJSON) as soon as it's available.
+    """
+    async with contextlib.aclosing(results):
+        async for result in results:
+            print(json.dumps(result), flush=True)
 
 
 async def query(configs: Config) -> int:
@@ -157,31 +697,59 @@ async def query(configs: Config) -> int:
             "Having both chunk and document in the output is not supported!",
         )
         return 1
-    client = await get_client(configs)
-    try:
-        collection = await get_collection(client, configs, False)
-        if not verify_ef(collection, configs):
-            return 1
-    except (ValueError, InvalidCollectionException) as e:
-        logger.error(
-            f"{e.__class__.__name__}: There's no existing collection for {configs.project_root}",
-        )
-        return 1
-    except InvalidDimensionException as e:
-        logger.error(
-            f"{e.__class__.__name__}: The collection was embedded with a different embedding model.",
-        )
-        return 1
-    except IndexError as e:  # pragma: nocover
-        logger.error(
-            f"{e.__class__.__name__}: Failed to get the collection. Please check your config."
+
+    if configs.query_projects or configs.query_all_projects:
+        from vectorcode.subcommands.query.projects import (
+            get_multi_project_results,
+            iter_multi_project_results,
         )
-        return 1
 
-    if not configs.pipe:
+        if not (configs.pipe or configs.stream):
+            print("Starting querying...")
+        if configs.char_budget > 0:
+            logger.warning(
+                "`char_budget` is not supported when querying multiple projects."
+            )
+        try:
+            if configs.stream:
+                await stream_query_results(iter_multi_project_results(configs))
+            else:
+                print_query_results(await get_multi_project_results(configs), configs)
+        except RerankerError as e:  # pragma: nocover
+            logger.error(f"{e.__class__.__name__}")
+            return 1
+        return 0
+
+    symbols = await get_symbol_results(configs)
+    collection = None
+    if len(get_exact_symbols(symbols, configs)) < configs.n_result:
+        client = await get_client(configs)
+        try:
+            collection = await get_collection(client, configs, False)
+            if not verify_ef(collection, configs):
+                return 1
+        except (ValueError, InvalidCollectionException) as e:
+            logger.error(
+                f"{e.__class__.__name__}: There's no existing collection for {configs.project_root}",
+            )
+            return 1
+        except InvalidDimensionException as e:
+            logger.error(
+                f"{e.__class__.__name__}: The collection was embedded with a different embedding model.",
+            )
+            return 1
+        except IndexError as e:  # pragma: nocover
+            logger.error(
+                f"{e.__class__.__name__}: Failed to get the collection. Please check your config."
+            )
+            return 1
+    else:
+        logger.info("Skipping vector search because of the symbol index hits.")
+
+    if not (configs.pipe or configs.stream):
         print("Starting querying...")
 
-    if QueryInclude.chunk in configs.include:
+    if collection is not None and QueryInclude.chunk in configs.include:
         if len((await collection.get(where={"start": {"$gte": 0}}))["ids"]) == 0:
             logger.warning(
                 """
@@ -189,20 +757,28 @@ This collection doesn't contain line range metadata. Falling back to `--include
 Please re-vectorise it to use `--include chunk`.""",
             )
             configs.include = [QueryInclude.path, QueryInclude.document]
+            symbols = await get_symbol_results(configs)
 
     try:
-        structured_result = await build_query_results(collection, configs)
+        if configs.stream:
+            await stream_query_results(
+                iter_packed_results(collection, configs, symbols=symbols)
+                if configs.char_budget > 0
+                else iter_query_results(collection, configs, symbols=symbols)
+            )
+            return 0
+        if configs.char_budget > 0:
+            structured_result = await get_packed_results(
+                collection, configs, symbols=symbols
+            )
+        else:
+            structured_result = await build_query_results(
+                collection, configs, symbols=symbols
+            )
     except RerankerError as e:  # pragma: nocover
         # error logs should be handled where they're raised
         logger.error(f"{e.__class__.__name__}")
         return 1
 
-    if configs.pipe:
-        print(json.dumps(structured_result))
-    else:
-        for idx, result in enumerate(structured_result):
-            for include_item in configs.include:
-                print(f"{include_item.to_header()}{result.get(include_item.value)}")
-            if idx != len(structured_result) - 1:
-                print()
+    print_query_results(structured_result, configs)
     return 0
@@ -0,0 +1,200 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+from chromadb import QueryResult
+
+logger = logging.getLogger(name=__name__)
+
+
+@dataclass
+class Span:
+    """
+    A range of lines in a file. Lines are 1-indexed and both ends are inclusive,
+    like the rows of the chunks and the symbols.
+    A smaller `rank` means the span is more relevant.
+    """
+
+    path: str
+    start: int
+    end: int
+    rank: int = 0
+
+
+@dataclass
+class PackedResult:
+    path: str
+    text: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+
+def slice_lines(lines: Sequence[str], start: int, end: int) -> str:
+    """The text of the lines from `start` to `end` (1-indexed, both inclusive)."""
+    return "".join(lines[max(start, 1) - 1 : end])
+
+
+def read_lines(path: str, start: int, end: int) -> str:
+    with open(path) as fin:
+        return slice_lines(fin.readlines(), start, end)
+
+
+def merge_spans(spans: Iterable[Span]) -> list[Span]:
+    """
+    Merge the overlapping or adjacent spans of the same file.
+    A merged span takes the best rank of its parts.
+    The returned spans are ordered by rank.
+    """
+    merged: list[Span] = []
+    for span in sorted(spans, key=lambda x: (x.path, x.start, x.end)):
+        if merged and merged[-1].path == span.path and span.start <= merged[-1].end + 1:
+            last = merged[-1]
+            last.end = max(last.end, span.end)
+            last.rank = min(last.rank, span.rank)
+        else:
+            merged.append(Span(span.path, span.start, span.end, span.rank))
+    merged.sort(key=lambda x: x.rank)
+    return merged
+
+
+def get_chunk_spans(results: QueryResult) -> dict[str, Span]:
+    """
+    Map the IDs of the chunks in `results` that have line range metadata to their spans,
+    ranked by their best distance to any of the query chunks.
+    """
+    assert results["metadatas"] is not None
+    assert results["distances"] is not None
+    best_distances: dict[str, float] = {}
+    spans: dict[str, Span] = {}
+    for ids, metas, distances in zip(
+        results["ids"], results["metadatas"], results["distances"]
+    ):
+        for chunk_id, meta, distance in zip(ids, metas, distances):
+            if meta.get("start") is None or meta.get("end") is None:
+                continue
+            if chunk_id not in spans:
+                spans[chunk_id] = Span(
+                    str(meta["path"]), int(meta["start"]), int(meta["end"])
+                )
+            best_distances[chunk_id] = min(
+                best_distances.get(chunk_id, float("inf")), float(distance)
+            )
+    for rank, chunk_id in enumerate(
+        sorted(best_distances.keys(), key=lambda x: best_distances[x])
+    ):
+        spans[chunk_id].rank = rank
+    return spans
+
+
+class _FileCache:
+    def __init__(self):
+        self.__lines: dict[str, list[str]] = {}
+
+    def lines(self, path: str) -> list[str]:
+        if path not in self.__lines:
+            with open(path) as fin:
+                self.__lines[path] = fin.readlines()
+        return self.__lines[path]
+
+
+def pack_results(
+    ranked: Sequence[str | Span],
+    budget: int,
+    file_spans: Optional[dict[str, Sequence[Span]]] = None,
+) -> list[PackedResult]:
+    """
+    Greedily pack the `ranked` results into `budget` characters.
+
+    Items of `ranked` are either paths (for whole-file documents) or spans (for chunks),
+    ordered by decreasing relevance. Items that don't fit in the remaining budget are
+    skipped so that smaller, less relevant ones can take their place. A document that
+    doesn't fit is swapped for those of its spans in `file_spans` that fit.
+    Lines that are already selected don't count towards the budget again, and the
+    selected spans of the same file are merged if they overlap or are adjacent.
+    """
+    file_spans = file_spans or {}
+    files = _FileCache()
+    remaining = budget
+    documents: set[str] = set()
+    covered: dict[str, set[int]] = {}
+    selected: list[Span] = []
+    # the order in which the results appear in the output.
+    order: dict[str, int] = {}
+
+    def try_select(span: Span, rank: int) -> bool:
+        nonlocal remaining
+        lines = files.lines(span.path)
+        covered_lines = covered.setdefault(span.path, set())
+        new_lines = [
+            i
+            for i in range(max(span.start, 1) - 1, min(span.end, len(lines)))
+            if i not in covered_lines
+        ]
+        cost = sum(len(lines[i]) for i in new_lines)
+        if cost > remaining:
+            return False
+        remaining -= cost
+        covered_lines.update(new_lines)
+        selected.append(Span(span.path, span.start, span.end, rank))
+        return True
+
+    for rank, item in enumerate(ranked):
+        if remaining <= 0:
+            break
+        path = item if isinstance(item, str) else item.path
+        if path in documents:
+            continue
+        if not os.path.isfile(path):
+            logger.warning(
+                f"{path} is no longer a valid file! Please re-run vectorcode vectorise to refresh the database.",
+            )
+            continue
+        if isinstance(item, Span):
+            try_select(item, rank)
+            continue
+        lines = files.lines(path)
+        cost = sum(
+            len(line)
+            for i, line in enumerate(lines)
+            if i not in covered.get(path, set())
+        )
+        if cost <= remaining:
+            remaining -= cost
+            documents.add(path)
+            order[path] = min([rank] + [i.rank for i in selected if i.path == path])
+            continue
+        logger.debug(f"{path} doesn't fit in the budget. Packing its best spans.")
+        for span in file_spans.get(path, []):
+            try_select(span, rank)
+
+    packed: list[tuple[tuple[int, int], PackedResult]] = []
+    for path in documents:
+        packed.append(
+            ((order[path], 0), PackedResult(path, "".join(files.lines(path))))
+        )
+    for span in merge_spans(i for i in selected if i.path not in documents):
+        packed.append(
+            (
+                (span.rank, span.start),
+                PackedResult(
+                    span.path,
+                    slice_lines(files.lines(span.path), span.start, span.end),
+                    span.start,
+                    span.end,
+                ),
+            )
+        )
+    packed.sort(key=lambda x: x[0])
+    logger.info(
+        f"Packed {len(packed)} result(s) into {budget - remaining}/{budget} characters."
+    )
+    return [i[1] for i in packed]
+
+
+def get_file_spans(spans: Iterable[Span]) -> dict[str, list[Span]]:
+    """Group the spans by file, ordered by relevance."""
+    file_spans: dict[str, list[Span]] = {}
+    for span in sorted(spans, key=lambda x: x.rank):
+        file_spans.setdefault(span.path, []).append(span)
+    return file_spans
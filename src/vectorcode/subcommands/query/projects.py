@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Hashable, Optional, Sequence, cast
+
+from chromadb import QueryResult
+from chromadb.api.models.AsyncCollection import AsyncCollection
+from chromadb.errors import InvalidCollectionException, InvalidDimensionException
+
+from vectorcode.cli_utils import (
+    Config,
+    QueryInclude,
+    cleanup_path,
+    expand_path,
+    get_project_config,
+)
+from vectorcode.common import (
+    get_client,
+    get_collection,
+    get_collections,
+    get_embedding_function,
+    verify_ef,
+)
+from vectorcode.embedding_registry import embed, make_embedding_key
+from vectorcode.subcommands.query import (
+    discard_reranker,
+    get_query_chunks,
+    get_raw_query_results,
+    start_reranker,
+)
+from vectorcode.subcommands.query.packing import read_lines
+from vectorcode.subcommands.query.reranker import partial_rerank
+
+logger = logging.getLogger(name=__name__)
+
+RANK_FUSION_K = 60
+
+
+@dataclass
+class ProjectCollection:
+    project_root: str
+    configs: Config
+    collection: AsyncCollection
+
+
+async def get_project_roots(configs: Config) -> list[str]:
+    """
+    Return the absolute paths of the projects to be queried: the current project,
+    followed by `configs.query_projects`, or all indexed projects if `configs.query_all_projects` is set.
+    """
+    roots = []
+    if configs.project_root is not None:
+        roots.append(str(configs.project_root))
+    roots.extend(str(i) for i in configs.query_projects)
+    if configs.query_all_projects:
+        async for collection in get_collections(await get_client(configs)):
+            roots.append(str(collection.metadata["path"]))
+    return list(dict.fromkeys(str(expand_path(i, True)) for i in roots))
+
+
+async def get_project_collections(configs: Config) -> list[ProjectCollection]:
+    """
+    Load the collections of the projects to be queried. Each project uses its own
+    project config (embedding function, local indices, etc.), with the query options taken from `configs`.
+    Projects that can't be queried are skipped with a warning.
+    """
+    projects: list[ProjectCollection] = []
+    for project_root in await get_project_roots(configs):
+        project_configs = await (await get_project_config(project_root)).merge_from(
+            Config(
+                query=configs.query,
+                n_result=configs.n_result,
+                query_multiplier=configs.query_multiplier,
+                query_exclude=configs.query_exclude,
+                include=configs.include,
+                use_absolute_path=configs.use_absolute_path,
+                pipe=configs.pipe,
+            )
+        )
+        project_configs.project_root = project_root
+        try:
+            collection = await get_collection(
+                await get_client(project_configs), project_configs, False
+            )
+        except (
+            ValueError,
+            InvalidCollectionException,
+            InvalidDimensionException,
+            IndexError,
+        ) as e:
+            logger.warning(
+                f"{e.__class__.__name__}: Skipping {project_root} because its collection is not accessible."
+            )
+            continue
+        if not verify_ef(collection, project_configs):
+            logger.warning(
+                f"Skipping {project_root} because of the embedding function mismatch."
+            )
+            continue
+        projects.append(ProjectCollection(project_root, project_configs, collection))
+    return projects
+
+
+def get_rank_distances(distances: Sequence[float]) -> list[float]:
+    """
+    Replace the distances of the results of a collection by pseudo-distances that
+    only depend on their ranks, like in reciprocal rank fusion.
+    """
+    distances = list(distances)
+    rank_distances = [0.0] * len(distances)
+    for rank, idx in enumerate(
+        sorted(range(len(distances)), key=lambda x: distances[x])
+    ):
+        rank_distances[idx] = 1 - 1 / (RANK_FUSION_K + rank + 1)
+    return rank_distances
+
+
+def merge_query_results(
+    results: Sequence[QueryResult], embedding_keys: Optional[Sequence[Hashable]] = None
+) -> QueryResult:
+    """
+    Concatenate the results of the same query chunks from different collections,
+    so that they can be reranked together.
+    `embedding_keys` are the embedding keys (see `make_embedding_key`) of the collections.
+    The distances from different embedding spaces aren't comparable, so if the keys
+    differ, the distances are replaced by per-collection rank distances
+    (see `get_rank_distances`) and the embeddings are dropped.
+    """
+    mixed = embedding_keys is not None and len(set(embedding_keys)) > 1
+    if mixed:
+        logger.info(
+            "The projects use different embedding functions. Merging their results by rank."
+        )
+    merged: dict[str, list[list[Any]]] = {
+        key: []
+        for key in (
+            "ids",
+            "distances",
+            "metadatas",
+            "documents",
+            "vector_ranks",
+            "lexical_ranks",
+        )
+    }
+    if results and not mixed and all(i.get("embeddings") is not None for i in results):
+        merged["embeddings"] = []
+    for query_idx in range(len(results[0]["ids"]) if results else 0):
+        for key in merged:
+            merged[key].append([])
+        for result in results:
+            ids = result["ids"][query_idx]
+            raw_result = cast(dict[str, Any], result)
+            merged["ids"][-1].extend(ids)
+            for key in ("metadatas", "documents"):
+                merged[key][-1].extend(raw_result[key][query_idx])
+            merged["distances"][-1].extend(
+                get_rank_distances(raw_result["distances"][query_idx])
+                if mixed
+                else raw_result["distances"][query_idx]
+            )
+            merged["vector_ranks"][-1].extend(
+                raw_result["vector_ranks"][query_idx]
+                if "vector_ranks" in raw_result
+                else range(len(ids))
+            )
+            merged["lexical_ranks"][-1].extend(
+                raw_result["lexical_ranks"][query_idx]
+                if "lexical_ranks" in raw_result
+                else [None] * len(ids)
+            )
+            if "embeddings" in merged:
+                # lexical-only hits don't have an embedding.
+                embeddings = list(raw_result["embeddings"][query_idx])
+                merged["embeddings"][-1].extend(
+                    embeddings + [None] * (len(ids) - len(embeddings))
+                )
+    return cast(QueryResult, merged)
+
+
+async def iter_multi_project_results(
+    configs: Config,
+) -> AsyncGenerator[dict[str, str | int], None]:
+    """
+    Query the collections of several projects concurrently, rerank the candidates
+    from all projects together with the reranker in `configs`, and yield
+    the results, tagged by the project that they belong to, one by one.
+    """
+    projects = await get_project_collections(configs)
+    if not projects:
+        logger.error("None of the requested projects can be queried.")
+        return
+    logger.info(f"Querying {len(projects)} projects.")
+    query_chunks = get_query_chunks(configs)
+    reranker_task = await start_reranker(configs, [i.collection for i in projects])
+    if reranker_task is None:
+        logger.error("None of the requested projects has been vectorised.")
+        return
+
+    try:
+        # projects that use the same embedding function share the query embeddings.
+        query_embeddings: dict[Hashable, Any] = {}
+        for project in projects:
+            ef_key = make_embedding_key(project.configs)
+            if ef_key not in query_embeddings:
+                embedding_function = get_embedding_function(project.configs)
+                assert embedding_function is not None
+                query_embeddings[ef_key] = await asyncio.to_thread(
+                    embed, embedding_function, query_chunks
+                )
+
+        raw_results = await asyncio.gather(
+            *(
+                get_raw_query_results(
+                    project.collection,
+                    project.configs,
+                    query_chunks,
+                    query_embeddings[make_embedding_key(project.configs)],
+                )
+                for project in projects
+            )
+        )
+    except Exception:
+        await discard_reranker(reranker_task)
+        raise
+    chunk_sources: dict[str, tuple[ProjectCollection, dict[str, Any], str]] = {}
+    path_sources: dict[str, ProjectCollection] = {}
+    valid_results: list[QueryResult] = []
+    embedding_keys: list[Hashable] = []
+    for project, result in zip(projects, raw_results):
+        if result is None:
+            continue
+        valid_results.append(result)
+        embedding_keys.append(make_embedding_key(project.configs))
+        assert result["metadatas"] is not None and result["documents"] is not None
+        for ids, metas, documents in zip(
+            result["ids"], result["metadatas"], result["documents"]
+        ):
+            for chunk_id, meta, document in zip(ids, metas, documents):
+                chunk_sources[chunk_id] = (project, dict(meta), document)
+                path_sources.setdefault(str(meta["path"]), project)
+    if not valid_results:
+        await discard_reranker(reranker_task)
+        return
+
+    identifiers = await (await reranker_task).rerank(
+        merge_query_results(valid_results, embedding_keys)
+    )
+
+    num_results = 0
+    for identifier in identifiers:
+        if num_results >= configs.n_result:
+            break
+        if QueryInclude.chunk in configs.include:
+            project, meta, document = chunk_sources[identifier]
+            path = str(meta["path"])
+            output: dict[str, str | int] = {"chunk": document}
+            if meta.get("start") is not None and meta.get("end") is not None:
+                start, end = int(meta["start"]), int(meta["end"])
+                output["chunk"] = read_lines(path, start, end)
+                output["start_line"] = start
+                output["end_line"] = end
+            if QueryInclude.path in configs.include:
+                output["path"] = path
+        else:
+            if not os.path.isfile(identifier):
+                logger.warning(
+                    f"{identifier} is no longer a valid file! Please re-run vectorcode vectorise to refresh the database.",
+                )
+                continue
+            project = path_sources[identifier]
+            with open(identifier) as fin:
+                full_result = {"path": identifier, "document": fin.read()}
+            output = {str(key): full_result[str(key)] for key in configs.include}
+        if output.get("path") is not None and not configs.use_absolute_path:
+            output["path"] = os.path.relpath(str(output["path"]), project.project_root)
+        if output.get("path") is not None:
+            output["path"] = cleanup_path(str(output["path"]))
+        output["project"] = cleanup_path(project.project_root)
+        if partial_rerank.get():
+            output["partial_rerank"] = True
+        yield output
+        num_results += 1
+
+
+async def get_multi_project_results(configs: Config) -> list[dict[str, str | int]]:
+    return [i async for i in iter_multi_project_results(configs)]
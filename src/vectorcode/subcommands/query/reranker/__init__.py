@@ -1,20 +1,39 @@
+import dataclasses
 import logging
 import sys
 from typing import Type
 
 from vectorcode.cli_utils import Config
 
-from .base import RerankerBase
+from .base import RerankerBase, partial_rerank
+from .cascade import CascadeReranker
 from .cross_encoder import CrossEncoderReranker
+from .mmr import MMRReranker
 from .naive import NaiveReranker
-
-__all__ = ["RerankerBase", "NaiveReranker", "CrossEncoderReranker"]
+from .onnx_cross_encoder import OnnxCrossEncoderReranker
+from .pool import ModelPool, model_pool
+from .rrf import RRFReranker
+
+__all__ = [
+    "RerankerBase",
+    "NaiveReranker",
+    "CrossEncoderReranker",
+    "RRFReranker",
+    "CascadeReranker",
+    "OnnxCrossEncoderReranker",
+    "MMRReranker",
+    "ModelPool",
+    "model_pool",
+    "partial_rerank",
+]
 
 logger = logging.getLogger(name=__name__)
 
 __supported_rerankers: dict[str, Type[RerankerBase]] = {
     "CrossEncoderReranker": CrossEncoderReranker,
     "NaiveReranker": NaiveReranker,
+    "RRFReranker": RRFReranker,
+    "CascadeReranker": CascadeReranker,
 }
 
 
@@ -49,22 +68,55 @@ def add_reranker(cls):
         raise TypeError(error_message)
 
 
+add_reranker(OnnxCrossEncoderReranker)
+add_reranker(MMRReranker)
+
+
 def get_available_rerankers():
     return list(__supported_rerankers.values())
 
 
-def get_reranker(configs: Config) -> RerankerBase:
+def get_reranker_class(configs: Config) -> Type[RerankerBase]:
     if configs.reranker:
         if hasattr(sys.modules[__name__], configs.reranker):
             # dynamic dispatch for built-in rerankers
-            return getattr(sys.modules[__name__], configs.reranker).create(configs)
+            return getattr(sys.modules[__name__], configs.reranker)
 
         elif issubclass(
             __supported_rerankers.get(configs.reranker, type(None)), RerankerBase
         ):
-            return __supported_rerankers[configs.reranker].create(configs)
+            return __supported_rerankers[configs.reranker]
 
     if not configs.reranker:
-        return NaiveReranker(configs)
+        return NaiveReranker
     else:
         raise RerankerInitialisationError()
+
+
+def get_reranker(configs: Config) -> RerankerBase:
+    if not configs.reranker:
+        return NaiveReranker(configs)
+    return get_reranker_class(configs).create(configs)
+
+
+def require_embeddings(configs: Config) -> bool:
+    """Whether the reranker in `configs` needs the stored embeddings of the query results."""
+    try:
+        return bool(getattr(get_reranker_class(configs), "require_embeddings", False))
+    except RerankerError:
+        # the error is raised again when the reranker is initialised.
+        return False
+
+
+def warm_up_reranker(configs: Config):
+    """
+    Initialise the reranker in `configs` so that its model (if any) is loaded into
+    the model pool before the first query arrives.
+    """
+    if not configs.reranker:
+        return
+    logger.info(f"Warming up {configs.reranker}.")
+    try:
+        get_reranker(dataclasses.replace(configs, query=[]))
+    except Exception as e:  # pragma: nocover
+        logger.warning(f"Failed to warm up {configs.reranker}: {e.__class__.__name__}")
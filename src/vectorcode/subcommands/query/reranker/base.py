@@ -1,16 +1,23 @@
-import heapq
+import asyncio
+import contextvars
+import json
 import logging
 from abc import ABC, abstractmethod
-from collections import defaultdict
-from typing import Any, DefaultDict, Optional, Sequence, cast
+from contextvars import ContextVar
+from typing import Any, Optional, Sequence, cast
 
 import numpy
 from chromadb.api.types import QueryResult
 
 from vectorcode.cli_utils import Config, QueryInclude
 
+from .score_cache import get_score_cache, make_score_key
+
 logger = logging.getLogger(name=__name__)
 
+partial_rerank: ContextVar[bool] = ContextVar("partial_rerank", default=False)
+"""Whether the last `rerank` call in the current context ran out of `configs.reranker_timeout`."""
+
 
 class RerankerBase(ABC):
     """This is the base class for the rerankers.
@@ -21,8 +28,17 @@ class RerankerBase(ABC):
 
     The class doc string will be added to the error message if your reranker fails to initialise.
     Thus, this is a good place to put the instructions to configuring your reranker.
+
+    Set `cacheable` to True if the score of a result only depends on its text and the query message
+    (and not on `self._raw_results`), so that the scores can be saved in the score cache (`configs.reranker_cache`).
+
+    Set `require_embeddings` to True if the reranker needs the stored embeddings of the results
+    (`self._raw_results["embeddings"]`), so that they're fetched by the vector search.
     """
 
+    cacheable: bool = False
+    require_embeddings: bool = False
+
     def __init__(self, configs: Config, **kwargs: Any):
         self.configs = configs
         assert self.configs.query is not None, (
@@ -61,35 +77,223 @@ class RerankerBase(ABC):
         """
         raise NotImplementedError
 
+    async def compute_similarities(
+        self, results: Sequence[list[str]], query_messages: Sequence[str]
+    ) -> list[Sequence[float]]:
+        """Compute the similarity scores for all query messages in one go.
+        `results[i]` holds the results that were retrieved for `query_messages[i]`,
+        and the `i`-th item of the returned list should hold their scores.
+
+        The default implementation calls `compute_similarity` for each query message.
+        Override this if your reranker can score all (result, query) pairs in a batch.
+        """
+        return [
+            await self.compute_similarity(docs, query_message)
+            for docs, query_message in zip(results, query_messages)
+        ]
+
+    @property
+    def model_key(self) -> str:
+        """Identify the model (and its parameters) that computes the scores."""
+        return json.dumps(
+            [self.__class__.__name__, self.configs.reranker_params],
+            sort_keys=True,
+            default=str,
+        )
+
+    async def compute_similarities_with_cache(
+        self, results: Sequence[list[str]], query_messages: Sequence[str]
+    ) -> list[Sequence[float]]:
+        """Same as `compute_similarities`, but the scores of the (result, query) pairs that are
+        in the score cache are not computed again.
+        """
+        if not (self.cacheable and self.configs.reranker_cache):
+            return await self.compute_similarities(results, query_messages)
+        cached_scores = self.get_cached_scores(results, query_messages)
+        missing = [
+            [doc for doc, score in zip(docs, scores) if score is None]
+            for docs, scores in zip(results, cached_scores)
+        ]
+        num_missing = sum(len(i) for i in missing)
+        logger.debug(
+            f"Found {sum(len(i) for i in results) - num_missing} cached reranker scores."
+        )
+        if num_missing:
+            new_scores = await self.compute_similarities(missing, query_messages)
+            computed: dict[str, float] = {}
+            for docs, query_message, scores in zip(missing, query_messages, new_scores):
+                for doc, score in zip(docs, scores):
+                    computed[make_score_key(self.model_key, query_message, doc)] = (
+                        float(score)
+                    )
+            get_score_cache().put_many(computed)
+            cached_scores = self.get_cached_scores(results, query_messages, computed)
+        return [[float(cast(float, i)) for i in scores] for scores in cached_scores]
+
+    def get_cached_scores(
+        self,
+        results: Sequence[list[str]],
+        query_messages: Sequence[str],
+        extra_scores: Optional[dict[str, float]] = None,
+    ) -> list[list[Optional[float]]]:
+        """Look up the scores of the (result, query) pairs in the score cache (and `extra_scores`).
+        Pairs without a cached score are `None`.
+        """
+        if not (self.cacheable and self.configs.reranker_cache):
+            return [[None] * len(docs) for docs in results]
+        keys = [
+            [make_score_key(self.model_key, query_message, doc) for doc in docs]
+            for docs, query_message in zip(results, query_messages)
+        ]
+        found = dict(extra_scores or {})
+        found.update(
+            get_score_cache().get_many(
+                key for query_keys in keys for key in query_keys if key not in found
+            )
+        )
+        return [[found.get(key) for key in query_keys] for query_keys in keys]
+
+    async def __compute_similarities_with_deadline(
+        self, results: Sequence[list[str]], query_messages: Sequence[str]
+    ) -> list[Sequence[float]]:
+        timeout = self.configs.reranker_timeout
+        if timeout <= 0:
+            return await self.compute_similarities_with_cache(results, query_messages)
+        # the task runs in a copy of the context, so a timeout inside of it
+        # (for example, in a stage of `CascadeReranker`) is copied back.
+        context = contextvars.copy_context()
+        task = asyncio.get_running_loop().create_task(
+            self.compute_similarities_with_cache(results, query_messages),
+            context=context,
+        )
+        try:
+            # shielded so that the scores still land in the score cache (if enabled).
+            scores = await asyncio.wait_for(asyncio.shield(task), timeout)
+            if context.get(partial_rerank):
+                partial_rerank.set(True)
+            return scores
+        except TimeoutError:
+            if self.cacheable and self.configs.reranker_cache:
+                task.add_done_callback(_log_background_error)
+            else:
+                task.cancel()
+            logger.warning(
+                f"{self.__class__.__name__} ran out of its time budget ({timeout}s). Falling back to the distance order."
+            )
+            partial_rerank.set(True)
+            assert self._raw_results is not None
+            distances = self._raw_results["distances"]
+            assert distances is not None
+            return merge_partial_scores(
+                self.get_cached_scores(results, query_messages),
+                [[-float(i) for i in dist] for dist in distances[: len(results)]],
+            )
+
     async def rerank(self, results: QueryResult | dict) -> list[str]:
         self._raw_results = cast(QueryResult, results)
         query_chunks = self.configs.query
         assert query_chunks
         assert results["metadatas"] is not None
         assert results["documents"] is not None
-        documents: DefaultDict[str, list[float]] = defaultdict(list)
-        for query_chunk_idx in range(len(query_chunks)):
-            chunk_ids = results["ids"][query_chunk_idx]
-            chunk_metas = results["metadatas"][query_chunk_idx]
-            chunk_docs = results["documents"][query_chunk_idx]
-            scores = await self.compute_similarity(
-                chunk_docs, query_chunks[query_chunk_idx]
-            )
-            for i, score in enumerate(scores):
-                if QueryInclude.chunk in self.configs.include:
-                    documents[chunk_ids[i]].append(float(score))
-                else:
-                    documents[str(chunk_metas[i]["path"])].append(float(score))
-
-        logger.debug("Document scores: %s", documents)
-        top_k = int(numpy.mean(tuple(len(i) for i in documents.values())))
-        for key in documents.keys():
-            documents[key] = heapq.nlargest(top_k, documents[key])
+        partial_rerank.set(False)
+        all_scores = await self.__compute_similarities_with_deadline(
+            results["documents"][: len(query_chunks)], query_chunks
+        )
+        keys: list[str] = []
+        flat_scores: list[numpy.ndarray] = []
+        for query_chunk_idx, scores in enumerate(all_scores):
+            scores = numpy.asarray(scores, dtype=float).reshape(-1)
+            if QueryInclude.chunk in self.configs.include:
+                keys.extend(results["ids"][query_chunk_idx][: len(scores)])
+            else:
+                keys.extend(
+                    str(meta["path"])
+                    for meta in results["metadatas"][query_chunk_idx][: len(scores)]
+                )
+            flat_scores.append(scores)
 
         self._raw_results = None
+        if not keys:
+            return []
+        names, mean_scores = aggregate_scores(keys, numpy.concatenate(flat_scores))
+        logger.debug("Document scores: %s", dict(zip(names, mean_scores)))
+        return [names[i] for i in top_n_indices(mean_scores, self.n_result)]
+
+
+def _log_background_error(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Background reranking failed: {task.exception()!r}")
 
-        return heapq.nlargest(
-            self.n_result,
-            documents.keys(),
-            key=lambda x: float(numpy.mean(documents[x])),
+
+def merge_partial_scores(
+    partial_scores: Sequence[Sequence[Optional[float]]],
+    fallback_scores: Sequence[Sequence[float]],
+) -> list[list[float]]:
+    """
+    Combine the scores that were computed (`None` for the ones that weren't) with
+    the fallback scores, which may have a different scale.
+    The items with a computed score are placed before all of the other items (of all queries),
+    which keep the order of their fallback scores.
+    """
+    floor = (
+        min(
+            (i for scores in partial_scores for i in scores if i is not None),
+            default=0.0,
         )
+        - 1
+    )
+    merged: list[list[float]] = []
+    for partial, fallback in zip(partial_scores, fallback_scores):
+        order = numpy.argsort(-numpy.asarray(fallback, dtype=float), kind="stable")
+        final = numpy.empty(len(fallback), dtype=float)
+        final[order] = floor - numpy.arange(len(fallback)) / max(len(fallback), 1)
+        for i, score in enumerate(partial):
+            if score is not None:
+                final[i] = score
+        merged.append(final.tolist())
+    return merged
+
+
+def aggregate_scores(
+    keys: Sequence[str], scores: numpy.ndarray
+) -> tuple[list[str], numpy.ndarray]:
+    """
+    Group the `scores` by `keys`, and compute the mean of the `top_k` largest scores of each group,
+    where `top_k` is the average group size (rounded down).
+    Returns the unique keys (in the order of their first appearance) and their aggregated scores.
+    """
+    # number the groups by their first appearance so that ties are broken by the input order.
+    group_ids: dict[str, int] = {}
+    groups = numpy.fromiter(
+        (group_ids.setdefault(key, len(group_ids)) for key in keys),
+        dtype=numpy.intp,
+        count=len(keys),
+    )
+
+    counts = numpy.bincount(groups)
+    top_k = int(numpy.mean(counts))
+    # sort by group, then by decreasing score, and keep the first `top_k` of each group.
+    order = numpy.lexsort((-scores, groups))
+    sorted_groups = groups[order]
+    group_starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    rank_in_group = numpy.arange(len(order)) - group_starts[sorted_groups]
+    kept = rank_in_group < top_k
+    sums = numpy.bincount(
+        sorted_groups[kept], weights=scores[order][kept], minlength=len(counts)
+    )
+    return list(group_ids.keys()), sums / numpy.minimum(counts, top_k)
+
+
+def top_n_indices(scores: numpy.ndarray, n: int) -> list[int]:
+    """
+    Return the indices of the `n` largest `scores` in decreasing order.
+    Ties are broken by the index.
+    """
+    if n <= 0 or len(scores) == 0:
+        return []
+    candidates = numpy.arange(len(scores))
+    if n < len(scores):
+        threshold = numpy.partition(-scores, n - 1)[n - 1]
+        candidates = numpy.flatnonzero(-scores <= threshold)
+    order = numpy.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:n].tolist()
@@ -0,0 +1,111 @@
+import asyncio
+import dataclasses
+import logging
+from typing import Any, Optional, Sequence
+
+import numpy
+
+from vectorcode.cli_utils import Config
+
+from .base import RerankerBase, merge_partial_scores, partial_rerank
+from .cross_encoder import CrossEncoderReranker
+from .naive import NaiveReranker
+from .rrf import RRFReranker
+
+logger = logging.getLogger(name=__name__)
+
+_PREFILTERS: dict[str, type[RerankerBase]] = {
+    "NaiveReranker": NaiveReranker,
+    "RRFReranker": RRFReranker,
+}
+
+
+class CascadeReranker(RerankerBase):
+    """This reranker ranks the candidates with a cheap prefilter first, and only sends the top candidates of each query to `CrossEncoderReranker`.
+    configs.reranker_params accepts the following options:
+    - "prefilter": "NaiveReranker" (default, sort by the vector distance) or "RRFReranker" (fuse the vector and lexical rankings);
+    - "shortlist_size": the number of candidates per query that are scored by the cross encoder (default: 20);
+    - "prefilter_timeout" and "rerank_timeout": the time budgets (in seconds) of the 2 stages.
+      If the prefilter runs out of time, the vector search order is used. If the cross encoder runs out of time, the prefilter order is used;
+    - other options are passed to `CrossEncoderReranker`.
+    """
+
+    def __init__(self, configs: Config, **kwargs: Any):
+        super().__init__(configs)
+        params = dict(configs.reranker_params)
+        prefilter_name = str(params.pop("prefilter", "NaiveReranker"))
+        if prefilter_name not in _PREFILTERS:
+            raise ValueError(
+                f"Unsupported prefilter: {prefilter_name}. Supported: {list(_PREFILTERS.keys())}"
+            )
+        self.shortlist_size = int(params.pop("shortlist_size", 20))
+        assert self.shortlist_size > 0, "'shortlist_size' should be a positive integer."
+        self.prefilter_timeout: Optional[float] = params.pop("prefilter_timeout", None)
+        self.rerank_timeout: Optional[float] = params.pop("rerank_timeout", None)
+
+        self.prefilter = _PREFILTERS[prefilter_name](configs)
+        self.cross_encoder = CrossEncoderReranker(
+            dataclasses.replace(configs, reranker_params=params)
+        )
+
+    async def compute_similarity(
+        self, results: list[str], query_message: str
+    ) -> Sequence[float]:
+        return (await self.compute_similarities([results], [query_message]))[0]
+
+    async def __prefilter(
+        self, results: Sequence[list[str]], query_messages: Sequence[str]
+    ) -> list[Sequence[float]]:
+        self.prefilter._raw_results = self._raw_results
+        try:
+            return await asyncio.wait_for(
+                self.prefilter.compute_similarities(results, query_messages),
+                self.prefilter_timeout,
+            )
+        except TimeoutError:
+            logger.warning(
+                "The prefilter ran out of its time budget. Using the vector search order."
+            )
+            partial_rerank.set(True)
+            return [[-float(i) for i in range(len(docs))] for docs in results]
+        finally:
+            self.prefilter._raw_results = None
+
+    async def compute_similarities(
+        self, results: Sequence[list[str]], query_messages: Sequence[str]
+    ) -> list[Sequence[float]]:
+        prefilter_scores = await self.__prefilter(results, query_messages)
+        shortlists: list[numpy.ndarray] = []
+        for scores in prefilter_scores:
+            order = numpy.argsort(-numpy.asarray(scores, dtype=float), kind="stable")
+            shortlists.append(order[: self.shortlist_size])
+        logger.debug(
+            f"Sending {sum(len(i) for i in shortlists)} of {sum(len(i) for i in results)} candidates to the cross encoder."
+        )
+        try:
+            cross_scores = await asyncio.wait_for(
+                self.cross_encoder.compute_similarities_with_cache(
+                    [
+                        [docs[i] for i in shortlist]
+                        for docs, shortlist in zip(results, shortlists)
+                    ],
+                    query_messages,
+                ),
+                self.rerank_timeout,
+            )
+        except TimeoutError:
+            logger.warning(
+                "The cross encoder ran out of its time budget. Using the prefilter order."
+            )
+            partial_rerank.set(True)
+            return prefilter_scores
+
+        # the candidates that are not shortlisted keep their prefilter order,
+        # but are placed behind all of the shortlisted ones of all queries.
+        partial_scores: list[list[Optional[float]]] = []
+        for docs, shortlist, shortlist_scores in zip(results, shortlists, cross_scores):
+            partial: list[Optional[float]] = [None] * len(docs)
+            for i, score in zip(shortlist, shortlist_scores):
+                partial[i] = float(score)
+            partial_scores.append(partial)
+        return list(merge_partial_scores(partial_scores, prefilter_scores))
@@ -1,10 +1,13 @@
 import asyncio
+import json
 import logging
-from typing import Any
+from typing import Any, Sequence
 
 from vectorcode.cli_utils import Config
+from vectorcode.model_artifacts import CROSS_ENCODER, find_artifact
 
 from .base import RerankerBase
+from .pool import make_model_key, model_pool
 
 logger = logging.getLogger(name=__name__)
 
@@ -16,26 +19,72 @@ class CrossEncoderReranker(RerankerBase):
     Consult sentence_transformers documentation for details on the available parameters.
     """
 
+    cacheable = True
+    default_model = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
     def __init__(
         self,
         configs: Config,
         **kwargs: Any,
     ):
         super().__init__(configs)
-        from sentence_transformers import CrossEncoder
-
-        if configs.reranker_params.get("model_name_or_path") is None:
+        # copy the parameters so that the shared `configs.reranker_params` is untouched.
+        params = dict(configs.reranker_params)
+        model_name = params.pop("model_name_or_path", None)
+        if model_name is None:
             logger.warning(
-                "'model_name_or_path' is not set. Fallback to 'cross-encoder/ms-marco-MiniLM-L-6-v2'"
+                f"'model_name_or_path' is not set. Fallback to '{self.default_model}'"
             )
-            configs.reranker_params["model_name_or_path"] = (
-                "cross-encoder/ms-marco-MiniLM-L-6-v2"
-            )
-        model_name = configs.reranker_params.pop("model_name_or_path")
-        self.model = CrossEncoder(model_name, **configs.reranker_params)
+            model_name = self.default_model
+        self._model_key = make_model_key(
+            self.__class__.__name__, {"model_name_or_path": model_name, **params}
+        )
+        self.model = model_pool.get(
+            self._model_key, lambda: self.load_model(model_name, params)
+        )
+
+    def load_model(self, model_name: str, params: dict[str, Any]):
+        """
+        Load the model (from the artifact prepared by `vectorcode prepare`, if any).
+        The returned object should implement `predict` like `CrossEncoder`.
+        """
+        from sentence_transformers import CrossEncoder
+
+        artifact_path = find_artifact(CROSS_ENCODER, model_name)
+        if artifact_path is not None:
+            logger.info(f"Loading {model_name} from {artifact_path}.")
+            model_name = artifact_path
+        return CrossEncoder(model_name, **params)
+
+    @property
+    def model_key(self) -> str:
+        return json.dumps(self._model_key)
 
     async def compute_similarity(self, results: list[str], query_message: str):
         scores = await asyncio.to_thread(
             self.model.predict, [(chunk, query_message) for chunk in results]
         )
         return list(float(i) for i in scores)
+
+    async def compute_similarities(
+        self, results: Sequence[list[str]], query_messages: Sequence[str]
+    ) -> list[Sequence[float]]:
+        """
+        Score the (result, query) pairs of all query messages in a single `predict` call.
+        Duplicated pairs are only scored once, and the pairs are sorted by length so that
+        each batch holds inputs of similar lengths and wastes less padding.
+        """
+        pair_ids: dict[tuple[str, str], int] = {}
+        for docs, query_message in zip(results, query_messages):
+            for doc in docs:
+                pair_ids.setdefault((doc, query_message), len(pair_ids))
+        if not pair_ids:
+            return [[] for _ in results]
+        pairs = sorted(pair_ids.keys(), key=lambda x: len(x[0]) + len(x[1]))
+        logger.debug(f"Scoring {len(pairs)} unique pairs with the cross encoder.")
+        scores = await asyncio.to_thread(self.model.predict, pairs)
+        pair_scores = {pair: float(score) for pair, score in zip(pairs, scores)}
+        return [
+            [pair_scores[(doc, query_message)] for doc in docs]
+            for docs, query_message in zip(results, query_messages)
+        ]
@@ -0,0 +1,122 @@
+import logging
+from typing import Any, Optional, Sequence
+
+import numpy
+from chromadb.api.types import QueryResult
+
+from vectorcode.cli_utils import Config, QueryInclude
+
+from .base import RerankerBase, aggregate_scores, partial_rerank
+
+logger = logging.getLogger(name=__name__)
+
+
+def mmr_select(
+    relevance: numpy.ndarray, vectors: numpy.ndarray, n: int, lambda_mult: float
+) -> list[int]:
+    """
+    Greedily pick `n` items by [maximal marginal relevance](https://www.cs.cmu.edu/~jgc/publication/The_Use_MMR_Diversity_Based_LTMIR_1998.pdf):
+    each step picks the item that maximises
+    `lambda_mult * relevance - (1 - lambda_mult) * (max cosine similarity to the picked items)`.
+    The relevance is rescaled to [0, 1] so that it's comparable to the similarities.
+    Zero vectors (items without an embedding) are not similar to anything.
+    """
+    n = min(n, len(relevance))
+    if n <= 0:
+        return []
+    relevance = numpy.asarray(relevance, dtype=float)
+    spread = relevance.max() - relevance.min()
+    if spread > 0:
+        relevance = (relevance - relevance.min()) / spread
+    else:
+        relevance = numpy.ones_like(relevance)
+    vectors = numpy.asarray(vectors, dtype=float)
+    norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = numpy.divide(
+        vectors, norms, out=numpy.zeros_like(vectors), where=norms > 0
+    )
+    similarities = vectors @ vectors.T
+
+    selected = [int(numpy.argmax(relevance))]
+    max_similarities = similarities[selected[0]].copy()
+    available = numpy.ones(len(relevance), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < n:
+        mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarities
+        mmr_scores[~available] = -numpy.inf
+        picked = int(numpy.argmax(mmr_scores))
+        selected.append(picked)
+        available[picked] = False
+        numpy.maximum(max_similarities, similarities[picked], out=max_similarities)
+    return selected
+
+
+class MMRReranker(RerankerBase):
+    """This reranker picks a diverse set of results with [maximal marginal relevance](https://www.cs.cmu.edu/~jgc/publication/The_Use_MMR_Diversity_Based_LTMIR_1998.pdf).
+    The relevance of a result is based on its vector distances (like `NaiveReranker`), and results
+    that are similar to the ones that have already been picked are penalised,
+    so that the top results don't come from near-duplicate chunks.
+    The similarities are computed from the embeddings stored in the database.
+    configs.reranker_params["lambda"] balances relevance (1) and diversity (0) (default: 0.7).
+    """
+
+    require_embeddings = True
+
+    def __init__(self, configs: Config, **kwargs: Any):
+        super().__init__(configs)
+        self.lambda_mult = float(configs.reranker_params.get("lambda", 0.7))
+        assert 0 <= self.lambda_mult <= 1, "'lambda' should be between 0 and 1."
+
+    async def compute_similarity(
+        self, results: list[str], query_message: str
+    ) -> Sequence[float]:
+        assert self._raw_results is not None, "Expecting raw results from the database."
+        assert self.configs.query, "Expecting query messages in self.configs"
+        distances = self._raw_results.get("distances")
+        assert distances is not None, "QueryResult should contain distances!"
+        return [-i for i in distances[self.configs.query.index(query_message)]]
+
+    async def rerank(self, results: QueryResult | dict) -> list[str]:
+        query_chunks = self.configs.query
+        assert query_chunks
+        partial_rerank.set(False)
+        assert results["metadatas"] is not None
+        assert results["distances"] is not None
+        embeddings: Optional[list[Any]] = results.get("embeddings")
+        if embeddings is None:
+            logger.warning(
+                "The query results don't contain the embeddings. Ranking by relevance only."
+            )
+
+        keys: list[str] = []
+        relevance: list[float] = []
+        rows: list[Optional[numpy.ndarray]] = []
+        for query_idx in range(min(len(query_chunks), len(results["ids"]))):
+            ids = results["ids"][query_idx]
+            if QueryInclude.chunk in self.configs.include:
+                keys.extend(ids)
+            else:
+                keys.extend(
+                    str(meta["path"]) for meta in results["metadatas"][query_idx]
+                )
+            relevance.extend(-float(i) for i in results["distances"][query_idx])
+            query_embeddings = embeddings[query_idx] if embeddings is not None else []
+            for i in range(len(ids)):
+                # lexical-only hits (see `merge_lexical_hits`) don't have an embedding.
+                row = query_embeddings[i] if i < len(query_embeddings) else None
+                rows.append(None if row is None else numpy.asarray(row, dtype=float))
+        if not keys:
+            return []
+
+        names, mean_relevance = aggregate_scores(keys, numpy.asarray(relevance))
+        group_ids = {name: idx for idx, name in enumerate(names)}
+        dim = max((len(i) for i in rows if i is not None), default=0)
+        # the direction of a file is the mean of the directions of its chunks.
+        vectors = numpy.zeros((len(names), dim))
+        for key, row in zip(keys, rows):
+            if row is not None and len(row) == dim:
+                norm = numpy.linalg.norm(row)
+                if norm > 0:
+                    vectors[group_ids[key]] += row / norm
+        selected = mmr_select(mean_relevance, vectors, self.n_result, self.lambda_mult)
+        return [names[i] for i in selected]
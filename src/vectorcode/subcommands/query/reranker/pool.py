@@ -0,0 +1,80 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, TypeVar
+
+logger = logging.getLogger(name=__name__)
+
+T = TypeVar("T")
+
+
+def make_model_key(name: str, params: dict[str, Any]) -> tuple[str, str]:
+    """Make a hashable key from the name of a model class and its parameters."""
+    return (name, json.dumps(params, sort_keys=True, default=str))
+
+
+class ModelPool:
+    """
+    A process-wide cache of loaded models, so that the long-running servers (LSP and MCP)
+    don't reload a model for every request.
+    The least recently used model is evicted when the pool holds more than `max_size` models,
+    and models that haven't been used for `ttl` seconds are evicted on the next access.
+    """
+
+    def __init__(self, max_size: int = 2, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__models: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        # held while a model is loaded, so that only the callers of the same model wait.
+        self.__load_locks: dict[Hashable, threading.Lock] = {}
+
+    def __evict(self, now: float):
+        for key, (_, last_used) in list(self.__models.items()):
+            if now - last_used > self.ttl:
+                logger.info(f"Evicting idle model {key}.")
+                self.__models.pop(key)
+        while len(self.__models) > self.max_size:
+            key, _ = self.__models.popitem(last=False)
+            logger.info(f"Evicting least recently used model {key}.")
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """
+        Return the model saved under `key`. If it's not in the pool,
+        it'll be created by calling `factory` and saved in the pool.
+        """
+        with self.__lock:
+            load_lock = self.__load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self.__lock:
+                now = time.monotonic()
+                self.__evict(now)
+                if key in self.__models:
+                    model = self.__models.pop(key)[0]
+                    logger.debug(f"Reusing model {key} from the pool.")
+                    self.__models[key] = (model, now)
+                    return model
+            logger.info(f"Loading model {key}.")
+            model = factory()
+            with self.__lock:
+                now = time.monotonic()
+                self.__models[key] = (model, now)
+                self.__evict(now)
+            return model
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.__lock:
+            return key in self.__models
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__models)
+
+    def clear(self):
+        with self.__lock:
+            self.__models.clear()
+
+
+model_pool = ModelPool()
@@ -0,0 +1,38 @@
+import logging
+from typing import Any, Sequence
+
+from vectorcode.cli_utils import Config
+
+from .base import RerankerBase
+
+logger = logging.getLogger(name=__name__)
+
+
+class RRFReranker(RerankerBase):
+    """This reranker fuses the ranking from the vector search and the ranking from the lexical (BM25) index using [reciprocal rank fusion](https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf).
+    Set `lexical_index` to `true` in the config (and re-vectorise the project) to enable the lexical index.
+    Without the lexical index, this reranker sorts the chunks by the vector search ranking.
+    configs.reranker_params["k"] sets the smoothing constant of the fusion (default: 60).
+    """
+
+    def __init__(self, configs: Config, **kwargs: Any):
+        super().__init__(configs)
+        self.k = float(configs.reranker_params.get("k", 60))
+
+    async def compute_similarity(
+        self, results: list[str], query_message: str
+    ) -> Sequence[float]:
+        assert self._raw_results is not None, "Expecting raw results from the database."
+        assert self.configs.query, "Expecting query messages in self.configs"
+        idx = self.configs.query.index(query_message)
+        raw_results: dict[str, Any] = dict(self._raw_results)
+        vector_ranks: list[int | None] = list(range(len(results)))
+        lexical_ranks: list[int | None] = [None] * len(results)
+        if raw_results.get("vector_ranks") is not None:
+            vector_ranks = raw_results["vector_ranks"][idx]
+        if raw_results.get("lexical_ranks") is not None:
+            lexical_ranks = raw_results["lexical_ranks"][idx]
+        return [
+            sum(1 / (self.k + rank + 1) for rank in ranks if rank is not None)
+            for ranks in zip(vector_ranks, lexical_ranks)
+        ]
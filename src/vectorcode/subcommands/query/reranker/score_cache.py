@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+logger = logging.getLogger(name=__name__)
+
+SCORE_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".local", "share", "vectorcode", "reranker_scores.sqlite3"
+)
+
+
+def make_score_key(model_key: str, query: str, document: str) -> str:
+    """Make the cache key of the score of a (query, document) pair under a reranker model."""
+    return hashlib.sha256(
+        "\0".join(
+            (
+                model_key,
+                hashlib.sha256(query.encode()).hexdigest(),
+                hashlib.sha256(document.encode()).hexdigest(),
+            )
+        ).encode()
+    ).hexdigest()
+
+
+class ScoreCache:
+    """
+    A cache of reranker scores with an in-memory LRU tier and a SQLite tier on the disk.
+    Only the most recent `max_disk_entries` scores are kept on the disk.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_memory_entries: int = 100_000,
+        max_disk_entries: int = 1_000_000,
+    ):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.__lock = threading.Lock()
+        self.__memory: OrderedDict[str, float] = OrderedDict()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.__conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL NOT NULL)"
+            )
+
+    def __remember(self, key: str, score: float):
+        self.__memory[key] = score
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_memory_entries:
+            self.__memory.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, float]:
+        """Return the cached scores of `keys`. Missing keys are left out."""
+        found: dict[str, float] = {}
+        missing: list[str] = []
+        with self.__lock:
+            for key in dict.fromkeys(keys):
+                if key in self.__memory:
+                    self.__memory.move_to_end(key)
+                    found[key] = self.__memory[key]
+                else:
+                    missing.append(key)
+            # stay below SQLite's limit of host parameters.
+            for start in range(0, len(missing), 500):
+                batch = missing[start : start + 500]
+                for key, score in self.__conn.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({', '.join('?' for _ in batch)})",
+                    batch,
+                ):
+                    found[key] = score
+                    self.__remember(key, score)
+        return found
+
+    def put_many(self, scores: dict[str, float]):
+        if not scores:
+            return
+        with self.__lock, self.__conn:
+            for key, score in scores.items():
+                self.__remember(key, score)
+            self.__conn.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?)", scores.items()
+            )
+            # rowids keep increasing, so the smallest ones are the oldest entries.
+            self.__conn.execute(
+                "DELETE FROM scores WHERE rowid <= (SELECT MAX(rowid) FROM scores) - ?",
+                (self.max_disk_entries,),
+            )
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+__SCORE_CACHE: Optional[ScoreCache] = None
+
+
+def get_score_cache() -> ScoreCache:
+    """Return the process-wide reranker score cache."""
+    global __SCORE_CACHE
+    if __SCORE_CACHE is None:
+        logger.debug(f"Opening reranker score cache at {SCORE_CACHE_PATH}.")
+        __SCORE_CACHE = ScoreCache(SCORE_CACHE_PATH)
+    return __SCORE_CACHE
@@ -10,12 +10,22 @@ from chromadb.errors import InvalidCollectionException
 
 from vectorcode.cli_utils import Config
 from vectorcode.common import get_client, get_collection, verify_ef
-from vectorcode.subcommands.vectorise import VectoriseStats, chunked_add, show_stats
+from vectorcode.embedding_batcher import make_embedding_batcher
+from vectorcode.governor import apply_governor, get_indexing_concurrency
+from vectorcode.reduction import calibrate_from_files
+from vectorcode.subcommands.vectorise import (
+    VectoriseStats,
+    chunked_add,
+    delete_from_local_indices,
+    get_local_indices,
+    show_stats,
+)
 
 logger = logging.getLogger(name=__name__)
 
 
 async def update(configs: Config) -> int:
+    apply_governor(configs)
     client = await get_client(configs)
     try:
         collection = await get_collection(client, configs, False)
@@ -49,7 +59,9 @@ async def update(configs: Config) -> int:
     collection_lock = Lock()
     stats_lock = Lock()
     max_batch_size = await client.get_max_batch_size()
-    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    semaphore = asyncio.Semaphore(get_indexing_concurrency(configs))
+    batcher = make_embedding_batcher(configs)
+    await calibrate_from_files(configs, [str(i) for i in files], collection)
 
     with tqdm.tqdm(
         total=len(files), desc="Vectorising files...", disable=configs.pipe
@@ -67,6 +79,7 @@ async def update(configs: Config) -> int:
                         configs,
                         max_batch_size,
                         semaphore,
+                        batcher,
                     )
                 )
                 for file in files
@@ -81,6 +94,20 @@ async def update(configs: Config) -> int:
     if len(orphanes):
         logger.info(f"Removing {len(orphanes)} orphaned files from database.")
         await collection.delete(where={"path": {"$in": list(orphanes)}})
+        dependents = delete_from_local_indices(get_local_indices(configs), orphanes)
+        for file in dependents:
+            if os.path.isfile(file):
+                await chunked_add(
+                    file,
+                    collection,
+                    collection_lock,
+                    stats,
+                    stats_lock,
+                    configs,
+                    max_batch_size,
+                    semaphore,
+                    batcher,
+                )
 
     show_stats(configs, stats)
     return 0
@@ -5,6 +5,7 @@ import logging
 import os
 import sys
 import uuid
+import weakref
 from asyncio import Lock
 from dataclasses import dataclass, fields
 from typing import Iterable, Optional
@@ -15,6 +16,7 @@ import tqdm
 from chromadb.api.models.AsyncCollection import AsyncCollection
 from chromadb.api.types import IncludeEnum
 
+from vectorcode.centroids import CentroidIndex, get_centroid_index
 from vectorcode.chunking import Chunk, TreeSitterChunker
 from vectorcode.cli_utils import (
     GLOBAL_EXCLUDE_SPEC,
@@ -26,9 +28,22 @@ from vectorcode.cli_utils import (
 from vectorcode.common import (
     get_client,
     get_collection,
+    get_embedding_function,
     list_collection_files,
     verify_ef,
 )
+from vectorcode.dedup import DedupIndex, get_dedup_index
+from vectorcode.embedding_batcher import EmbeddingBatcher, make_embedding_batcher
+from vectorcode.embedding_pool import get_embedding_pool
+from vectorcode.embedding_registry import embed
+from vectorcode.governor import (
+    apply_governor,
+    get_indexing_concurrency,
+    yield_to_queries,
+)
+from vectorcode.lexical import LexicalIndex, get_lexical_index
+from vectorcode.reduction import RECALL_K, calibrate_from_files
+from vectorcode.symbols import SymbolIndex, get_symbol_index
 
 logger = logging.getLogger(name=__name__)
 
@@ -80,6 +95,54 @@ def get_uuid() -> str:
     return uuid.uuid4().hex
 
 
+def get_local_indices(
+    configs: Config, make_if_missing: bool = False
+) -> list[LexicalIndex | SymbolIndex | CentroidIndex | DedupIndex]:
+    """
+    Return the enabled local indices (lexical, symbol, centroid, near-duplicate) that have to be kept in sync with the collection.
+    """
+    return [
+        i
+        for i in (
+            get_lexical_index(configs, make_if_missing),
+            get_symbol_index(configs, make_if_missing),
+            get_centroid_index(configs, make_if_missing),
+            get_dedup_index(configs, make_if_missing),
+        )
+        if i is not None
+    ]
+
+
+def delete_from_local_indices(
+    local_indices: Iterable[LexicalIndex | SymbolIndex | CentroidIndex | DedupIndex],
+    paths: Iterable[str],
+) -> list[str]:
+    """
+    Remove `paths` from the local indices. Return the other files that have to be
+    vectorised again because their chunks were collapsed into the removed chunks.
+    """
+    paths = list(paths)
+    dependents: list[str] = []
+    for local_index in local_indices:
+        if isinstance(local_index, DedupIndex):
+            dependents.extend(local_index.delete(paths))
+        else:
+            local_index.delete(paths)
+    return dependents
+
+
+__path_locks: weakref.WeakValueDictionary[str, Lock] = weakref.WeakValueDictionary()
+
+
+def __get_path_lock(path: str) -> Lock:
+    """The lock that prevents the same file from being vectorised twice at the same time."""
+    lock = __path_locks.get(path)
+    if lock is None:
+        lock = Lock()
+        __path_locks[path] = lock
+    return lock
+
+
 async def chunked_add(
     file_path: str,
     collection: AsyncCollection,
@@ -89,10 +152,63 @@ async def chunked_add(
     configs: Config,
     max_batch_size: int,
     semaphore: asyncio.Semaphore,
+    batcher: Optional[EmbeddingBatcher] = None,
 ):
-    full_path_str = str(expand_path(str(file_path), True))
+    """
+    Vectorise a file (unless it's unchanged). The other files whose chunks were collapsed
+    into the removed chunks of the file are vectorised again, so that their content
+    doesn't disappear from the search. Each file is vectorised at most once per call.
+    """
+    pending = [str(expand_path(str(file_path), True))]
+    visited: set[str] = set()
+    while pending:
+        full_path_str = pending.pop(0)
+        if full_path_str in visited:
+            continue
+        visited.add(full_path_str)
+        async with __get_path_lock(full_path_str):
+            dependents = await __add_file(
+                full_path_str,
+                collection,
+                collection_lock,
+                stats,
+                stats_lock,
+                configs,
+                max_batch_size,
+                semaphore,
+                batcher,
+            )
+        if dependents:
+            logger.debug(
+                f"Vectorising {len(dependents)} file(s) that referenced the chunks of {full_path_str} again."
+            )
+        pending.extend(i for i in dependents if os.path.isfile(i))
+
+
+async def __add_file(
+    full_path_str: str,
+    collection: AsyncCollection,
+    collection_lock: Lock,
+    stats: VectoriseStats,
+    stats_lock: Lock,
+    configs: Config,
+    max_batch_size: int,
+    semaphore: asyncio.Semaphore,
+    batcher: Optional[EmbeddingBatcher] = None,
+) -> list[str]:
+    """Vectorise a file and return the files that have to be vectorised again."""
+    dependents: list[str] = []
     orig_sha256 = None
     new_sha256 = hash_file(full_path_str)
+    lexical_index = get_lexical_index(configs, make_if_missing=True)
+    symbol_index = get_symbol_index(configs, make_if_missing=True)
+    centroid_index = get_centroid_index(configs, make_if_missing=True)
+    dedup_index = get_dedup_index(configs, make_if_missing=True)
+    local_indices = [
+        i
+        for i in (lexical_index, symbol_index, centroid_index, dedup_index)
+        if i is not None
+    ]
     async with collection_lock:
         existing_chunks = await collection.get(
             where={"path": full_path_str},
@@ -101,12 +217,16 @@ async def chunked_add(
         num_existing_chunks = len((existing_chunks)["ids"])
         if existing_chunks["metadatas"]:
             orig_sha256 = existing_chunks["metadatas"][0].get("sha256")
-    if orig_sha256 and orig_sha256 == new_sha256:
+    if (
+        orig_sha256
+        and orig_sha256 == new_sha256
+        and all(i.has_path(full_path_str) for i in local_indices)
+    ):
         logger.debug(
             f"Skipping {full_path_str} because it's unchanged since last vectorisation."
         )
         stats.skipped += 1
-        return
+        return dependents
 
     if num_existing_chunks:
         logger.debug(
@@ -114,18 +234,19 @@ async def chunked_add(
         )
         async with collection_lock:
             await collection.delete(where={"path": full_path_str})
+            dependents = delete_from_local_indices(local_indices, [full_path_str])
 
-    logger.debug(f"Vectorising {file_path}")
+    logger.debug(f"Vectorising {full_path_str}")
     try:
         async with semaphore:
-            chunks: list[Chunk | str] = list(
-                TreeSitterChunker(configs).chunk(full_path_str)
-            )
+            await yield_to_queries(configs)
+            chunker = TreeSitterChunker(configs)
+            chunks: list[Chunk | str] = list(chunker.chunk(full_path_str))
             if len(chunks) == 0 or (len(chunks) == 1 and chunks[0] == ""):
                 # empty file
                 logger.debug(f"Skipping {full_path_str} because it's empty.")
                 stats.skipped += 1
-                return
+                return dependents
             chunks.append(str(os.path.relpath(full_path_str, configs.project_root)))
             logger.debug(f"Chunked into {len(chunks)} pieces.")
             metas = []
@@ -139,18 +260,88 @@ async def chunked_add(
                     meta["end"] = chunk.end.row
 
                 metas.append(meta)
+            chunk_ids = [get_uuid() for _ in chunks]
+            dedup_plan = None
+            if dedup_index is not None:
+                async with collection_lock:
+                    dedup_plan = dedup_index.plan(
+                        full_path_str, chunk_ids, [str(i) for i in chunks], metas
+                    )
+                keep = dedup_plan.keep
+                if not all(keep):
+                    logger.debug(
+                        f"Skipping {keep.count(False)} near-duplicate chunk(s) of {full_path_str}."
+                    )
+                    chunks = [i for i, k in zip(chunks, keep) if k]
+                    metas = [i for i, k in zip(metas, keep) if k]
+                    chunk_ids = [i for i, k in zip(chunk_ids, keep) if k]
+            # embedded outside of the lock, so that the files that are processed
+            # concurrently are embedded at the same time (and the batcher can group
+            # their chunks). The lock is only held to write the embeddings.
+            embeddings = None
+            if batcher is not None:
+                embeddings = await batcher.embed([str(i) for i in chunks])
+            else:
+                embedding_function = get_embedding_function(configs)
+                if embedding_function is not None:
+                    embeddings = await asyncio.to_thread(
+                        embed, embedding_function, [str(i) for i in chunks]
+                    )
+            await yield_to_queries(configs)
             async with collection_lock:
                 for idx in range(0, len(chunks), max_batch_size):
                     inserted_chunks = chunks[idx : idx + max_batch_size]
-                    await collection.add(
-                        ids=[get_uuid() for _ in inserted_chunks],
-                        documents=[str(i) for i in inserted_chunks],
-                        metadatas=metas,
-                    )
+                    ids = chunk_ids[idx : idx + max_batch_size]
+                    documents = [str(i) for i in inserted_chunks]
+                    batch_metas = metas[idx : idx + max_batch_size]
+                    if embeddings is None:
+                        await collection.add(
+                            ids=ids,
+                            documents=documents,
+                            metadatas=batch_metas,
+                        )
+                    else:
+                        await collection.add(
+                            ids=ids,
+                            documents=documents,
+                            metadatas=batch_metas,
+                            embeddings=embeddings[idx : idx + max_batch_size],
+                        )
+                    if lexical_index is not None:
+                        lexical_index.add(ids, documents, batch_metas)
+                if symbol_index is not None:
+                    symbol_index.add(full_path_str, chunker.symbols)
+                if dedup_index is not None and dedup_plan is not None:
+                    # recorded after the chunks are stored, so that a failed `add`
+                    # doesn't leave references to chunks that aren't in the collection.
+                    dedup_index.add(dedup_plan)
+                if centroid_index is not None:
+                    if embeddings is None:
+                        # read the embeddings back so that the chunks aren't embedded twice.
+                        added_chunks = await collection.get(
+                            where={"path": full_path_str},
+                            include=[IncludeEnum.embeddings],
+                        )
+                        embeddings = added_chunks.get("embeddings")
+                    if (
+                        embeddings is not None
+                        and dedup_plan is not None
+                        and dedup_plan.duplicates
+                    ):
+                        # the collapsed chunks count as the chunks that they duplicate,
+                        # so that the centroid reflects the content of the whole file.
+                        embeddings = [
+                            *embeddings,
+                            *await get_canonical_embeddings(
+                                collection, [i[2] for i in dedup_plan.duplicates]
+                            ),
+                        ]
+                    if embeddings is not None and len(embeddings):
+                        centroid_index.add(full_path_str, embeddings)
     except (UnicodeDecodeError, UnicodeError):  # pragma: nocover
         logger.warning(f"Failed to decode {full_path_str}.")
         stats.failed += 1
-        return
+        return dependents
 
     if num_existing_chunks:
         async with stats_lock:
@@ -158,6 +349,22 @@ async def chunked_add(
     else:
         async with stats_lock:
             stats.add += 1
+    return dependents
+
+
+async def get_canonical_embeddings(
+    collection: AsyncCollection, canonical_ids: list[str]
+) -> list:
+    """The embeddings of the stored chunks that `canonical_ids` refer to, in that order."""
+    canonical_chunks = await collection.get(
+        ids=list(dict.fromkeys(canonical_ids)), include=[IncludeEnum.embeddings]
+    )
+    if canonical_chunks.get("embeddings") is None:
+        return []
+    canonical_embeddings = dict(
+        zip(canonical_chunks["ids"], canonical_chunks["embeddings"])
+    )
+    return [canonical_embeddings[i] for i in canonical_ids if i in canonical_embeddings]
 
 
 async def remove_orphanes(
@@ -165,7 +372,13 @@ async def remove_orphanes(
     collection_lock: Lock,
     stats: VectoriseStats,
     stats_lock: Lock,
-):
+    configs: Optional[Config] = None,
+) -> list[str]:
+    """
+    Remove the files that no longer exist from the collection and the local indices.
+    Return the files that have to be vectorised again (see `delete_from_local_indices`).
+    """
+    dependents: list[str] = []
     async with collection_lock:
         paths = await list_collection_files(collection)
         orphans = set()
@@ -177,6 +390,11 @@ async def remove_orphanes(
         if len(orphans):
             logger.info(f"Removing {len(orphans)} orphaned files from database.")
             await collection.delete(where={"path": {"$in": list(orphans)}})
+            if configs is not None:
+                dependents = delete_from_local_indices(
+                    get_local_indices(configs), orphans
+                )
+    return [i for i in dependents if os.path.isfile(i)]
 
 
 def show_stats(configs: Config, stats: VectoriseStats):
@@ -251,6 +469,7 @@ def find_exclude_specs(configs: Config) -> list[str]:
 
 async def vectorise(configs: Config) -> int:
     assert configs.project_root is not None
+    apply_governor(configs)
     client = await get_client(configs)
     try:
         collection = await get_collection(client, configs, True)
@@ -280,7 +499,14 @@ async def vectorise(configs: Config) -> int:
     collection_lock = Lock()
     stats_lock = Lock()
     max_batch_size = await client.get_max_batch_size()
-    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    semaphore = asyncio.Semaphore(get_indexing_concurrency(configs))
+    batcher = make_embedding_batcher(configs)
+    recall = await calibrate_from_files(configs, [str(i) for i in files], collection)
+    if recall is not None and not configs.pipe:
+        print(
+            f"Recall@{RECALL_K} of the reduced embeddings: {recall:.3f}",
+            file=sys.stderr,
+        )
 
     with tqdm.tqdm(
         total=len(files), desc="Vectorising files...", disable=configs.pipe
@@ -297,6 +523,7 @@ async def vectorise(configs: Config) -> int:
                         configs,
                         max_batch_size,
                         semaphore,
+                        batcher,
                     )
                 )
                 for file in files
@@ -308,7 +535,23 @@ async def vectorise(configs: Config) -> int:
             print("Abort.", file=sys.stderr)
             return 1
 
-    await remove_orphanes(collection, collection_lock, stats, stats_lock)
+    for file in await remove_orphanes(
+        collection, collection_lock, stats, stats_lock, configs
+    ):
+        await chunked_add(
+            file,
+            collection,
+            collection_lock,
+            stats,
+            stats_lock,
+            configs,
+            max_batch_size,
+            semaphore,
+            batcher,
+        )
 
     show_stats(configs=configs, stats=stats)
+    pool = get_embedding_pool(configs)
+    if pool is not None and pool.stats and not configs.pipe:
+        print(pool.report(), file=sys.stderr)
     return 0
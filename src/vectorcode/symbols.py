@@ -0,0 +1,127 @@
+import logging
+import re
+from typing import Iterable, Optional, Sequence
+
+from vectorcode.chunking import Symbol
+from vectorcode.cli_utils import Config
+from vectorcode.sqlite_index import SQLiteIndex, open_index
+
+logger = logging.getLogger(name=__name__)
+
+SYMBOL_INDEX_FILE = "symbols.sqlite3"
+
+
+def get_symbol_name(query: str) -> Optional[str]:
+    """
+    Return the symbol name to look up for a query keyword, or None if the keyword
+    doesn't look like an identifier.
+    Qualified names (`module.func`, `Class::method`) are reduced to the last component.
+    """
+    query = query.strip()
+    if not re.fullmatch(r"[\w.:$]+", query):
+        return None
+    name = re.split(r"\.|::", query)[-1]
+    if not re.fullmatch(r"[A-Za-z_$][\w$]*", name):
+        return None
+    return name
+
+
+class SymbolIndex(SQLiteIndex):
+    """
+    A table of the definitions found by the treesitter chunker, backed by SQLite.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS symbols (
+            name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);
+        CREATE INDEX IF NOT EXISTS symbols_path ON symbols(path);
+        CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY);
+    """
+
+    def add(self, path: str, symbols: Sequence[Symbol]):
+        """
+        Save the symbols of a file. The file will be marked as indexed even if
+        it contains no symbols.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO files VALUES (?)", (path,))
+            self._conn.executemany(
+                "INSERT INTO symbols VALUES (?, ?, ?, ?, ?)",
+                ((i.name, i.kind, path, i.start, i.end) for i in symbols),
+            )
+
+    def delete(self, paths: Iterable[str]):
+        with self._lock, self._conn:
+            for path in paths:
+                self._conn.execute("DELETE FROM symbols WHERE path = ?", (path,))
+                self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def has_path(self, path: str) -> bool:
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM files WHERE path = ?", (path,)
+                ).fetchone()
+                is not None
+            )
+
+    def lookup(
+        self, name: str, n_results: int, exclude_paths: Sequence[str] = ()
+    ) -> list[Symbol]:
+        """
+        Return at most `n_results` symbols, with the exact matches
+        of `name` before the prefix matches.
+        """
+        if n_results <= 0:
+            return []
+        exclude_clause = ""
+        if exclude_paths:
+            exclude_clause = (
+                f" AND path NOT IN ({', '.join('?' for _ in exclude_paths)})"
+            )
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, kind, path, start, end FROM symbols "
+                f"WHERE name = ?{exclude_clause} ORDER BY path, start LIMIT ?",
+                (name, *exclude_paths, n_results),
+            ).fetchall()
+            if len(rows) < n_results:
+                # range scan so that the index on `name` is used.
+                rows.extend(
+                    self._conn.execute(
+                        "SELECT name, kind, path, start, end FROM symbols "
+                        f"WHERE name > ? AND name < ?{exclude_clause} "
+                        "ORDER BY length(name), name, path, start LIMIT ?",
+                        (
+                            name,
+                            name + "\U0010ffff",
+                            *exclude_paths,
+                            n_results - len(rows),
+                        ),
+                    ).fetchall()
+                )
+        return [
+            Symbol(name=row[0], kind=row[1], path=row[2], start=row[3], end=row[4])
+            for row in rows
+        ]
+
+
+def get_symbol_index(
+    configs: Config, make_if_missing: bool = False
+) -> Optional[SymbolIndex]:
+    """
+    Return the symbol index of the collection for `configs.project_root`.
+    Return None if `configs.symbol_index` is disabled,
+    or if the index doesn't exist and `make_if_missing` is False.
+    """
+    if not configs.symbol_index:
+        return None
+    return open_index(
+        configs, SYMBOL_INDEX_FILE, SymbolIndex, make_if_missing, "Symbol index"
+    )
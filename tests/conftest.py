@@ -1,6 +1,10 @@
+import os
+from unittest.mock import patch
+
 import pytest
 
 from vectorcode.cli_utils import GLOBAL_CONFIG_DIR
+from vectorcode.sqlite_index import close_indices
 
 
 @pytest.fixture(autouse=True)
@@ -9,3 +13,15 @@ def restore_global_config_path():
     original_global_config_path = GLOBAL_CONFIG_DIR
     yield
     GLOBAL_CONFIG_DIR = original_global_config_path
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    """
+    A temporary `GLOBAL_INDEX_DIR` for the local indices of the collections.
+    The indices that were opened in it are closed afterwards.
+    """
+    with patch("vectorcode.common.GLOBAL_INDEX_DIR", str(tmp_path)):
+        yield str(tmp_path)
+        for collection_name in os.listdir(tmp_path):
+            close_indices(collection_name)
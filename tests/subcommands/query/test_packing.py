@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+from vectorcode.subcommands.query.packing import (
+    Span,
+    get_chunk_spans,
+    get_file_spans,
+    merge_spans,
+    pack_results,
+    slice_lines,
+)
+
+
+def make_file(directory: str, name: str, num_lines: int) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "w") as fout:
+        fout.writelines(f"line {i}\n" for i in range(1, num_lines + 1))
+    return path
+
+
+def test_slice_lines():
+    lines = [f"line {i}\n" for i in range(1, 6)]
+    assert slice_lines(lines, 2, 3) == "line 2\nline 3\n"
+    assert slice_lines(lines, 0, 1) == "line 1\n"
+    assert slice_lines(lines, 5, 10) == "line 5\n"
+
+
+def test_merge_spans():
+    spans = [
+        Span("a", 10, 12, rank=3),
+        Span("a", 1, 3, rank=2),
+        Span("a", 4, 5, rank=0),
+        Span("b", 1, 3, rank=1),
+        Span("a", 2, 4, rank=4),
+    ]
+    assert merge_spans(spans) == [
+        Span("a", 1, 5, rank=0),
+        Span("b", 1, 3, rank=1),
+        Span("a", 10, 12, rank=3),
+    ]
+
+
+def test_get_chunk_spans():
+    results = {
+        "ids": [["id1", "id2", "id3"], ["id2", "id1"]],
+        "metadatas": [
+            [
+                {"path": "a", "start": 1, "end": 2},
+                {"path": "b", "start": 3, "end": 4},
+                {"path": "c"},
+            ],
+            [{"path": "b", "start": 3, "end": 4}, {"path": "a", "start": 1, "end": 2}],
+        ],
+        "distances": [[0.3, 0.5, 0.6], [0.1, 0.4]],
+    }
+    spans = get_chunk_spans(results)
+    assert spans == {"id1": Span("a", 1, 2, rank=1), "id2": Span("b", 3, 4, rank=0)}
+    assert get_file_spans(spans.values()) == {
+        "b": [Span("b", 3, 4, rank=0)],
+        "a": [Span("a", 1, 2, rank=1)],
+    }
+
+
+def test_pack_results_documents():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        small = make_file(tmp_dir, "small.py", 2)
+        large = make_file(tmp_dir, "large.py", 100)
+        other = make_file(tmp_dir, "other.py", 3)
+        budget = 2 * len("line 1\n") + 4 * len("line 10\n") + 3 * len("line 1\n")
+
+        results = pack_results(
+            [small, large, other],
+            budget,
+            {large: [Span(large, 50, 51), Span(large, 10, 11), Span(large, 52, 60)]},
+        )
+
+        assert [(i.path, i.start, i.end) for i in results] == [
+            (small, None, None),
+            # the spans of the same file are in the order of the lines.
+            (large, 10, 11),
+            (large, 50, 51),
+            (other, None, None),
+        ]
+        assert results[0].text == "line 1\nline 2\n"
+        assert results[2].text == "line 50\nline 51\n"
+        assert sum(len(i.text) for i in results) <= budget
+
+
+def test_pack_results_chunks():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = make_file(tmp_dir, "foo.py", 20)
+        results = pack_results(
+            [
+                Span(path, 5, 6),
+                Span(path, 10, 12),
+                Span(path, 6, 8),
+                Span(path, 1, 20),
+                Span(os.path.join(tmp_dir, "missing.py"), 1, 2),
+            ],
+            100,
+        )
+
+        # overlapping chunks are merged and only the new lines are counted.
+        assert [(i.start, i.end) for i in results] == [(5, 8), (10, 12)]
+        assert results[0].text == "".join(f"line {i}\n" for i in range(5, 9))
+
+
+def test_pack_results_zero_budget():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = make_file(tmp_dir, "foo.py", 2)
+        assert pack_results([path], 0) == []
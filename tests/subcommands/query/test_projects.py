@@ -0,0 +1,212 @@
+from unittest.mock import AsyncMock, MagicMock, mock_open, patch
+
+import pytest
+
+from vectorcode.cli_utils import Config, QueryInclude
+from vectorcode.subcommands.query.projects import (
+    ProjectCollection,
+    get_multi_project_results,
+    get_project_roots,
+    get_rank_distances,
+    merge_query_results,
+)
+
+
+def make_result(prefix: str, path: str):
+    return {
+        "ids": [[f"{prefix}1", f"{prefix}2"]],
+        "distances": [[0.1, 0.2]],
+        "metadatas": [
+            [{"path": path, "start": 1, "end": 1}, {"path": path, "start": 2, "end": 2}]
+        ],
+        "documents": [[f"{prefix} doc1", f"{prefix} doc2"]],
+    }
+
+
+def test_merge_query_results():
+    result_a = make_result("a", "/a/file.py")
+    result_a["vector_ranks"] = [[0, None]]
+    result_a["lexical_ranks"] = [[None, 0]]
+    merged = merge_query_results([result_a, make_result("b", "/b/file.py")])
+    assert merged["ids"] == [["a1", "a2", "b1", "b2"]]
+    assert merged["distances"] == [[0.1, 0.2, 0.1, 0.2]]
+    assert merged["documents"][0][2] == "b doc1"
+    assert merged["vector_ranks"] == [[0, None, 0, 1]]
+    assert merged["lexical_ranks"] == [[None, 0, None, None]]
+    assert merge_query_results([])["ids"] == []
+    assert "embeddings" not in merged
+
+
+def test_merge_query_results_embeddings():
+    result_a = make_result("a", "/a/file.py")
+    # the second entry is a lexical-only hit.
+    result_a["embeddings"] = [[[1.0, 0.0]]]
+    result_b = make_result("b", "/b/file.py")
+    result_b["embeddings"] = [[[0.0, 1.0], [1.0, 1.0]]]
+    merged = merge_query_results([result_a, result_b])
+    assert merged["embeddings"] == [[[1.0, 0.0], None, [0.0, 1.0], [1.0, 1.0]]]
+
+
+def test_get_rank_distances():
+    distances = get_rank_distances([0.5, 0.1, 0.9])
+    assert distances[1] < distances[0] < distances[2]
+    assert distances[1] == pytest.approx(1 - 1 / 61)
+    assert get_rank_distances([]) == []
+
+
+def test_merge_query_results_mixed_embedding_keys():
+    result_a = make_result("a", "/a/file.py")
+    result_a["embeddings"] = [[[1.0, 0.0], [0.0, 1.0]]]
+    result_b = make_result("b", "/b/file.py")
+    result_b["distances"] = [[300.0, 400.0]]
+    result_b["embeddings"] = [[[1.0], [0.0]]]
+
+    merged = merge_query_results([result_a, result_b], ["x", "x"])
+    assert merged["distances"] == [[0.1, 0.2, 300.0, 400.0]]
+    assert "embeddings" in merged
+
+    # the distances of different embedding functions are replaced by their ranks.
+    merged = merge_query_results([result_a, result_b], ["x", "y"])
+    assert merged["distances"][0][0] == merged["distances"][0][2]
+    assert merged["distances"][0][1] == merged["distances"][0][3]
+    assert merged["distances"][0][0] < merged["distances"][0][1]
+    assert "embeddings" not in merged
+
+
+@pytest.mark.asyncio
+async def test_get_project_roots():
+    configs = Config(project_root="/a", query_projects=["/b", "/a/"])
+    assert await get_project_roots(configs) == ["/a", "/b"]
+
+    async def fake_collections(_):
+        for path in ("/b", "/c"):
+            collection = MagicMock()
+            collection.metadata = {"path": path}
+            yield collection
+
+    configs.query_all_projects = True
+    with (
+        patch("vectorcode.subcommands.query.projects.get_client"),
+        patch(
+            "vectorcode.subcommands.query.projects.get_collections",
+            side_effect=fake_collections,
+        ),
+    ):
+        assert await get_project_roots(configs) == ["/a", "/b", "/c"]
+
+
+@pytest.mark.asyncio
+async def test_get_multi_project_results():
+    configs = Config(
+        query=["hello"],
+        n_result=3,
+        project_root="/a",
+        query_projects=["/b"],
+        include=[QueryInclude.path, QueryInclude.document],
+        reranker="NaiveReranker",
+    )
+    projects = [
+        ProjectCollection("/a", Config(project_root="/a"), AsyncMock()),
+        ProjectCollection("/b", Config(project_root="/b"), AsyncMock()),
+    ]
+    embedding_function = MagicMock(return_value=[[0.1, 0.2]])
+    with (
+        patch(
+            "vectorcode.subcommands.query.projects.get_project_collections",
+            return_value=projects,
+        ),
+        patch(
+            "vectorcode.subcommands.query.projects.get_embedding_function",
+            return_value=embedding_function,
+        ),
+        patch(
+            "vectorcode.subcommands.query.projects.get_raw_query_results",
+            side_effect=[
+                make_result("a", "/a/file.py"),
+                make_result("b", "/b/file.py"),
+            ],
+        ) as mock_get_raw_results,
+        patch("os.path.isfile", return_value=True),
+        patch("builtins.open", mock_open(read_data="content")),
+    ):
+        results = await get_multi_project_results(configs)
+
+    # both projects use the default embedding function, so the query is embedded once.
+    embedding_function.assert_called_once_with(["hello"])
+    assert all(
+        call.args[3] == [[0.1, 0.2]] for call in mock_get_raw_results.call_args_list
+    )
+    assert sorted((i["project"], i["path"]) for i in results) == [
+        ("/a", "file.py"),
+        ("/b", "file.py"),
+    ]
+    assert all(i["document"] == "content" for i in results)
+
+
+@pytest.mark.asyncio
+async def test_get_multi_project_results_chunk_mode():
+    configs = Config(
+        query=["hello"],
+        n_result=1,
+        project_root="/a",
+        query_projects=["/b"],
+        include=[QueryInclude.path, QueryInclude.chunk],
+        reranker="NaiveReranker",
+        use_absolute_path=True,
+    )
+    projects = [ProjectCollection("/b", Config(project_root="/b"), AsyncMock())]
+    with (
+        patch(
+            "vectorcode.subcommands.query.projects.get_project_collections",
+            return_value=projects,
+        ),
+        patch(
+            "vectorcode.subcommands.query.projects.get_embedding_function",
+            return_value=MagicMock(return_value=[[0.1]]),
+        ),
+        patch(
+            "vectorcode.subcommands.query.projects.get_raw_query_results",
+            return_value=make_result("b", "/b/file.py"),
+        ),
+        patch("builtins.open", mock_open(read_data="line1\nline2\n")),
+    ):
+        results = await get_multi_project_results(configs)
+    assert results == [
+        {
+            "chunk": "line1\n",
+            "start_line": 1,
+            "end_line": 1,
+            "path": "/b/file.py",
+            "project": "/b",
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_multi_project_results_no_project():
+    with patch(
+        "vectorcode.subcommands.query.projects.get_project_collections",
+        return_value=[],
+    ):
+        assert await get_multi_project_results(Config(query=["hello"])) == []
+
+
+@pytest.mark.asyncio
+async def test_get_multi_project_results_empty_projects():
+    collection = AsyncMock()
+    collection.count.return_value = 0
+    projects = [ProjectCollection("/b", Config(project_root="/b"), collection)]
+    with (
+        patch(
+            "vectorcode.subcommands.query.projects.get_project_collections",
+            return_value=projects,
+        ),
+        patch("vectorcode.subcommands.query.get_reranker") as mock_get_reranker,
+        patch(
+            "vectorcode.subcommands.query.projects.get_raw_query_results"
+        ) as mock_get_raw_results,
+    ):
+        assert await get_multi_project_results(Config(query=["hello"])) == []
+    # the reranker isn't loaded when there's nothing to rerank.
+    mock_get_reranker.assert_not_called()
+    mock_get_raw_results.assert_not_called()
@@ -1,3 +1,9 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
 from unittest.mock import AsyncMock, MagicMock, mock_open, patch
 
 import pytest
@@ -6,10 +12,20 @@ from chromadb.api.models.AsyncCollection import AsyncCollection
 from chromadb.api.types import IncludeEnum
 from chromadb.errors import InvalidCollectionException, InvalidDimensionException
 
+from vectorcode.chunking import Symbol
 from vectorcode.cli_utils import CliAction, Config, QueryInclude
+from vectorcode.dedup import DuplicateReference
+from vectorcode.lexical import LexicalHit
 from vectorcode.subcommands.query import (
+    blend_results,
     build_query_results,
+    get_exact_symbols,
+    get_packed_results,
     get_query_result_files,
+    get_symbol_results,
+    iter_query_results,
+    merge_duplicate_references,
+    merge_lexical_hits,
     query,
 )
 from vectorcode.subcommands.query.reranker import (
@@ -121,6 +137,278 @@ async def test_get_query_result_files_include_chunk(mock_collection, mock_config
         assert kwargs["n_results"] == 3  # n_result should be used directly
 
 
+def test_merge_lexical_hits(mock_collection):
+    results = mock_collection.query.return_value
+    merged = merge_lexical_hits(
+        results,
+        [
+            [
+                LexicalHit(id="id3", path="file3.py", document="content3", score=2.0),
+                LexicalHit(
+                    id="id7",
+                    path="file7.py",
+                    document="content7",
+                    score=1.0,
+                    start=1,
+                    end=3,
+                ),
+            ],
+            [],
+        ],
+    )
+    assert merged["ids"][0] == ["id1", "id2", "id3", "id7"]
+    assert merged["documents"][0][-1] == "content7"
+    assert merged["metadatas"][0][-1] == {"path": "file7.py", "start": 1, "end": 3}
+    assert merged["distances"][0][-1] == 0.3
+    assert merged["vector_ranks"] == [[0, 1, 2, None], [0, 1, 2]]
+    assert merged["lexical_ranks"] == [[None, None, 0, 1], [None, None, None]]
+
+
+def test_merge_duplicate_references(mock_collection):
+    results = merge_lexical_hits(
+        mock_collection.query.return_value,
+        [[LexicalHit(id="id7", path="file7.py", document="content7", score=1.0)], []],
+    )
+    results["embeddings"] = [[[0.1], [0.2], [0.3]], [[0.4], [0.5], [0.6]]]
+    references = {
+        "id1": [
+            DuplicateReference("dedup:1", "file8.py", 2, 4, "id1"),
+            DuplicateReference("dedup:2", "excluded.py", 2, 4, "id1"),
+        ],
+        "id5": [DuplicateReference("dedup:3", "file9.py", None, None, "id5")],
+    }
+    dedup_index = MagicMock()
+    dedup_index.get_references.side_effect = lambda x: references.get(x, [])
+
+    merged = merge_duplicate_references(results, dedup_index, ["excluded.py"])
+    assert merged["ids"] == [
+        ["id1", "id2", "id3", "id7", "dedup:1"],
+        ["id4", "id5", "id6", "dedup:3"],
+    ]
+    # a reference takes the document and the scores of its stored chunk.
+    assert merged["metadatas"][0][-1] == {"path": "file8.py", "start": 2, "end": 4}
+    assert merged["metadatas"][1][-1] == {"path": "file9.py"}
+    assert merged["documents"][0][-1] == "content1"
+    assert merged["distances"][1][-1] == 0.5
+    assert merged["vector_ranks"][0][-1] == 0
+    assert merged["lexical_ranks"][0][-1] is None
+    assert merged["embeddings"][0] == [[0.1], [0.2], [0.3], None, [0.1]]
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_with_duplicates(mock_collection, mock_config):
+    dedup_index = MagicMock()
+    dedup_index.get_references.side_effect = lambda x: (
+        [DuplicateReference("dedup:1", "file9.py", 1, 1, "id1")] if x == "id1" else []
+    )
+    with patch(
+        "vectorcode.subcommands.query.get_dedup_index", return_value=dedup_index
+    ):
+        result = await get_query_result_files(mock_collection, mock_config)
+
+    # file9.py only consists of a collapsed copy of the best chunk.
+    assert "file9.py" in result
+
+
+@pytest.mark.asyncio
+async def test_build_query_results_chunk_mode_duplicate(
+    mock_collection, mock_config, tmp_path
+):
+    mock_config.include = [QueryInclude.chunk, QueryInclude.path]
+    mock_config.use_absolute_path = True
+    file_path = tmp_path / "file9.py"
+    file_path.write_text("".join(f"line {i}\n" for i in range(1, 6)))
+    dedup_index = MagicMock()
+    dedup_index.get_reference.side_effect = lambda x: (
+        DuplicateReference("dedup:1", str(file_path), 1, 2, "id1")
+        if x == "dedup:1"
+        else None
+    )
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_query_result_files",
+            return_value=["dedup:1"],
+        ),
+        patch("vectorcode.subcommands.query.get_dedup_index", return_value=dedup_index),
+    ):
+        results = await build_query_results(mock_collection, mock_config)
+
+    # the reference is read from its own file instead of the collection.
+    mock_collection.get.assert_not_called()
+    assert results == [
+        {
+            "chunk": "line 1\nline 2\n",
+            "start_line": 1,
+            "end_line": 2,
+            "path": str(file_path),
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_with_lexical_index(mock_collection, mock_config):
+    mock_config.lexical_index = True
+    mock_lexical_index = MagicMock()
+    mock_lexical_index.search.return_value = [
+        LexicalHit(id="id7", path="file7.py", document="content7", score=1.0)
+    ]
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_lexical_index",
+            return_value=mock_lexical_index,
+        ),
+        patch("vectorcode.subcommands.query.get_reranker") as mock_get_reranker,
+    ):
+        mock_reranker_instance = MagicMock()
+        mock_reranker_instance.rerank = AsyncMock(return_value=["file7.py"])
+        mock_get_reranker.return_value = mock_reranker_instance
+
+        result = await get_query_result_files(mock_collection, mock_config)
+
+        mock_lexical_index.search.assert_called_once_with("test query", 6, [], False)
+        reranked = mock_reranker_instance.rerank.call_args.args[0]
+        assert "id7" in reranked["ids"][0]
+        assert reranked["lexical_ranks"][0][-1] == 0
+        assert result == ["file7.py"]
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_with_centroid_index(mock_collection, mock_config):
+    mock_centroid_index = MagicMock()
+    mock_centroid_index.count.return_value = 100
+    mock_centroid_index.search.return_value = ["file1.py", "file2.py"]
+    mock_embedding_function = MagicMock(return_value=[[0.1, 0.2]])
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_centroid_index",
+            return_value=mock_centroid_index,
+        ),
+        patch(
+            "vectorcode.subcommands.query.get_embedding_function",
+            return_value=mock_embedding_function,
+        ),
+        patch("vectorcode.subcommands.query.get_reranker") as mock_get_reranker,
+    ):
+        mock_reranker_instance = MagicMock()
+        mock_reranker_instance.rerank = AsyncMock(return_value=["file1.py"])
+        mock_get_reranker.return_value = mock_reranker_instance
+
+        assert await get_query_result_files(mock_collection, mock_config) == [
+            "file1.py"
+        ]
+
+        mock_embedding_function.assert_called_once_with(["test query"])
+        mock_centroid_index.search.assert_called_once_with([[0.1, 0.2]], 6, [])
+        kwargs = mock_collection.query.call_args.kwargs
+        assert kwargs["query_embeddings"] == [[0.1, 0.2]]
+        assert "query_texts" not in kwargs
+        assert kwargs["where"] == {"path": {"$in": ["file1.py", "file2.py"]}}
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_with_small_centroid_index(
+    mock_collection, mock_config
+):
+    mock_centroid_index = MagicMock()
+    mock_centroid_index.count.return_value = 6
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_centroid_index",
+            return_value=mock_centroid_index,
+        ),
+        patch(
+            "vectorcode.subcommands.query.get_embedding_function"
+        ) as mock_get_embedding_function,
+        patch("vectorcode.subcommands.query.get_reranker") as mock_get_reranker,
+    ):
+        mock_get_reranker.return_value.rerank = AsyncMock(return_value=[])
+        await get_query_result_files(mock_collection, mock_config)
+
+        mock_get_embedding_function.assert_not_called()
+        mock_centroid_index.search.assert_not_called()
+        assert mock_collection.query.call_args.kwargs["query_texts"] == ["test query"]
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_overlaps_reranker_init(
+    mock_collection, mock_config
+):
+    loading = threading.Event()
+    loaded = threading.Event()
+    query_during_load: list[bool] = []
+    mock_reranker = MagicMock()
+    mock_reranker.rerank = AsyncMock(return_value=["file1.py"])
+
+    def slow_get_reranker(configs):
+        loading.set()
+        time.sleep(0.2)
+        loaded.set()
+        return mock_reranker
+
+    async def fake_query(**kwargs):
+        await asyncio.to_thread(loading.wait, 1)
+        query_during_load.append(not loaded.is_set())
+        return {
+            "ids": [["id1"]],
+            "distances": [[0.1]],
+            "metadatas": [[{"path": "file1.py"}]],
+            "documents": [["content1"]],
+        }
+
+    mock_collection.query.side_effect = fake_query
+    with patch(
+        "vectorcode.subcommands.query.get_reranker", side_effect=slow_get_reranker
+    ):
+        assert await get_query_result_files(mock_collection, mock_config) == [
+            "file1.py"
+        ]
+    # the vector search ran while the reranker was being initialised.
+    assert query_during_load == [True]
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_empty_collection_skips_reranker(
+    mock_collection, mock_config
+):
+    mock_collection.count.return_value = 0
+    with patch("vectorcode.subcommands.query.get_reranker", side_effect=RerankerError):
+        assert await get_query_result_files(mock_collection, mock_config) == []
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_no_results_waits_for_reranker(
+    mock_collection, mock_config
+):
+    loaded = threading.Event()
+
+    def slow_get_reranker(configs):
+        time.sleep(0.1)
+        loaded.set()
+        return MagicMock()
+
+    mock_collection.query.side_effect = IndexError
+    with patch(
+        "vectorcode.subcommands.query.get_reranker", side_effect=slow_get_reranker
+    ):
+        assert await get_query_result_files(mock_collection, mock_config) == []
+    # cancelling the task wouldn't have stopped the thread that loads the reranker.
+    assert loaded.is_set()
+
+
+@pytest.mark.asyncio
+async def test_get_query_result_files_with_embeddings(mock_collection, mock_config):
+    mock_config.reranker = "MMRReranker"
+    mock_config.reranker_params = {"lambda": 0.5}
+    mock_collection.query.return_value["embeddings"] = [
+        [[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]],
+        [[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]],
+    ]
+    result = await get_query_result_files(mock_collection, mock_config)
+
+    assert IncludeEnum.embeddings in mock_collection.query.call_args.kwargs["include"]
+    assert result == ["file1.py", "file3.py", "file2.py"]
+
+
 @pytest.mark.asyncio
 async def test_build_query_results_chunk_mode_success(mock_collection, mock_config):
     """Test build_query_results in chunk mode successfully retrieves chunk details."""
@@ -136,7 +424,8 @@ async def test_build_query_results_chunk_mode_success(mock_collection, mock_conf
     full_file_content_lines = [f"line {i}\n" for i in range(15)]
     full_file_content = "".join(full_file_content_lines)
 
-    expected_chunk_content = "".join(full_file_content_lines[start_line : end_line + 1])
+    # the rows of the chunks are 1-indexed.
+    expected_chunk_content = "".join(full_file_content_lines[start_line - 1 : end_line])
 
     mock_get_result = GetResult(
         ids=[identifier],
@@ -385,6 +674,149 @@ async def test_query_success(mock_config):
         assert mock_open.call_count == 2  # Two files
 
 
+@pytest.mark.asyncio
+async def test_query_multi_project(mock_config, capsys):
+    mock_config.query_projects = ["/test/lib"]
+    mock_config.pipe = True
+    with (
+        patch(
+            "vectorcode.subcommands.query.projects.get_multi_project_results",
+            return_value=[{"path": "lib.py", "document": "x", "project": "/test/lib"}],
+        ),
+        patch("vectorcode.subcommands.query.get_collection") as mock_get_collection,
+    ):
+        assert await query(mock_config) == 0
+        mock_get_collection.assert_not_called()
+    assert '"project": "/test/lib"' in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_iter_query_results_stops_at_n_result(mock_collection, mock_config):
+    mock_config.n_result = 1
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_query_result_files",
+            return_value=["/test/project/file1.py", "/test/project/file2.py"],
+        ),
+        patch("os.path.isfile", return_value=True),
+        patch("builtins.open", mock_open(read_data="content")) as mocked_open,
+    ):
+        results = [
+            i async for i in iter_query_results(mock_collection, mock_config, [])
+        ]
+    assert results == [{"path": "file1.py", "document": "content"}]
+    # the second file is never read.
+    assert mocked_open.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_iter_query_results_partial_rerank(mock_collection, mock_config):
+    mock_config.reranker_timeout = 0.01
+
+    async def slow_compute_similarities(*args):
+        await asyncio.sleep(1)
+
+    with (
+        patch(
+            "vectorcode.subcommands.query.reranker.naive.NaiveReranker.compute_similarities",
+            side_effect=slow_compute_similarities,
+        ),
+        patch("os.path.isfile", return_value=True),
+        patch("builtins.open", mock_open(read_data="content")),
+    ):
+        results = [
+            i async for i in iter_query_results(mock_collection, mock_config, [])
+        ]
+    assert [os.path.basename(str(i["path"])) for i in results] == [
+        "file1.py",
+        "file2.py",
+        "file3.py",
+    ]
+    assert all(i["partial_rerank"] for i in results)
+
+
+@pytest.mark.asyncio
+async def test_query_stream_mode(mock_config, capsys):
+    mock_config.stream = True
+    mock_config.n_result = 2
+    with (
+        patch("vectorcode.subcommands.query.get_client"),
+        patch("vectorcode.subcommands.query.get_collection"),
+        patch("vectorcode.subcommands.query.verify_ef", return_value=True),
+        patch(
+            "vectorcode.subcommands.query.get_query_result_files",
+            return_value=["/test/project/file1.py", "/test/project/file2.py"],
+        ),
+        patch("os.path.isfile", return_value=True),
+        patch("builtins.open", mock_open(read_data="content")),
+    ):
+        assert await query(mock_config) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(i)["path"] for i in lines] == ["file1.py", "file2.py"]
+
+
+@pytest.mark.asyncio
+async def test_get_packed_results(mock_collection, mock_config):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        large = os.path.join(tmp_dir, "large.py")
+        small = os.path.join(tmp_dir, "small.py")
+        with open(large, "w") as fout:
+            fout.writelines(f"line {i}\n" for i in range(1, 101))
+        with open(small, "w") as fout:
+            fout.write("small\n")
+        mock_collection.query.return_value = {
+            "ids": [["id1", "id2", "id3"]],
+            "distances": [[0.1, 0.2, 0.3]],
+            "metadatas": [
+                [
+                    {"path": large, "start": 10, "end": 11},
+                    {"path": small, "start": 1, "end": 1},
+                    {"path": large, "start": 12, "end": 12},
+                ]
+            ],
+            "documents": [["chunk1", "chunk2", "chunk3"]],
+        }
+        mock_config.project_root = tmp_dir
+        mock_config.char_budget = 50
+        with patch("vectorcode.subcommands.query.get_reranker") as mock_get_reranker:
+            mock_get_reranker.return_value.rerank = AsyncMock(
+                return_value=[large, small]
+            )
+            results = await get_packed_results(mock_collection, mock_config, [])
+
+    assert results == [
+        {
+            "path": "large.py",
+            "chunk": "line 10\nline 11\nline 12\n",
+            "start_line": 10,
+            "end_line": 12,
+        },
+        {"path": "small.py", "document": "small\n"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_query_char_budget(mock_config, capsys):
+    mock_config.char_budget = 100
+    with (
+        patch("vectorcode.subcommands.query.get_client"),
+        patch("vectorcode.subcommands.query.get_collection"),
+        patch("vectorcode.subcommands.query.verify_ef", return_value=True),
+        patch(
+            "vectorcode.subcommands.query.get_packed_results",
+            return_value=[
+                {"path": "file1.py", "chunk": "foo", "start_line": 1, "end_line": 1}
+            ],
+        ) as mock_get_packed_results,
+        patch("vectorcode.subcommands.query.build_query_results") as mock_build,
+    ):
+        assert await query(mock_config) == 0
+        mock_get_packed_results.assert_called_once()
+        mock_build.assert_not_called()
+    # a file that was replaced by its lines is printed as a chunk.
+    assert "Chunk: foo" in capsys.readouterr().out
+
+
 @pytest.mark.asyncio
 async def test_query_pipe_mode(mock_config):
     # Set pipe mode to True
@@ -600,3 +1032,175 @@ async def test_query_chunk_mode_no_metadata_fallback(mock_config):
         args, _ = mock_build_results.call_args
         _, called_config = args
         assert called_config.include == [QueryInclude.path, QueryInclude.document]
+
+
+@pytest.mark.asyncio
+async def test_get_symbol_results(mock_config):
+    mock_config.query = ["vectorcode.get_reranker", "how to rerank"]
+    mock_config.include = [QueryInclude.path, QueryInclude.chunk]
+    symbol_index = MagicMock()
+    symbol_index.lookup.return_value = [
+        Symbol("get_reranker_class", "function", "/test/project/a.py", 7, 9),
+        Symbol("get_reranker", "function", "/test/project/b.py", 1, 5),
+        Symbol("get_reranker", "method", "/test/project/missing.py", 1, 5),
+    ]
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_symbol_index", return_value=symbol_index
+        ),
+        patch("os.path.isfile", side_effect=lambda x: not x.endswith("missing.py")),
+    ):
+        symbols = await get_symbol_results(mock_config)
+    symbol_index.lookup.assert_called_once_with("get_reranker", 3, [])
+    assert [i.name for i in symbols] == ["get_reranker", "get_reranker_class"]
+
+
+@pytest.mark.asyncio
+async def test_get_symbol_results_disabled(mock_config):
+    with patch("vectorcode.subcommands.query.get_symbol_index", return_value=None):
+        assert await get_symbol_results(mock_config) == []
+
+
+@pytest.mark.asyncio
+async def test_build_query_results_with_symbols(mock_collection, mock_config):
+    mock_config.query = ["foo"]
+    mock_config.include = [QueryInclude.path, QueryInclude.chunk]
+    mock_config.n_result = 2
+    symbols = [Symbol("foo", "function", "/test/project/file1.py", 2, 3)]
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_query_result_files",
+            return_value=["id1", "id2"],
+        ),
+        patch("builtins.open", mock_open(read_data="line1\nline2\nline3\nline4\n")),
+    ):
+        mock_collection.get.side_effect = [
+            {
+                "ids": ["id1"],
+                "documents": ["line2"],
+                "metadatas": [{"path": "/test/project/file1.py", "start": 2, "end": 2}],
+            },
+            {
+                "ids": ["id2"],
+                "documents": ["other"],
+                "metadatas": [{"path": "/test/project/file2.py", "start": 1, "end": 1}],
+            },
+        ]
+        results = await build_query_results(
+            mock_collection, mock_config, symbols=symbols
+        )
+    assert results[0] == {
+        "chunk": "line2\nline3\n",
+        "start_line": 2,
+        "end_line": 3,
+        "path": "file1.py",
+    }
+    # the vector hit that overlaps with the symbol is dropped.
+    assert len(results) == 2
+    assert results[1]["path"] == "file2.py"
+
+
+@pytest.mark.asyncio
+async def test_query_skips_vector_search_with_symbols(mock_config):
+    mock_config.query = ["foo"]
+    mock_config.n_result = 1
+    symbols = [Symbol("foo", "function", "/test/project/file1.py", 1, 1)]
+    with (
+        patch("vectorcode.subcommands.query.get_symbol_results", return_value=symbols),
+        patch("vectorcode.subcommands.query.get_client") as mock_get_client,
+        patch("vectorcode.subcommands.query.get_collection") as mock_get_collection,
+        patch("builtins.open", mock_open(read_data="def foo(): ...")),
+        patch("os.path.relpath", return_value="file1.py"),
+    ):
+        assert await query(mock_config) == 0
+        mock_get_client.assert_not_called()
+        mock_get_collection.assert_not_called()
+
+
+def test_blend_results():
+    assert blend_results([1, 2, 3], ["a"]) == [1, "a", 2, 3]
+    assert blend_results([1], ["a", "b"]) == [1, "a", "b"]
+    assert blend_results([], ["a"]) == ["a"]
+
+
+def test_get_exact_symbols(mock_config):
+    mock_config.query = ["vectorcode.foo", "bar baz"]
+    symbols = [
+        Symbol("foobar", "function", "/test/project/a.py", 1, 2),
+        Symbol("foo", "function", "/test/project/b.py", 1, 2),
+    ]
+    assert get_exact_symbols(symbols, mock_config) == [symbols[1]]
+
+
+@pytest.mark.asyncio
+async def test_build_query_results_with_prefix_symbols(mock_collection, mock_config):
+    mock_config.query = ["foo"]
+    mock_config.n_result = 3
+    symbols = [
+        Symbol("foo_prefix", "function", "/test/project/prefix.py", 1, 1),
+        Symbol("foo_other", "function", "/test/project/other.py", 1, 1),
+    ]
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_query_result_files",
+            return_value=["/test/project/file1.py", "/test/project/file2.py"],
+        ) as mock_get_files,
+        patch("builtins.open", mock_open(read_data="content")),
+        patch("os.path.isfile", return_value=True),
+        patch("os.path.samefile", side_effect=lambda a, b: a == b),
+    ):
+        results = await build_query_results(
+            mock_collection, mock_config, symbols=symbols
+        )
+    # prefix matches don't take the place of the vector search results.
+    mock_get_files.assert_called_once()
+    assert [i["path"] for i in results] == ["file1.py", "prefix.py", "file2.py"]
+
+
+@pytest.mark.asyncio
+async def test_get_packed_results_with_prefix_symbols(mock_collection, mock_config):
+    mock_config.query = ["foo"]
+    mock_config.char_budget = 1000
+    symbols = [
+        Symbol("foo", "function", "/test/project/exact.py", 1, 1),
+        Symbol("foo_prefix", "function", "/test/project/prefix.py", 1, 1),
+    ]
+    reranker = MagicMock()
+    reranker.rerank = AsyncMock(
+        return_value=["/test/project/file1.py", "/test/project/file2.py"]
+    )
+    with (
+        patch(
+            "vectorcode.subcommands.query.get_raw_query_results",
+            return_value={"ids": [[]], "metadatas": [[]], "distances": [[]]},
+        ),
+        patch("vectorcode.subcommands.query.get_reranker", return_value=reranker),
+        patch("builtins.open", mock_open(read_data="content")),
+        patch("os.path.isfile", return_value=True),
+    ):
+        results = await get_packed_results(mock_collection, mock_config, symbols)
+    assert [i["path"] for i in results] == [
+        "exact.py",
+        "file1.py",
+        "prefix.py",
+        "file2.py",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_query_does_not_skip_vector_search_with_prefix_symbols(mock_config):
+    mock_config.query = ["foo"]
+    mock_config.n_result = 1
+    symbols = [Symbol("foo_prefix", "function", "/test/project/file1.py", 1, 1)]
+    with (
+        patch("vectorcode.subcommands.query.get_symbol_results", return_value=symbols),
+        patch("vectorcode.subcommands.query.get_client"),
+        patch("vectorcode.subcommands.query.get_collection") as mock_get_collection,
+        patch("vectorcode.subcommands.query.verify_ef", return_value=True),
+        patch(
+            "vectorcode.subcommands.query.build_query_results", return_value=[]
+        ) as mock_build_query_results,
+    ):
+        assert await query(mock_config) == 0
+        mock_get_collection.assert_called_once()
+        mock_build_query_results.assert_called_once()
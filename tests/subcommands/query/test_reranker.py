@@ -1,3 +1,7 @@
+import asyncio
+import os
+import tempfile
+import threading
 from typing import cast
 from unittest.mock import MagicMock, patch
 
@@ -6,14 +10,40 @@ import pytest
 
 from vectorcode.cli_utils import Config, QueryInclude
 from vectorcode.subcommands.query.reranker import (
+    CascadeReranker,
     CrossEncoderReranker,
+    MMRReranker,
+    ModelPool,
     NaiveReranker,
+    OnnxCrossEncoderReranker,
     RerankerBase,
+    RRFReranker,
     __supported_rerankers,
     add_reranker,
     get_available_rerankers,
     get_reranker,
+    model_pool,
+    partial_rerank,
+    require_embeddings,
+    warm_up_reranker,
 )
+from vectorcode.subcommands.query.reranker.base import (
+    aggregate_scores,
+    merge_partial_scores,
+    top_n_indices,
+)
+from vectorcode.subcommands.query.reranker.mmr import mmr_select
+from vectorcode.subcommands.query.reranker.score_cache import (
+    ScoreCache,
+    make_score_key,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_model_pool():
+    model_pool.clear()
+    yield
+    model_pool.clear()
 
 
 @pytest.fixture(scope="function")
@@ -97,13 +127,127 @@ async def test_naive_reranker_rerank(naive_reranker_conf, query_result):
         assert isinstance(path, str)
 
 
+@pytest.mark.asyncio
+async def test_rrf_reranker_without_lexical_ranks(naive_reranker_conf, query_result):
+    naive_reranker_conf.reranker = "RRFReranker"
+    reranker = get_reranker(naive_reranker_conf)
+    assert isinstance(reranker, RRFReranker)
+    reranker._raw_results = query_result
+    scores = await reranker.compute_similarity(
+        query_result["documents"][0], "query chunk 1"
+    )
+    assert scores == [1 / 61, 1 / 62, 1 / 63]
+
+
+@pytest.mark.asyncio
+async def test_rrf_reranker_rerank(naive_reranker_conf, query_result):
+    naive_reranker_conf.reranker_params = {"k": 0}
+    query_result["vector_ranks"] = [[0, 1, None], [0, 1, 2]]
+    query_result["lexical_ranks"] = [[None, 1, 0], [None, None, None]]
+    reranker = RRFReranker(naive_reranker_conf)
+    reranker._raw_results = query_result
+    assert await reranker.compute_similarity(
+        query_result["documents"][0], "query chunk 1"
+    ) == [1, 1 / 2 + 1 / 2, 1]
+
+    result = await reranker.rerank(query_result)
+    assert len(result) == 3
+    assert result[0] == "file1.py"
+
+
 @patch("sentence_transformers.CrossEncoder")
 def test_cross_encoder_reranker_initialization(mock_cross_encoder: MagicMock, config):
     model_name = config.reranker_params["model_name_or_path"]
     reranker = CrossEncoderReranker(config)
     # Verify constructor was called with correct parameters
-    mock_cross_encoder.assert_called_once_with(model_name, **config.reranker_params)
+    mock_cross_encoder.assert_called_once_with(model_name, device="cpu")
     assert reranker.n_result == config.n_result
+    # the shared params are not modified.
+    assert config.reranker_params["model_name_or_path"] == model_name
+
+
+@patch("sentence_transformers.CrossEncoder")
+def test_cross_encoder_reranker_prepared_model(mock_cross_encoder: MagicMock, config):
+    model_name = config.reranker_params["model_name_or_path"]
+    with patch(
+        "vectorcode.subcommands.query.reranker.cross_encoder.find_artifact",
+        return_value="/models/cross_encoder",
+    ) as mock_find_artifact:
+        CrossEncoderReranker(config)
+    mock_find_artifact.assert_called_once_with("cross_encoder", model_name)
+    mock_cross_encoder.assert_called_once_with("/models/cross_encoder", device="cpu")
+
+
+@patch("sentence_transformers.CrossEncoder")
+def test_cross_encoder_reranker_model_pool(mock_cross_encoder: MagicMock, config):
+    first = CrossEncoderReranker(config)
+    second = CrossEncoderReranker(config)
+    assert first.model is second.model
+    mock_cross_encoder.assert_called_once()
+
+    config.reranker_params = {"model_name_or_path": "another-model"}
+    CrossEncoderReranker(config)
+    assert mock_cross_encoder.call_count == 2
+
+
+@patch("sentence_transformers.CrossEncoder")
+def test_warm_up_reranker(mock_cross_encoder: MagicMock, config):
+    warm_up_reranker(config)
+    mock_cross_encoder.assert_called_once()
+    CrossEncoderReranker(config)
+    mock_cross_encoder.assert_called_once()
+
+
+def test_model_pool_lru():
+    pool = ModelPool(max_size=2)
+    assert pool.get("a", lambda: 1) == 1
+    assert pool.get("b", lambda: 2) == 2
+    # "a" becomes the most recently used one.
+    assert pool.get("a", lambda: 3) == 1
+    pool.get("c", lambda: 4)
+    assert "a" in pool and "c" in pool
+    assert "b" not in pool
+    assert len(pool) == 2
+
+
+def test_model_pool_ttl():
+    pool = ModelPool(ttl=10)
+    with patch("time.monotonic", return_value=0):
+        pool.get("a", lambda: 1)
+    with patch("time.monotonic", return_value=5):
+        pool.get("b", lambda: 2)
+    with patch("time.monotonic", return_value=12):
+        assert pool.get("b", lambda: 3) == 2
+    assert "a" not in pool
+
+
+def test_model_pool_loads_keys_independently():
+    pool = ModelPool()
+    loading = threading.Event()
+    release = threading.Event()
+    calls: list[str] = []
+
+    def slow_factory():
+        calls.append("a")
+        loading.set()
+        assert release.wait(5)
+        return 1
+
+    results: list[int] = []
+    threads = [
+        threading.Thread(target=lambda: results.append(pool.get("a", slow_factory)))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    assert loading.wait(5)
+    # another model can be loaded while "a" is loading.
+    assert pool.get("b", lambda: 2) == 2
+    release.set()
+    for thread in threads:
+        thread.join()
+    # the callers of the same model waited for it to be loaded once.
+    assert calls == ["a"] and results == [1, 1]
 
 
 @patch("sentence_transformers.CrossEncoder")
@@ -125,8 +269,9 @@ async def test_cross_encoder_reranker_rerank(mock_cross_encoder, config, query_r
     mock_cross_encoder.return_value = mock_model
 
     # Configure mock predict to return numpy array with float32 dtype
-    scores = numpy.array([0.9, 0.7, 0.8], dtype=numpy.float32)
-    mock_model.predict.return_value = scores
+    mock_model.predict.side_effect = lambda pairs: numpy.linspace(
+        0, 1, len(pairs), dtype=numpy.float32
+    )
 
     # Ensure complete query_result structure
     query_result.update(
@@ -191,18 +336,358 @@ async def test_cross_encoder_reranker_with_chunk_ids(
     mock_cross_encoder.return_value = mock_model
 
     # Setup mock to return numpy array scores
-    scores = numpy.array([0.9, 0.7], dtype=numpy.float32)
-    mock_model.predict.return_value = scores
+    doc_scores = {"content1": 0.9, "content2": 0.7, "content4": 0.8}
+    mock_model.predict.side_effect = lambda pairs: numpy.array(
+        [doc_scores.get(doc, 0.1) for doc, _ in pairs], dtype=numpy.float32
+    )
 
     config.include = {QueryInclude.chunk}
     reranker = CrossEncoderReranker(config)
 
     result = await reranker.rerank(query_result)
 
-    mock_model.predict.assert_called()
-    assert isinstance(result, list)
-    assert all(isinstance(id, str) for id in result)
-    assert all(id in ["id1", "id2", "id3", "id4"] for id in result)
+    mock_model.predict.assert_called_once()
+    assert result == ["id1", "id4", "id2"]
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_cross_encoder_reranker_batched_predict(
+    mock_cross_encoder, config, query_result
+):
+    mock_model = MagicMock()
+    mock_cross_encoder.return_value = mock_model
+    mock_model.predict.side_effect = lambda pairs: numpy.array(
+        [len(doc) for doc, _ in pairs], dtype=numpy.float32
+    )
+    reranker = CrossEncoderReranker(config)
+
+    scores = await reranker.compute_similarities(
+        [["a", "ccc", "a"], ["bb", "a"]], ["query", "query"]
+    )
+
+    # all pairs are scored in one call, without duplicates, from the shortest.
+    mock_model.predict.assert_called_once_with(
+        [("a", "query"), ("bb", "query"), ("ccc", "query")]
+    )
+    assert scores == [[1, 3, 1], [2, 1]]
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_cascade_reranker(mock_cross_encoder, config, query_result):
+    mock_model = MagicMock()
+    mock_cross_encoder.return_value = mock_model
+    # the cross encoder prefers the later documents.
+    mock_model.predict.side_effect = lambda pairs: numpy.array(
+        [int(doc[-1]) for doc, _ in pairs], dtype=numpy.float32
+    )
+    config.reranker = "CascadeReranker"
+    config.reranker_params = {"shortlist_size": 2, "device": "cpu"}
+    config.include = [QueryInclude.chunk]
+    reranker = get_reranker(config)
+    assert isinstance(reranker, CascadeReranker)
+    mock_cross_encoder.assert_called_once_with(
+        "cross-encoder/ms-marco-MiniLM-L-6-v2", device="cpu"
+    )
+
+    result = await reranker.rerank(query_result)
+
+    # only the 2 closest chunks of each query are scored by the cross encoder.
+    mock_model.predict.assert_called_once_with(
+        [
+            ("content1", "query chunk 1"),
+            ("content2", "query chunk 1"),
+            ("content4", "query chunk 2"),
+            ("content5", "query chunk 2"),
+        ]
+    )
+    assert result == ["id5", "id4", "id2"]
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_cascade_reranker_rerank_timeout(
+    mock_cross_encoder, config, query_result
+):
+    config.reranker_params = {"rerank_timeout": 0.01}
+    reranker = CascadeReranker(config)
+    reranker._raw_results = query_result
+
+    async def slow_compute_similarities(*args):
+        await asyncio.sleep(1)
+
+    partial_rerank.set(False)
+    with patch.object(
+        reranker.cross_encoder,
+        "compute_similarities",
+        side_effect=slow_compute_similarities,
+    ):
+        scores = await reranker.compute_similarities(
+            query_result["documents"], config.query
+        )
+    # falls back to the prefilter (distance) order.
+    assert scores == [[-0.1, -0.2, -0.3], [-0.4, -0.5, -0.6]]
+    assert partial_rerank.get()
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_cascade_reranker_prefilter_timeout(
+    mock_cross_encoder, config, query_result
+):
+    mock_cross_encoder.return_value.predict.side_effect = lambda pairs: numpy.zeros(
+        len(pairs), dtype=numpy.float32
+    )
+    config.reranker_params = {"prefilter_timeout": 0.01, "shortlist_size": 1}
+    reranker = CascadeReranker(config)
+    reranker._raw_results = query_result
+
+    async def slow_compute_similarities(*args):
+        await asyncio.sleep(1)
+
+    partial_rerank.set(False)
+    with patch.object(
+        reranker.prefilter,
+        "compute_similarities",
+        side_effect=slow_compute_similarities,
+    ):
+        scores = await reranker.compute_similarities(
+            query_result["documents"], config.query
+        )
+    # the first result of each query (in the vector search order) is shortlisted.
+    assert [len(i) for i in scores] == [3, 3]
+    assert scores[0][0] > scores[0][1] > scores[0][2]
+    assert partial_rerank.get()
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_cascade_reranker_timeout_with_deadline(
+    mock_cross_encoder, config, query_result
+):
+    # the stages run inside of the `reranker_timeout` task.
+    config.reranker_timeout = 5
+    config.reranker_params = {"rerank_timeout": 0.01}
+    reranker = CascadeReranker(config)
+
+    async def slow_compute_similarities(*args):
+        await asyncio.sleep(1)
+
+    with patch.object(
+        reranker.cross_encoder,
+        "compute_similarities",
+        side_effect=slow_compute_similarities,
+    ):
+        await reranker.rerank(query_result)
+    assert partial_rerank.get()
+
+
+def test_cascade_reranker_invalid_prefilter(config):
+    config.reranker_params = {"prefilter": "CrossEncoderReranker"}
+    with pytest.raises(ValueError):
+        CascadeReranker(config)
+
+
+def test_aggregate_scores():
+    names, scores = aggregate_scores(
+        ["b", "a", "b", "c", "b", "a"],
+        numpy.array([0.1, 0.5, 0.9, 0.3, 0.7, 0.2]),
+    )
+    assert names == ["b", "a", "c"]
+    # top_k = int(mean([3, 2, 1])) = 2
+    assert numpy.allclose(scores, [(0.9 + 0.7) / 2, (0.5 + 0.2) / 2, 0.3])
+
+
+def test_top_n_indices():
+    scores = numpy.array([0.5, 0.9, 0.5, 0.1, 0.5])
+    assert top_n_indices(scores, 3) == [1, 0, 2]
+    assert top_n_indices(scores, 10) == [1, 0, 2, 4, 3]
+    assert top_n_indices(scores, 0) == []
+
+
+def test_merge_partial_scores():
+    assert merge_partial_scores(
+        [[None, 5.0, None], [None, None]], [[-0.3, -0.1, -0.2], [-0.4, -0.5]]
+    ) == [[4 - 2 / 3, 5.0, 4 - 1 / 3], [4.0, 3.5]]
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_rerank_timeout(mock_cross_encoder, config, query_result):
+    config.reranker_timeout = 0.01
+    config.reranker_cache = True
+    reranker = CrossEncoderReranker(config)
+
+    async def slow_compute_similarities(*args):
+        await asyncio.sleep(1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = ScoreCache(os.path.join(tmp_dir, "scores.sqlite3"))
+        cache.put_many(
+            {make_score_key(reranker.model_key, "query chunk 2", "content6"): 1.0}
+        )
+        with (
+            patch(
+                "vectorcode.subcommands.query.reranker.base.get_score_cache",
+                return_value=cache,
+            ),
+            patch.object(
+                reranker,
+                "compute_similarities",
+                side_effect=slow_compute_similarities,
+            ),
+        ):
+            result = await reranker.rerank(query_result)
+        cache.close()
+
+    # the scored chunk goes first, and the rest are ranked by their distances.
+    assert result == ["file3.py", "file1.py", "file2.py"]
+    assert partial_rerank.get()
+
+    config.reranker_timeout = 0
+    with patch.object(
+        reranker, "compute_similarities", return_value=[[3, 2, 1], [1, 2, 3]]
+    ):
+        await reranker.rerank(query_result)
+    assert not partial_rerank.get()
+
+
+def test_mmr_select():
+    relevance = numpy.array([1.0, 0.9, 0.5])
+    vectors = numpy.array([[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]])
+    # the near-duplicate of the first item is skipped.
+    assert mmr_select(relevance, vectors, 2, 0.5) == [0, 2]
+    assert mmr_select(relevance, vectors, 2, 1) == [0, 1]
+    assert mmr_select(relevance, vectors, 10, 0.5) == [0, 2, 1]
+    assert mmr_select(relevance, numpy.zeros((3, 2)), 3, 0.5) == [0, 1, 2]
+    assert mmr_select(relevance, vectors, 0, 0.5) == []
+
+
+@pytest.mark.asyncio
+async def test_mmr_reranker(naive_reranker_conf, query_result):
+    naive_reranker_conf.reranker = "MMRReranker"
+    naive_reranker_conf.n_result = 2
+    assert require_embeddings(naive_reranker_conf)
+    query_result["embeddings"] = [
+        [[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]],
+        # the last entry is a lexical-only hit.
+        [[1.0, 0.02], [0.5, 0.5]],
+    ]
+    reranker = get_reranker(naive_reranker_conf)
+    assert isinstance(reranker, MMRReranker)
+    assert await reranker.rerank(query_result) == ["file1.py", "file3.py"]
+
+    naive_reranker_conf.include = [QueryInclude.chunk]
+    naive_reranker_conf.reranker_params = {"lambda": 1}
+    assert await get_reranker(naive_reranker_conf).rerank(query_result) == [
+        "id1",
+        "id2",
+    ]
+
+
+def test_mmr_reranker_invalid_lambda(naive_reranker_conf):
+    naive_reranker_conf.reranker_params = {"lambda": 2}
+    with pytest.raises(AssertionError):
+        MMRReranker(naive_reranker_conf)
+
+
+def test_score_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "scores.sqlite3")
+        cache = ScoreCache(db_path, max_memory_entries=1, max_disk_entries=2)
+        key1 = make_score_key("model", "query", "doc1")
+        key2 = make_score_key("model", "query", "doc2")
+        key3 = make_score_key("model", "query", "doc3")
+        assert key1 != make_score_key("another model", "query", "doc1")
+
+        cache.put_many({key1: 0.1, key2: 0.2})
+        assert cache.get_many([key1, key2, key3]) == {key1: 0.1, key2: 0.2}
+        cache.put_many({key3: 0.3})
+        cache.close()
+
+        # the oldest entry is evicted from the disk.
+        cache = ScoreCache(db_path)
+        assert cache.get_many([key1, key2, key3]) == {key2: 0.2, key3: 0.3}
+        cache.close()
+
+
+@pytest.mark.asyncio
+@patch("sentence_transformers.CrossEncoder")
+async def test_cross_encoder_reranker_score_cache(
+    mock_cross_encoder, config, query_result
+):
+    mock_model = MagicMock()
+    mock_cross_encoder.return_value = mock_model
+    mock_model.predict.side_effect = lambda pairs: numpy.array(
+        [int(doc[-1]) for doc, _ in pairs], dtype=numpy.float32
+    )
+    config.reranker_cache = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = ScoreCache(os.path.join(tmp_dir, "scores.sqlite3"))
+        with patch(
+            "vectorcode.subcommands.query.reranker.base.get_score_cache",
+            return_value=cache,
+        ):
+            reranker = CrossEncoderReranker(config)
+            first = await reranker.rerank(query_result)
+            assert mock_model.predict.call_count == 1
+
+            # only the new chunk is scored.
+            query_result["documents"][0][0] = "content7"
+            second = await reranker.rerank(query_result)
+            assert mock_model.predict.call_count == 2
+            mock_model.predict.assert_called_with([("content7", "query chunk 1")])
+        cache.close()
+    assert first == ["file3.py", "file4.py", "file2.py"]
+    assert second == ["file1.py", "file3.py", "file4.py"]
+
+
+@pytest.mark.asyncio
+async def test_onnx_cross_encoder_reranker(naive_reranker_conf):
+    naive_reranker_conf.reranker = "OnnxCrossEncoderReranker"
+    naive_reranker_conf.reranker_params = {"batch_size": 2}
+    mock_session = MagicMock()
+    mock_session.get_inputs.return_value = [MagicMock(), MagicMock()]
+    mock_session.get_inputs.return_value[0].name = "input_ids"
+    mock_session.get_inputs.return_value[1].name = "attention_mask"
+
+    def tokenize(docs, queries, **kwargs):
+        return {
+            "input_ids": numpy.array([[len(i)] for i in docs]),
+            "attention_mask": numpy.ones((len(docs), 1)),
+            "token_type_ids": numpy.zeros((len(docs), 1)),
+        }
+
+    mock_tokenizer = MagicMock(side_effect=tokenize)
+    mock_session.run.side_effect = lambda _, inputs: [
+        inputs["input_ids"].astype(numpy.float32)
+    ]
+    with (
+        patch("onnxruntime.InferenceSession", return_value=mock_session),
+        patch(
+            "transformers.AutoTokenizer.from_pretrained", return_value=mock_tokenizer
+        ),
+        patch(
+            "huggingface_hub.hf_hub_download", return_value="/tmp/model.onnx"
+        ) as mock_download,
+    ):
+        reranker = get_reranker(naive_reranker_conf)
+        assert isinstance(reranker, OnnxCrossEncoderReranker)
+        mock_download.assert_called_once_with(
+            "cross-encoder/ms-marco-MiniLM-L-6-v2", "onnx/model_quint8_avx2.onnx"
+        )
+        scores = await reranker.compute_similarities(
+            [["ccc", "a", "bbbb"], ["dd"]], ["q1", "q2"]
+        )
+
+    assert scores == [[3, 1, 4], [2]]
+    # 4 pairs in batches of 2.
+    assert mock_session.run.call_count == 2
+    assert set(mock_session.run.call_args.args[1].keys()) == {
+        "input_ids",
+        "attention_mask",
+    }
 
 
 def test_get_reranker(config, naive_reranker_conf):
@@ -222,7 +707,7 @@ def test_supported_rerankers_initialization(config, naive_reranker_conf):
 
     assert isinstance(get_reranker(config), CrossEncoderReranker)
     assert isinstance(get_reranker(naive_reranker_conf), NaiveReranker)
-    assert len(get_available_rerankers()) == 2
+    assert len(get_available_rerankers()) == 6
 
 
 def test_add_reranker_success():
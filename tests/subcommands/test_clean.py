@@ -26,10 +26,12 @@ async def test_run_clean_on_client():
     with (
         patch("vectorcode.subcommands.clean.get_collections", new=mock_get_collections),
         patch("os.path.isdir", return_value=lambda x: x == "/test/path2"),
+        patch("vectorcode.subcommands.clean.evict_collection") as mock_evict,
     ):
         await run_clean_on_client(mock_client, pipe_mode=False)
 
     mock_client.delete_collection.assert_called_once_with(mock_collection1.name)
+    mock_evict.assert_called_once_with("/test/path1")
 
 
 @pytest.mark.asyncio
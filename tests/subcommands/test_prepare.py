@@ -0,0 +1,68 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.subcommands import prepare
+
+
+@pytest.mark.asyncio
+async def test_prepare(capsys):
+    configs = Config(
+        embedding_function="SentenceTransformerEmbeddingFunction",
+        embedding_params={"model_name": "my-embedder"},
+        reranker="CascadeReranker",
+        reranker_params={"model_name_or_path": "my-reranker", "shortlist_size": 5},
+        force=True,
+        pipe=True,
+    )
+    with (
+        patch(
+            "vectorcode.subcommands.prepare.prepare_sentence_transformer",
+            return_value="/models/embedder",
+        ) as mock_embedder,
+        patch(
+            "vectorcode.subcommands.prepare.prepare_cross_encoder",
+            return_value="/models/reranker",
+        ) as mock_reranker,
+    ):
+        assert await prepare(configs) == 0
+    mock_embedder.assert_called_once_with("my-embedder", True, False)
+    mock_reranker.assert_called_once_with("my-reranker", True, False)
+    assert json.loads(capsys.readouterr().out) == {
+        "embedding_function": "/models/embedder",
+        "reranker": "/models/reranker",
+    }
+
+
+@pytest.mark.asyncio
+async def test_prepare_onnx_reranker():
+    configs = Config(
+        embedding_function="OllamaEmbeddingFunction",
+        reranker="OnnxCrossEncoderReranker",
+        reranker_params={},
+    )
+    with (
+        patch(
+            "vectorcode.subcommands.prepare.prepare_sentence_transformer"
+        ) as mock_embedder,
+        patch(
+            "vectorcode.subcommands.prepare.prepare_onnx_cross_encoder",
+            return_value="/models/reranker",
+        ) as mock_reranker,
+    ):
+        assert await prepare(configs) == 0
+    mock_embedder.assert_not_called()
+    mock_reranker.assert_called_once_with(
+        "cross-encoder/ms-marco-MiniLM-L-6-v2", "onnx/model_quint8_avx2.onnx", False
+    )
+
+
+@pytest.mark.asyncio
+async def test_prepare_skipped(capsys):
+    configs = Config(
+        embedding_function="OllamaEmbeddingFunction", reranker="NaiveReranker"
+    )
+    assert await prepare(configs) == 0
+    assert capsys.readouterr().err.count("Skipped") == 2
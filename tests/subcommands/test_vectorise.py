@@ -13,6 +13,7 @@ from tree_sitter import Point
 
 from vectorcode.chunking import Chunk
 from vectorcode.cli_utils import Config
+from vectorcode.dedup import get_dedup_index
 from vectorcode.subcommands.vectorise import (
     VectoriseStats,
     chunked_add,
@@ -27,6 +28,17 @@ from vectorcode.subcommands.vectorise import (
 )
 
 
+@pytest.fixture(autouse=True)
+def embedding_function():
+    """A stand-in for the embedding function that `chunked_add` embeds the chunks with."""
+    function = MagicMock(side_effect=lambda texts: [[float(len(i))] for i in texts])
+    with patch(
+        "vectorcode.subcommands.vectorise.get_embedding_function",
+        return_value=function,
+    ):
+        yield function
+
+
 def test_hash_str():
     test_string = "test_string"
     expected_hash = hashlib.sha256(test_string.encode()).hexdigest()
@@ -101,6 +113,241 @@ async def test_chunked_add():
     assert stats.update == 0
     collection.add.assert_called()
     assert collection.add.call_count == 1
+    kwargs = collection.add.call_args.kwargs
+    assert kwargs["embeddings"] == [[float(len(i))] for i in kwargs["documents"]]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_embeds_outside_of_the_lock(embedding_function):
+    collection = AsyncMock()
+    collection_lock = asyncio.Lock()
+    lock_states: list[bool] = []
+
+    def fake_embed(texts):
+        lock_states.append(collection_lock.locked())
+        return [[1.0] for _ in texts]
+
+    embedding_function.side_effect = fake_embed
+    with (
+        patch("vectorcode.chunking.TreeSitterChunker.chunk", return_value=["chunk1"]),
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash1"),
+    ):
+        await chunked_add(
+            "test_file.py",
+            collection,
+            collection_lock,
+            VectoriseStats(),
+            asyncio.Lock(),
+            Config(project_root="."),
+            50,
+            asyncio.Semaphore(1),
+        )
+    assert lock_states == [False]
+    collection.add.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_with_batcher():
+    file_path = "test_file.py"
+    collection = AsyncMock()
+    collection_lock = asyncio.Lock()
+    stats = VectoriseStats()
+    stats_lock = asyncio.Lock()
+    configs = Config(chunk_size=100, overlap_ratio=0.2, project_root=".")
+    batcher = MagicMock()
+    batcher.embed = AsyncMock(side_effect=lambda texts: [[len(i)] for i in texts])
+
+    with (
+        patch("vectorcode.chunking.TreeSitterChunker.chunk") as mock_chunk,
+        patch("vectorcode.subcommands.vectorise.hash_file") as mock_hash_file,
+    ):
+        mock_hash_file.return_value = "hash1"
+        mock_chunk.return_value = [Chunk("chunk1", Point(1, 0), Point(1, 5)), "chunk22"]
+        await chunked_add(
+            file_path,
+            collection,
+            collection_lock,
+            stats,
+            stats_lock,
+            configs,
+            50,
+            asyncio.Semaphore(1),
+            batcher,
+        )
+
+    batcher.embed.assert_awaited_once()
+    kwargs = collection.add.call_args.kwargs
+    assert kwargs["documents"][:2] == ["chunk1", "chunk22"]
+    assert kwargs["embeddings"] == [[len(i)] for i in kwargs["documents"]]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_with_dedup(tmp_path, index_dir):
+    collection = AsyncMock()
+    collection.get.return_value = {"ids": [], "metadatas": []}
+    configs = Config(project_root=str(tmp_path), dedup_threshold=0.9)
+    header = "# Licensed under the Apache License, Version 2.0 (the License)"
+
+    with (
+        patch("vectorcode.chunking.TreeSitterChunker.chunk") as mock_chunk,
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash"),
+    ):
+        for name, body in (("a.py", "def foo(): pass"), ("b.py", "def bar(): pass")):
+            mock_chunk.return_value = [
+                Chunk(header, Point(1, 0), Point(1, 60)),
+                Chunk(body, Point(2, 0), Point(2, 15)),
+            ]
+            await chunked_add(
+                str(tmp_path / name),
+                collection,
+                asyncio.Lock(),
+                VectoriseStats(),
+                asyncio.Lock(),
+                configs,
+                50,
+                asyncio.Semaphore(1),
+            )
+        dedup_index = get_dedup_index(configs)
+
+    assert dedup_index is not None
+    # the license header of b.py is not stored again.
+    assert collection.add.call_args.kwargs["documents"] == ["def bar(): pass", "b.py"]
+    first_id = collection.add.call_args_list[0].kwargs["ids"][0]
+    assert [(i.path, i.start, i.end) for i in dedup_index.get_references(first_id)] == [
+        (str(tmp_path / "b.py"), 1, 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_with_dedup_failed_add(tmp_path, index_dir):
+    collection = AsyncMock()
+    collection.get.return_value = {"ids": [], "metadatas": []}
+    collection.add.side_effect = RuntimeError("failed to store the chunks")
+    configs = Config(project_root=str(tmp_path), dedup_threshold=0.9)
+
+    with (
+        patch(
+            "vectorcode.chunking.TreeSitterChunker.chunk",
+            return_value=[Chunk("def foo(): pass", Point(1, 0), Point(1, 15))],
+        ),
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash"),
+    ):
+        with pytest.raises(RuntimeError):
+            await chunked_add(
+                str(tmp_path / "a.py"),
+                collection,
+                asyncio.Lock(),
+                VectoriseStats(),
+                asyncio.Lock(),
+                configs,
+                50,
+                asyncio.Semaphore(1),
+            )
+        dedup_index = get_dedup_index(configs)
+
+    assert dedup_index is not None
+    # nothing is recorded for the chunks that weren't stored.
+    assert not dedup_index.has_path(str(tmp_path / "a.py"))
+    assert dedup_index.plan(
+        str(tmp_path / "b.py"), ["b1"], ["def foo(): pass"], [{"start": 1}]
+    ).keep == [True]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_with_dedup_dependents(tmp_path, index_dir):
+    collection = AsyncMock()
+    collection.get.return_value = {"ids": [], "metadatas": []}
+    configs = Config(project_root=str(tmp_path), dedup_threshold=0.9)
+    header = "# Licensed under the Apache License, Version 2.0 (the License)"
+    file_a, file_b = str(tmp_path / "a.py"), str(tmp_path / "b.py")
+    for path in (file_a, file_b):
+        with open(path, "w") as fout:
+            fout.write(header)
+
+    async def add(path: str, stats: VectoriseStats):
+        await chunked_add(
+            path,
+            collection,
+            asyncio.Lock(),
+            stats,
+            asyncio.Lock(),
+            configs,
+            50,
+            asyncio.Semaphore(1),
+        )
+
+    with (
+        patch(
+            "vectorcode.chunking.TreeSitterChunker.chunk",
+            return_value=[Chunk(header, Point(1, 0), Point(1, 60))],
+        ),
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash"),
+    ):
+        await add(file_a, VectoriseStats())
+        await add(file_b, VectoriseStats())
+        # the header of b.py was collapsed into the chunk of a.py, which is now modified.
+        collection.get.return_value = {
+            "ids": ["id"],
+            "metadatas": [{"sha256": "old hash"}],
+        }
+        stats = VectoriseStats()
+        await add(file_a, stats)
+        dedup_index = get_dedup_index(configs)
+
+    assert dedup_index is not None
+    # b.py is vectorised again in the same run, instead of losing its content.
+    assert [i.kwargs["where"] for i in collection.delete.call_args_list] == [
+        {"path": file_a},
+        {"path": file_b},
+    ]
+    assert stats.update == 2
+    assert dedup_index.has_path(file_b)
+    new_id = collection.add.call_args_list[2].kwargs["ids"][0]
+    assert [i.path for i in dedup_index.get_references(new_id)] == [file_b]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_centroid_index_with_dedup(tmp_path, index_dir):
+    collection = AsyncMock()
+    collection.get.return_value = {"ids": [], "metadatas": []}
+    configs = Config(project_root=str(tmp_path), dedup_threshold=0.9)
+    header = "# Licensed under the Apache License, Version 2.0 (the License)"
+    centroid_index = MagicMock()
+
+    with (
+        patch(
+            "vectorcode.chunking.TreeSitterChunker.chunk",
+            return_value=[Chunk(header, Point(1, 0), Point(1, 60))],
+        ),
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash"),
+        patch(
+            "vectorcode.subcommands.vectorise.get_centroid_index",
+            return_value=centroid_index,
+        ),
+    ):
+        for name in ("a.py", "b.py"):
+            if name == "b.py":
+                canonical_id = collection.add.call_args.kwargs["ids"][0]
+                collection.get.side_effect = lambda **kwargs: (
+                    {"ids": [canonical_id], "embeddings": [[100.0]]}
+                    if "ids" in kwargs
+                    else {"ids": [], "metadatas": []}
+                )
+            await chunked_add(
+                str(tmp_path / name),
+                collection,
+                asyncio.Lock(),
+                VectoriseStats(),
+                asyncio.Lock(),
+                configs,
+                50,
+                asyncio.Semaphore(1),
+            )
+
+    # the only chunk of b.py was collapsed, but it still counts towards its centroid.
+    assert collection.add.call_args.kwargs["documents"] == ["b.py"]
+    collection.get.assert_awaited_with(ids=[canonical_id], include=["embeddings"])
+    centroid_index.add.assert_called_with(str(tmp_path / "b.py"), [[4.0], [100.0]])
 
 
 @pytest.mark.asyncio
@@ -206,6 +453,125 @@ async def test_chunked_add_empty_file():
     assert collection.add.call_count == 0
 
 
+@pytest.mark.asyncio
+async def test_chunked_add_lexical_index():
+    file_path = "test_file.py"
+    collection = AsyncMock()
+    collection.get = AsyncMock()
+    collection.get.return_value = {"ids": ["id1"], "metadatas": [{"sha256": "hash1"}]}
+    stats = VectoriseStats()
+    configs = Config(
+        chunk_size=100, overlap_ratio=0.2, project_root=".", lexical_index=True
+    )
+    lexical_index = MagicMock()
+    lexical_index.has_path.return_value = False
+
+    with (
+        patch("vectorcode.chunking.TreeSitterChunker.chunk") as mock_chunk,
+        patch("vectorcode.subcommands.vectorise.hash_file") as mock_hash_file,
+        patch(
+            "vectorcode.subcommands.vectorise.get_lexical_index",
+            return_value=lexical_index,
+        ),
+    ):
+        # unchanged file that is missing from the lexical index.
+        mock_hash_file.return_value = "hash1"
+        mock_chunk.return_value = ["chunk1", "chunk2"]
+        await chunked_add(
+            file_path,
+            collection,
+            asyncio.Lock(),
+            stats,
+            asyncio.Lock(),
+            configs,
+            50,
+            asyncio.Semaphore(1),
+        )
+
+    full_path = os.path.abspath(file_path)
+    assert stats.update == 1
+    lexical_index.delete.assert_called_once_with([full_path])
+    lexical_index.add.assert_called_once()
+    ids, documents, metas = lexical_index.add.call_args.args
+    assert ids == collection.add.call_args.kwargs["ids"]
+    assert documents == ["chunk1", "chunk2", "test_file.py"]
+    assert all(meta["path"] == full_path for meta in metas)
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_symbol_index():
+    file_path = "test_file.py"
+    collection = AsyncMock()
+    collection.get = AsyncMock()
+    collection.get.return_value = {"ids": [], "metadatas": []}
+    stats = VectoriseStats()
+    configs = Config(
+        chunk_size=100, overlap_ratio=0.2, project_root=".", symbol_index=True
+    )
+    symbol_index = MagicMock()
+
+    with (
+        patch("vectorcode.chunking.TreeSitterChunker.chunk") as mock_chunk,
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash1"),
+        patch(
+            "vectorcode.subcommands.vectorise.get_symbol_index",
+            return_value=symbol_index,
+        ),
+    ):
+        mock_chunk.return_value = ["chunk1"]
+        await chunked_add(
+            file_path,
+            collection,
+            asyncio.Lock(),
+            stats,
+            asyncio.Lock(),
+            configs,
+            50,
+            asyncio.Semaphore(1),
+        )
+
+    assert stats.add == 1
+    symbol_index.add.assert_called_once_with(os.path.abspath(file_path), [])
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_centroid_index():
+    file_path = "test_file.py"
+    collection = AsyncMock()
+    collection.get = AsyncMock(return_value={"ids": [], "metadatas": []})
+    stats = VectoriseStats()
+    configs = Config(
+        chunk_size=100, overlap_ratio=0.2, project_root=".", centroid_index=True
+    )
+    centroid_index = MagicMock()
+
+    with (
+        patch("vectorcode.chunking.TreeSitterChunker.chunk") as mock_chunk,
+        patch("vectorcode.subcommands.vectorise.hash_file", return_value="hash1"),
+        patch(
+            "vectorcode.subcommands.vectorise.get_centroid_index",
+            return_value=centroid_index,
+        ),
+    ):
+        mock_chunk.return_value = ["chunk1"]
+        await chunked_add(
+            file_path,
+            collection,
+            asyncio.Lock(),
+            stats,
+            asyncio.Lock(),
+            configs,
+            50,
+            asyncio.Semaphore(1),
+        )
+
+    # the embeddings of the chunks are used without reading them back.
+    collection.get.assert_awaited_once()
+    centroid_index.add.assert_called_once_with(
+        os.path.abspath(file_path), [[6.0], [12.0]]
+    )
+
+
 @patch("tabulate.tabulate")
 def test_show_stats_pipe_false(mock_tabulate, capsys):
     configs = Config(pipe=False)
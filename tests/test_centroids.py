@@ -0,0 +1,90 @@
+import sqlite3
+
+import numpy
+import pytest
+
+from vectorcode.centroids import (
+    CentroidIndex,
+    get_centroid_index,
+)
+from vectorcode.cli_utils import Config
+
+
+@pytest.fixture
+def centroid_index(tmp_path):
+    index = CentroidIndex(str(tmp_path / "centroids.sqlite3"))
+    index.add("/repo/a.py", [[1.0, 0.0], [1.0, 0.2]])
+    index.add("/repo/b.py", [[0.0, 1.0]])
+    index.add("/repo/c.py", numpy.array([[1.0, 1.0], [1.0, 1.0]]))
+    yield index
+    index.close()
+
+
+def test_centroid_index_search(centroid_index):
+    assert centroid_index.count() == 3
+    assert centroid_index.search([[1.0, 0.0]], 3) == [
+        "/repo/a.py",
+        "/repo/c.py",
+        "/repo/b.py",
+    ]
+    assert centroid_index.search([[0.0, 2.0]], 1) == ["/repo/b.py"]
+    # each file is scored by its most similar query.
+    assert set(centroid_index.search([[1.0, 0.0], [0.0, 1.0]], 2)) == {
+        "/repo/a.py",
+        "/repo/b.py",
+    }
+    assert centroid_index.search([[1.0, 0.0]], 0) == []
+
+
+def test_centroid_index_search_exclude(centroid_index):
+    assert centroid_index.search([[1.0, 0.0]], 3, exclude_paths=["/repo/a.py"]) == [
+        "/repo/c.py",
+        "/repo/b.py",
+    ]
+
+
+def test_centroid_index_float16(tmp_path):
+    db_path = str(tmp_path / "centroids.sqlite3")
+    # an index that was created before the dtype column existed.
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE centroids (path TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        conn.execute(
+            "INSERT INTO centroids VALUES (?, ?)",
+            ("/repo/a.py", numpy.array([1.0, 0.0], dtype=numpy.float32).tobytes()),
+        )
+    conn.close()
+
+    index = CentroidIndex(db_path, float16=True)
+    index.add("/repo/b.py", [[0.0, 1.0]])
+    assert index.search([[1.0, 0.1]], 2) == ["/repo/a.py", "/repo/b.py"]
+    assert index.search([[0.1, 1.0]], 1) == ["/repo/b.py"]
+    index.close()
+
+    with sqlite3.connect(db_path) as conn:
+        rows = dict(conn.execute("SELECT path, length(vector) FROM centroids"))
+    conn.close()
+    assert rows == {"/repo/a.py": 8, "/repo/b.py": 4}
+
+
+def test_centroid_index_update(centroid_index):
+    assert centroid_index.search([[0.0, 1.0]], 1) == ["/repo/b.py"]
+    centroid_index.add("/repo/a.py", [[0.0, 1.0]])
+    centroid_index.delete(["/repo/b.py"])
+    assert not centroid_index.has_path("/repo/b.py")
+    assert centroid_index.has_path("/repo/a.py")
+    assert centroid_index.search([[0.0, 1.0]], 1) == ["/repo/a.py"]
+
+
+def test_get_centroid_index(index_dir):
+    configs = Config(project_root=index_dir)
+    assert get_centroid_index(configs, make_if_missing=True) is None
+
+    configs.centroid_index = True
+    assert get_centroid_index(configs) is None
+
+    index = get_centroid_index(configs, make_if_missing=True)
+    assert isinstance(index, CentroidIndex)
+    assert index.search([[1.0]], 1) == []
+    assert get_centroid_index(configs) is index
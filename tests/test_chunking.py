@@ -1,6 +1,6 @@
 import os
 import tempfile
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
 from tree_sitter import Point
@@ -11,7 +11,9 @@ from vectorcode.chunking import (
     ChunkOpts,
     FileChunker,
     StringChunker,
+    TokenCounter,
     TreeSitterChunker,
+    get_token_counter,
 )
 from vectorcode.cli_utils import Config
 
@@ -584,3 +586,113 @@ def bar():
             assert chunks[i].end.column <= chunks[i + 1].start.column
 
     os.remove(test_file)
+
+
+def make_whitespace_tokenizer():
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]")
+
+
+def test_token_counter():
+    tokenizer = MagicMock(wraps=make_whitespace_tokenizer())
+    tokenizer.num_special_tokens_to_add.return_value = 2
+    counter = TokenCounter(tokenizer, max_length=10)
+    assert counter.count(["foo bar", "baz", "foo bar"]) == [3 - 1, 1, 2]
+    assert counter.count(["baz"]) == [1]
+    # the cached texts are not tokenized again.
+    assert tokenizer.call_count == 1
+    assert counter.offsets("foo  bar") == [(0, 3), (5, 8)]
+    assert counter.get_budget(100) == 8
+    assert counter.get_budget(5) == 5
+
+
+def test_get_token_counter_fallback():
+    with patch("vectorcode.common.get_embedding_function") as mock_get_ef:
+        mock_get_ef.return_value = MagicMock()
+        assert get_token_counter(Config(embedding_function="NoTokenizer")) is None
+        assert (
+            StringChunker(
+                Config(embedding_function="NoTokenizer", chunk_by_tokens=True)
+            ).token_counter
+            is None
+        )
+        assert mock_get_ef.call_count == 1
+
+
+def test_get_token_counter_copies_the_tokenizer():
+    embedding_function = MagicMock()
+    embedding_function._model.tokenizer = make_whitespace_tokenizer()
+    embedding_function._model.max_seq_length = 8
+    with patch(
+        "vectorcode.common.get_embedding_function", return_value=embedding_function
+    ):
+        counter = get_token_counter(Config(embedding_function="CopiedTokenizer"))
+    assert counter is not None
+    # the model may use its own tokenizer in another thread.
+    assert counter.tokenizer is not embedding_function._model.tokenizer
+    assert counter.max_length == 8
+    assert counter.count(["foo bar"]) == [2]
+
+
+def test_get_token_counter_without_the_model():
+    # `WorkerEmbeddingFunction` doesn't hold the model in this process.
+    tokenizer = make_whitespace_tokenizer()
+    configs = Config(
+        embedding_function="SentenceTransformerEmbeddingFunction",
+        embedding_params={"model_name": "worker-model"},
+    )
+    with (
+        patch(
+            "vectorcode.common.get_embedding_function",
+            return_value=MagicMock(spec=[]),
+        ),
+        patch(
+            "vectorcode.chunking.load_tokenizer", return_value=(tokenizer, 7)
+        ) as mock_load,
+    ):
+        counter = get_token_counter(configs)
+    mock_load.assert_called_once_with(configs)
+    assert counter is not None
+    assert counter.tokenizer is tokenizer
+    assert counter.max_length == 7
+
+
+def test_string_chunker_by_tokens():
+    counter = TokenCounter(make_whitespace_tokenizer(), max_length=5)
+    with patch("vectorcode.chunking.get_token_counter", return_value=counter):
+        chunker = StringChunker(
+            Config(chunk_size=100, overlap_ratio=0, chunk_by_tokens=True)
+        )
+        chunks = list(chunker.chunk("a b c d e f\ng h"))
+    # capped at the max sequence length.
+    assert [str(i) for i in chunks] == ["a b c d e", "f\ng h"]
+    assert chunks[1].start == Point(1, 10)
+    assert chunks[1].end == Point(2, 2)
+    assert all(sum(counter.count([str(i)])) <= 5 for i in chunks)
+
+
+def test_treesitter_chunker_by_tokens():
+    counter = TokenCounter(make_whitespace_tokenizer())
+    test_content = """
+def foo():
+    return "foo"
+
+def bar():
+    return "bar"
+"""
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".py") as tmp_file:
+        tmp_file.write(test_content)
+        test_file = tmp_file.name
+
+    with patch("vectorcode.chunking.get_token_counter", return_value=counter):
+        chunker = TreeSitterChunker(Config(chunk_size=8, chunk_by_tokens=True))
+        chunks = [str(i) for i in chunker.chunk(test_file)]
+    assert chunks == ['def foo():\n    return "foo"', 'def bar():\n    return "bar"']
+    assert all(counter.count([i])[0] <= 8 for i in chunks)
+    os.remove(test_file)
@@ -365,6 +365,33 @@ async def test_parse_cli_args_include_argument():
         assert config.include == [QueryInclude.path, QueryInclude.document]
 
 
+@pytest.mark.asyncio
+async def test_parse_cli_args_query_projects():
+    with patch(
+        "sys.argv",
+        ["vectorcode", "query", "test_query", "--projects", "../lib1", "../lib2"],
+    ):
+        config = await parse_cli_args()
+        assert config.query == ["test_query"]
+        assert config.query_projects == ["../lib1", "../lib2"]
+        assert not config.query_all_projects
+
+    with patch("sys.argv", ["vectorcode", "query", "test_query", "--all-projects"]):
+        config = await parse_cli_args()
+        assert config.query_projects == []
+        assert config.query_all_projects
+
+
+@pytest.mark.asyncio
+async def test_parse_cli_args_query_char_budget():
+    with patch("sys.argv", ["vectorcode", "query", "test_query"]):
+        assert (await parse_cli_args()).char_budget == 0
+    with patch(
+        "sys.argv", ["vectorcode", "query", "test_query", "--char-budget", "2000"]
+    ):
+        assert (await parse_cli_args()).char_budget == 2000
+
+
 @pytest.mark.asyncio
 async def test_parse_cli_args_vectorise():
     with patch("sys.argv", ["vectorcode", "vectorise", "file1.txt"]):
@@ -508,6 +535,17 @@ async def test_parse_cli_args_chunks():
         assert config.chunk_size == Config().chunk_size
 
 
+@pytest.mark.asyncio
+async def test_parse_cli_args_prepare():
+    with patch("sys.argv", ["vectorcode", "prepare"]):
+        config = await parse_cli_args()
+        assert config.action == CliAction.prepare
+        assert not config.force
+
+    with patch("sys.argv", ["vectorcode", "prepare", "--force"]):
+        assert (await parse_cli_args()).force
+
+
 @pytest.mark.asyncio
 async def test_config_import_from_hnsw():
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -13,6 +13,7 @@ from chromadb.utils import embedding_functions
 
 from vectorcode.cli_utils import Config
 from vectorcode.common import (
+    evict_collection,
     get_client,
     get_collection,
     get_collection_name,
@@ -23,6 +24,15 @@ from vectorcode.common import (
     verify_ef,
     wait_for_server,
 )
+from vectorcode.embedding_registry import (
+    embedding_function_registry,
+    make_embedding_key,
+)
+from vectorcode.reduction import (
+    PROJECTION_DIGEST_KEY,
+    get_calibration_digest,
+    get_calibration_path,
+)
 
 
 def test_get_collection_name():
@@ -259,6 +269,47 @@ def test_verify_ef():
     assert verify_ef(mock_collection, mock_config) is True
 
 
+def test_verify_ef_dimensions():
+    mock_collection = MagicMock()
+    mock_collection.metadata = {
+        "embedding_function": "SentenceTransformerEmbeddingFunction",
+        "embedding_dimensions": 256,
+        "embedding_reduction": "pca",
+    }
+    assert verify_ef(mock_collection, Config()) is False
+    assert (
+        verify_ef(mock_collection, Config(embedding_dimensions=256)) is False
+    )  # different reduction
+    assert verify_ef(
+        mock_collection,
+        Config(embedding_dimensions=256, embedding_reduction="pca"),
+    )
+
+
+def test_verify_ef_projection_digest(tmp_path):
+    configs = Config(
+        embedding_dimensions=2, embedding_reduction="pca", project_root=str(tmp_path)
+    )
+    mock_collection = MagicMock()
+    with patch("vectorcode.common.GLOBAL_INDEX_DIR", str(tmp_path)):
+        path = get_calibration_path(configs)
+        assert path is not None
+        mock_collection.metadata = {
+            "embedding_dimensions": 2,
+            "embedding_reduction": "pca",
+            PROJECTION_DIGEST_KEY: "digest",
+        }
+        # the projection is missing.
+        assert verify_ef(mock_collection, configs) is False
+
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fout:
+            fout.write(b"projection")
+        assert verify_ef(mock_collection, configs) is False
+        mock_collection.metadata[PROJECTION_DIGEST_KEY] = get_calibration_digest(path)
+        assert verify_ef(mock_collection, configs) is True
+
+
 @patch("socket.socket")
 @pytest.mark.asyncio
 async def test_try_server_mocked(mock_socket):
@@ -415,6 +466,80 @@ async def test_get_collection_hnsw():
         )
 
 
+@pytest.mark.asyncio
+async def test_get_collection_shares_embedding_function():
+    from vectorcode.common import __COLLECTION_CACHE
+
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+    mock_client = MagicMock(spec=AsyncClientAPI)
+    mock_client.get_collection.return_value = MagicMock()
+    configs = [
+        Config(
+            embedding_function="SentenceTransformerEmbeddingFunction",
+            embedding_params={"model_name": "foo"},
+            project_root=f"/test_project_{i}",
+        )
+        for i in range(2)
+    ]
+    key = make_embedding_key(configs[0])
+    with patch.object(
+        embedding_functions, "SentenceTransformerEmbeddingFunction"
+    ) as mock_stef:
+        for config in configs:
+            await get_collection(mock_client, config)
+        assert mock_stef.call_count == 1
+        assert embedding_function_registry.refcount(key) == 2
+        assert (
+            mock_client.get_collection.call_args_list[0].args[1]
+            is mock_client.get_collection.call_args_list[1].args[1]
+        )
+
+        evict_collection("/test_project_0")
+        assert embedding_function_registry.refcount(key) == 1
+        evict_collection("/test_project_0")
+        assert embedding_function_registry.refcount(key) == 1
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+
+
+@pytest.mark.asyncio
+async def test_get_collection_evicts_idle_collections():
+    from vectorcode.common import __COLLECTION_CACHE
+
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+    mock_client = MagicMock(spec=AsyncClientAPI)
+    mock_client.get_collection.return_value = MagicMock()
+    configs = [
+        Config(
+            embedding_function="SentenceTransformerEmbeddingFunction",
+            embedding_params={"model_name": f"model_{i}"},
+            project_root=f"/test_project_{i}",
+        )
+        for i in range(2)
+    ]
+    keys = [make_embedding_key(i) for i in configs]
+    with (
+        patch.object(embedding_functions, "SentenceTransformerEmbeddingFunction"),
+        patch("vectorcode.common.time.monotonic", return_value=0),
+        patch("vectorcode.embedding_registry.time.monotonic", return_value=0),
+    ):
+        await get_collection(mock_client, configs[0])
+    with (
+        patch.object(embedding_functions, "SentenceTransformerEmbeddingFunction"),
+        patch("vectorcode.common.time.monotonic", return_value=1000),
+        patch("vectorcode.embedding_registry.time.monotonic", return_value=1000),
+    ):
+        await get_collection(mock_client, configs[1])
+    # the idle collection released its embedding function, which was then unloaded.
+    assert "/test_project_0" not in __COLLECTION_CACHE
+    assert keys[0] not in embedding_function_registry
+    assert embedding_function_registry.refcount(keys[1]) == 1
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+
+
 @pytest.mark.asyncio
 async def test_start_server():
     with tempfile.TemporaryDirectory() as temp_dir:
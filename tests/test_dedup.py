@@ -0,0 +1,161 @@
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.dedup import (
+    DedupIndex,
+    DuplicateReference,
+    estimate_similarity,
+    get_dedup_index,
+    get_shingles,
+    minhash,
+)
+
+LICENSE = """
+# Copyright (c) 2024 The Project Authors. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+
+@pytest.fixture
+def dedup_index(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"), threshold=0.8)
+    yield index
+    index.close()
+
+
+def add(index: DedupIndex, path, ids, documents, metadatas) -> list[bool]:
+    plan = index.plan(path, ids, documents, metadatas)
+    index.add(plan)
+    return plan.keep
+
+
+def test_get_shingles():
+    assert get_shingles("  ") == set()
+    assert get_shingles("foo(bar)") == {"foo ( bar )"}
+    assert get_shingles("a b c d e f") == {"a b c d e", "b c d e f"}
+
+
+def test_minhash():
+    assert minhash("") is None
+    sketch = minhash(LICENSE)
+    assert sketch is not None
+    # whitespaces don't matter.
+    assert estimate_similarity(sketch, minhash(LICENSE.replace("\n", "\n  "))) == 1
+    assert estimate_similarity(sketch, minhash(LICENSE.replace("2024", "2025"))) > 0.7
+    assert estimate_similarity(sketch, minhash("def foo(): return 42")) < 0.1
+
+
+def test_dedup_index_add(dedup_index):
+    metas = [{"start": 0, "end": 4}, {"start": 5, "end": 9}, {}]
+    assert add(
+        dedup_index,
+        "/repo/a.py",
+        ["a1", "a2", "a3"],
+        [LICENSE, "def foo(): pass", "a.py"],
+        metas,
+    ) == [True, True, True]
+    assert add(
+        dedup_index,
+        "/repo/b.py",
+        ["b1", "b2", "b3"],
+        [LICENSE.replace("2024", "2025"), "def bar(): pass", "a.py"],
+        metas,
+    ) == [False, True, True]
+    assert dedup_index.count_duplicates() == 1
+    references = dedup_index.get_references("a1")
+    assert [(i.path, i.start, i.end) for i in references] == [("/repo/b.py", 0, 4)]
+    assert dedup_index.get_reference(references[0].id) == references[0]
+    assert dedup_index.get_reference("a1") is None
+    assert dedup_index.get_reference("dedup:foo") is None
+    assert references[0].id == f"dedup:{dedup_index.namespace}:1"
+    assert dedup_index.has_path("/repo/a.py") and dedup_index.has_path("/repo/b.py")
+
+
+def test_dedup_index_plan(dedup_index):
+    metas = [{"start": 0, "end": 4}, {"start": 10, "end": 14}]
+    plan = dedup_index.plan("/repo/a.py", ["a1", "a2"], [LICENSE, LICENSE], metas)
+    # a chunk can duplicate an earlier chunk of the same file.
+    assert plan.keep == [True, False]
+    # nothing is recorded until the plan is added.
+    assert not dedup_index.has_path("/repo/a.py")
+    assert dedup_index.plan("/repo/b.py", ["b1"], [LICENSE], metas[:1]).keep == [True]
+
+    dedup_index.add(plan)
+    assert dedup_index.has_path("/repo/a.py")
+    assert dedup_index.get_references("a1") == [
+        DuplicateReference(
+            f"dedup:{dedup_index.namespace}:1", "/repo/a.py", 10, 14, "a1"
+        )
+    ]
+
+
+def test_dedup_index_add_removed_canonical(dedup_index):
+    meta = [{"start": 0, "end": 4}]
+    add(dedup_index, "/repo/a.py", ["a1"], [LICENSE], meta)
+    plan = dedup_index.plan("/repo/b.py", ["b1"], [LICENSE], meta)
+    assert plan.keep == [False]
+    dedup_index.delete(["/repo/a.py"])
+
+    # b.py isn't marked as indexed because the chunk that it duplicates is gone.
+    dedup_index.add(plan)
+    assert not dedup_index.has_path("/repo/b.py")
+    assert dedup_index.count_duplicates() == 0
+
+
+def test_dedup_index_delete(dedup_index):
+    meta = [{"start": 0, "end": 4}]
+    add(dedup_index, "/repo/a.py", ["a1"], [LICENSE], meta)
+    add(dedup_index, "/repo/b.py", ["b1"], [LICENSE], meta)
+    add(dedup_index, "/repo/c.py", ["c1"], ["def foo(): pass"], meta)
+
+    # b.py referenced a chunk of a.py, so it has to be vectorised again.
+    assert dedup_index.delete(["/repo/a.py"]) == ["/repo/b.py"]
+    assert not dedup_index.has_path("/repo/a.py")
+    assert not dedup_index.has_path("/repo/b.py")
+    assert dedup_index.has_path("/repo/c.py")
+    assert dedup_index.count_duplicates() == 0
+    assert add(dedup_index, "/repo/b.py", ["b2"], [LICENSE], meta) == [True]
+
+
+def test_dedup_index_delete_dependents(dedup_index):
+    meta = [{"start": 0, "end": 4}]
+    add(dedup_index, "/repo/a.py", ["a1"], [LICENSE], meta)
+    add(dedup_index, "/repo/b.py", ["b1"], [LICENSE], meta)
+    add(dedup_index, "/repo/c.py", ["c1"], [LICENSE], meta)
+    # the deleted files aren't their own dependents.
+    assert dedup_index.delete(["/repo/a.py", "/repo/b.py"]) == ["/repo/c.py"]
+    assert dedup_index.delete(["/repo/d.py"]) == []
+
+
+def test_dedup_index_reference_namespace(tmp_path, dedup_index):
+    meta = [{"start": 0, "end": 4}]
+    other_index = DedupIndex(str(tmp_path / "other.sqlite3"), threshold=0.8)
+    try:
+        for index in (dedup_index, other_index):
+            add(index, "/repo/a.py", ["a1"], [LICENSE], meta)
+            add(index, "/repo/b.py", ["b1"], [LICENSE], meta)
+        reference = dedup_index.get_references("a1")[0]
+        other_reference = other_index.get_references("a1")[0]
+        # the references of different collections can be merged in the same results.
+        assert reference.id != other_reference.id
+        assert other_index.get_reference(reference.id) is None
+        assert dedup_index.get_reference(reference.id) == reference
+    finally:
+        other_index.close()
+
+
+def test_get_dedup_index(index_dir):
+    configs = Config(project_root=index_dir)
+    assert get_dedup_index(configs, make_if_missing=True) is None
+
+    configs.dedup_threshold = 0.9
+    assert get_dedup_index(configs) is None
+
+    index = get_dedup_index(configs, make_if_missing=True)
+    assert isinstance(index, DedupIndex)
+    assert index.threshold == 0.9
+    configs.dedup_threshold = 0.8
+    assert get_dedup_index(configs) is index
+    assert index.threshold == 0.8
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+from transformers import PreTrainedTokenizerBase
+
+from vectorcode.cli_utils import Config
+from vectorcode.embedding_batcher import (
+    EmbeddingBatcher,
+    count_tokens,
+    get_model_name,
+    get_tokenizer,
+    load_tokenizer,
+    make_batches,
+    make_embedding_batcher,
+)
+from vectorcode.embedding_pool import ProcessPoolEmbeddingFunction
+from vectorcode.embedding_registry import embedding_function_registry
+from vectorcode.reduction import ReducedEmbeddingFunction
+
+
+def test_count_tokens_estimate():
+    assert count_tokens(["", "a" * 8]) == [1, 3]
+    # a mocked embedding function doesn't have a real tokenizer.
+    assert get_tokenizer(MagicMock()) is None
+    assert count_tokens(["abcd"], MagicMock()) == [2]
+
+
+def test_count_tokens_with_tokenizer():
+    embedding_function = MagicMock()
+    embedding_function._model.max_seq_length = 4
+    tokenizer = MagicMock(spec=PreTrainedTokenizerBase)
+    tokenizer.return_value = {"input_ids": [[1, 2], [1, 2, 3, 4]]}
+    embedding_function._model.tokenizer = tokenizer
+
+    assert get_tokenizer(embedding_function) is tokenizer
+    assert count_tokens(["a", "b c d e f"], embedding_function) == [2, 4]
+    assert tokenizer.call_args.kwargs["truncation"]
+    assert tokenizer.call_args.kwargs["max_length"] == 4
+
+
+def test_count_tokens_under_the_lock():
+    embedding_function = MagicMock()
+    embedding_function._model.max_seq_length = 4
+    tokenizer = MagicMock(spec=PreTrainedTokenizerBase)
+    embedding_function._model.tokenizer = tokenizer
+    embedding_function_registry.clear()
+    embedding_function_registry.get("test_count_tokens", lambda: embedding_function)
+    lock = embedding_function_registry.lock_of(embedding_function)
+    # the tokenizer is shared with the model, which `embed` calls under the same lock.
+    tokenizer.side_effect = lambda texts, **kwargs: {
+        "input_ids": [[1] * (2 if lock.locked() else 1) for _ in texts]
+    }
+    try:
+        assert count_tokens(["a"], embedding_function) == [2]
+        reduced = ReducedEmbeddingFunction(
+            Config(embedding_dimensions=2), embedding_function
+        )
+        assert count_tokens(["a"], reduced) == [2]
+    finally:
+        embedding_function_registry.clear()
+
+
+def test_get_model_name():
+    assert get_model_name(Config(embedding_function="OllamaEmbeddingFunction")) is None
+    with patch(
+        "vectorcode.embedding_batcher.resolve_embedding_params",
+        side_effect=lambda _, params: params,
+    ):
+        assert (
+            get_model_name(
+                Config(embedding_function="SentenceTransformerEmbeddingFunction")
+            )
+            == "sentence-transformers/all-MiniLM-L6-v2"
+        )
+        assert (
+            get_model_name(
+                Config(
+                    embedding_function="SentenceTransformerEmbeddingFunction",
+                    embedding_params={"model_name": "BAAI/bge-small-en"},
+                )
+            )
+            == "BAAI/bge-small-en"
+        )
+
+
+def test_load_tokenizer(tmp_path):
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="[UNK]"
+    ).save_pretrained(tmp_path)
+    with open(os.path.join(tmp_path, "sentence_bert_config.json"), "w") as fout:
+        json.dump({"max_seq_length": 128}, fout)
+
+    loaded, max_length = load_tokenizer(
+        Config(
+            embedding_function="SentenceTransformerEmbeddingFunction",
+            embedding_params={"model_name": str(tmp_path)},
+        )
+    )
+    assert isinstance(loaded, PreTrainedTokenizerBase)
+    assert loaded("foo bar", add_special_tokens=False)["input_ids"] == [0, 0]
+    assert max_length == 128
+
+
+def test_load_tokenizer_failures(tmp_path):
+    assert load_tokenizer(Config(embedding_function="OllamaEmbeddingFunction")) == (
+        None,
+        None,
+    )
+    assert load_tokenizer(
+        Config(
+            embedding_function="SentenceTransformerEmbeddingFunction",
+            embedding_params={"model_name": str(tmp_path)},
+        )
+    ) == (None, None)
+
+
+def test_make_batches():
+    lengths = [5, 1, 10, 2, 1]
+    batches = make_batches(lengths, token_budget=10)
+    # every index is batched exactly once, from the shortest to the longest.
+    assert sorted(sum(batches, [])) == list(range(len(lengths)))
+    assert sum(batches, []) == [1, 4, 3, 0, 2]
+    for batch in batches:
+        assert len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 10
+
+    assert make_batches(lengths, token_budget=100, max_batch_size=2) == [
+        [1, 4],
+        [3, 0],
+        [2],
+    ]
+    assert make_batches([], token_budget=10) == []
+
+
+@pytest.mark.asyncio
+async def test_batcher_restores_order():
+    calls: list[list[str]] = []
+
+    def embedding_function(texts):
+        calls.append(list(texts))
+        return [[len(i)] for i in texts]
+
+    batcher = EmbeddingBatcher(embedding_function, token_budget=100, max_delay=0.01)
+    first, second = await asyncio.gather(
+        batcher.embed(["a" * 20, "b"]), batcher.embed(["cc" * 4, "d" * 12])
+    )
+    assert first == [[20], [1]]
+    assert second == [[8], [12]]
+    # the documents from both calls are batched together, sorted by their lengths.
+    assert calls == [["b", "cc" * 4, "d" * 12, "a" * 20]]
+    assert await batcher.embed([]) == []
+
+
+@pytest.mark.asyncio
+async def test_batcher_error():
+    def embedding_function(texts):
+        raise RuntimeError("test error")
+
+    batcher = EmbeddingBatcher(embedding_function, token_budget=1, max_delay=0.01)
+    with pytest.raises(RuntimeError):
+        await batcher.embed(["foo"])
+
+
+def test_make_embedding_batcher():
+    assert make_embedding_batcher(Config()) is None
+    batcher = make_embedding_batcher(
+        Config(embedding_function="DefaultEmbeddingFunction", embedding_batch_tokens=8)
+    )
+    assert isinstance(batcher, EmbeddingBatcher)
+    assert batcher.token_budget == 8
+
+
+@pytest.mark.parametrize("dimensions", [0, 2])
+def test_make_embedding_batcher_with_processes(dimensions):
+    embedding_function_registry.clear()
+    configs = Config(
+        embedding_function="Fake",
+        embedding_batch_tokens=8,
+        embedding_processes=2,
+        embedding_dimensions=dimensions,
+        embedding_reduction="truncate",
+    )
+    with patch("vectorcode.common._make_embedding_function") as mock_make:
+        batcher = make_embedding_batcher(configs)
+        assert batcher is not None
+        # the documents are embedded by the pool, and the tokens are counted
+        # with the model in this process.
+        function = batcher.embedding_function
+        tokenizer_function = batcher.tokenizer_function
+        if dimensions > 0:
+            assert isinstance(function, ReducedEmbeddingFunction)
+            assert isinstance(tokenizer_function, ReducedEmbeddingFunction)
+            function = function.base_function
+            tokenizer_function = tokenizer_function.base_function
+        assert isinstance(function, ProcessPoolEmbeddingFunction)
+        assert tokenizer_function is mock_make.return_value
+    embedding_function_registry.clear()
+
+
+def test_make_embedding_batcher_processes_without_batches(caplog):
+    assert make_embedding_batcher(Config(embedding_processes=2)) is None
+    assert "embedding_batch_tokens" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_batcher_tokenizer_function():
+    tokenizer_function = MagicMock()
+    tokenizer = MagicMock(spec=PreTrainedTokenizerBase)
+    tokenizer.return_value = {"input_ids": [[1, 2, 3]]}
+    tokenizer_function._model.tokenizer = tokenizer
+    tokenizer_function._model.max_seq_length = 16
+    embedding_function = MagicMock(return_value=[[1.0]])
+    batcher = EmbeddingBatcher(
+        embedding_function,
+        token_budget=1,
+        max_delay=0.01,
+        tokenizer_function=tokenizer_function,
+    )
+    assert await batcher.embed(["foo"]) == [[1.0]]
+    tokenizer.assert_called_once()
+    tokenizer_function.assert_not_called()
@@ -0,0 +1,110 @@
+import os
+from dataclasses import replace
+from unittest.mock import patch
+
+import psutil
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.common import get_embedding_function
+from vectorcode.embedding_pool import (
+    ProcessPoolEmbeddingFunction,
+    WorkerStats,
+    get_embedding_pool,
+    split_shards,
+)
+from vectorcode.embedding_registry import embedding_function_registry
+
+
+def length_embedding(texts):
+    num_threads = float(os.environ.get("OMP_NUM_THREADS", 0))
+    return [[float(len(i)), num_threads] for i in texts]
+
+
+def make_length_embedding():
+    return length_embedding
+
+
+def test_split_shards():
+    assert split_shards(["a", "b", "c", "d"], 2) == [["a", "b"], ["c", "d"]]
+    assert split_shards(["aaaa", "b", "c", "d"], 2) == [["aaaa"], ["b", "c", "d"]]
+    assert split_shards(["a", "b"], 4) == [["a"], ["b"]]
+    assert split_shards(["a", "b", "c"], 3) == [["a"], ["b"], ["c"]]
+    texts = [str(i) * (i % 7) for i in range(50)]
+    shards = split_shards(texts, 4)
+    assert len(shards) == 4
+    assert sum(shards, []) == texts
+
+
+def test_worker_stats():
+    assert WorkerStats().throughput == 0
+    assert WorkerStats(documents=10, seconds=2).throughput == 5
+
+
+def test_process_pool_embedding_function():
+    ef = ProcessPoolEmbeddingFunction(
+        Config(embedding_processes=2, embedding_threads=3),
+        factory=make_length_embedding,
+    )
+    texts = ["a" * i for i in range(1, 21)]
+    try:
+        embeddings = ef(texts)
+    finally:
+        ef.close()
+    assert [float(i[0]) for i in embeddings] == [float(len(i)) for i in texts]
+    # the thread count is pinned in the workers.
+    assert all(float(i[1]) == 3 for i in embeddings)
+    assert sum(i.documents for i in ef.stats.values()) == len(texts)
+    assert os.getpid() not in ef.stats
+    report = ef.report()
+    assert len(report.splitlines()) == len(ef.stats)
+    assert "documents/s" in report
+
+
+def test_embedding_pool_closed_by_registry():
+    embedding_function_registry.clear()
+    configs = Config(embedding_processes=2, embedding_threads=1)
+    with patch(
+        "vectorcode.embedding_pool.ProcessPoolEmbeddingFunction",
+        side_effect=lambda base_configs: ProcessPoolEmbeddingFunction(
+            base_configs, factory=make_length_embedding
+        ),
+    ):
+        pool = get_embedding_pool(configs)
+    assert pool is not None
+    pool(["foo", "bar"])
+    workers = [psutil.Process(pid) for pid in pool.stats]
+    assert workers
+    # the worker processes are stopped when the registry drops the pool.
+    embedding_function_registry.clear()
+    _, alive = psutil.wait_procs(workers, timeout=10)
+    assert alive == []
+
+
+def test_get_embedding_pool():
+    assert get_embedding_pool(Config()) is None
+    embedding_function_registry.clear()
+    configs = Config(embedding_function="Fake", embedding_processes=4)
+    with patch("vectorcode.common._make_embedding_function") as mock_make:
+        pool = get_embedding_pool(configs)
+        assert isinstance(pool, ProcessPoolEmbeddingFunction)
+        assert pool.num_processes == 4
+        assert pool.num_threads == max(1, (os.cpu_count() or 1) // 4)
+        assert get_embedding_pool(configs) is pool
+        # the pool produces the full embeddings.
+        assert get_embedding_pool(replace(configs, embedding_dimensions=2)) is pool
+        mock_make.assert_not_called()
+    embedding_function_registry.clear()
+
+
+@pytest.mark.parametrize("processes", [0, 1, 4])
+def test_embedding_function_without_pool(processes):
+    # the queries (and the servers) keep embedding in this process.
+    embedding_function_registry.clear()
+    with patch("vectorcode.common._make_embedding_function") as mock_make:
+        assert (
+            get_embedding_function(Config(embedding_processes=processes))
+            is mock_make.return_value
+        )
+        mock_make.assert_called_once()
+    embedding_function_registry.clear()
@@ -0,0 +1,161 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+from vectorcode.cli_utils import Config
+from vectorcode.embedding_registry import (
+    EmbeddingFunctionRegistry,
+    embed,
+    embedding_function_registry,
+    make_embedding_key,
+)
+
+
+def test_make_embedding_key():
+    key = make_embedding_key(
+        Config(embedding_function="foo", embedding_params={"b": 1, "a": 2})
+    )
+    assert key == make_embedding_key(
+        Config(embedding_function="foo", embedding_params={"a": 2, "b": 1})
+    )
+    assert key != make_embedding_key(
+        Config(embedding_function="bar", embedding_params={"a": 2, "b": 1})
+    )
+    assert key != make_embedding_key(
+        Config(
+            embedding_function="foo",
+            embedding_params={"a": 2, "b": 1},
+            embedding_worker=True,
+        )
+    )
+    assert key != make_embedding_key(
+        Config(
+            embedding_function="foo",
+            embedding_params={"a": 2, "b": 1},
+            embedding_dimensions=128,
+        )
+    )
+    # the reduced embeddings of each project have their own projection.
+    assert make_embedding_key(
+        Config(embedding_function="foo", embedding_dimensions=128, project_root="/a")
+    ) != make_embedding_key(
+        Config(embedding_function="foo", embedding_dimensions=128, project_root="/b")
+    )
+
+
+def test_registry_shares_instances():
+    registry = EmbeddingFunctionRegistry()
+    factory = MagicMock(side_effect=lambda: object())
+    first = registry.get("key", factory)
+    assert registry.get("key", factory) is first
+    assert factory.call_count == 1
+    assert "key" in registry and len(registry) == 1
+
+
+def test_registry_loads_once_across_threads():
+    registry = EmbeddingFunctionRegistry()
+    factory = MagicMock(side_effect=lambda: object())
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get("key", factory)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert factory.call_count == 1
+    assert all(i is results[0] for i in results)
+
+
+def test_registry_loads_keys_independently():
+    registry = EmbeddingFunctionRegistry()
+    loading = threading.Event()
+    release = threading.Event()
+    function = object()
+    registry.get("a", lambda: function)
+
+    def slow_factory():
+        loading.set()
+        assert release.wait(5)
+        return object()
+
+    thread = threading.Thread(target=lambda: registry.get("b", slow_factory))
+    thread.start()
+    assert loading.wait(5)
+    # a cold load of "b" doesn't block the users of "a".
+    assert registry.get("a", object) is function
+    with registry.lock_of(function):
+        pass
+    release.set()
+    thread.join()
+    assert "b" in registry
+
+
+def test_registry_refcount_and_idle_eviction():
+    registry = EmbeddingFunctionRegistry(ttl=10)
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=0):
+        registry.get("used", object)
+        registry.get("idle", object)
+        registry.retain("used")
+        registry.retain("missing")
+    assert registry.refcount("used") == 1
+    assert registry.refcount("missing") == 0
+
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=20):
+        # referenced functions are kept, idle ones are evicted.
+        registry.get("other", object)
+        assert "used" in registry and "idle" not in registry
+
+        registry.release("used")
+    assert registry.refcount("used") == 0
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=40):
+        registry.get("other", object)
+    assert "used" not in registry and "other" in registry
+
+
+def test_registry_closes_evicted_functions():
+    registry = EmbeddingFunctionRegistry(ttl=10)
+    idle, used = MagicMock(), MagicMock()
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=0):
+        registry.get("idle", lambda: idle)
+        registry.get("used", lambda: used)
+        registry.get("plain", object)
+        registry.retain("used")
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=20):
+        # functions without a `close` method are just dropped.
+        registry.get("other", object)
+    idle.close.assert_called_once()
+    used.close.assert_not_called()
+
+    registry.clear()
+    used.close.assert_called_once()
+    assert len(registry) == 0
+
+
+def test_registry_dependencies():
+    registry = EmbeddingFunctionRegistry(ttl=10)
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=0):
+        registry.get("base", object)
+        registry.get("reduced", object, dependencies=["base", "missing"])
+        registry.retain("reduced")
+    # the wrapper holds a reference to the function that it wraps.
+    assert registry.refcount("base") == 1
+
+    with patch("vectorcode.embedding_registry.time.monotonic", return_value=20):
+        registry.get("other", object)
+        assert "base" in registry and "reduced" in registry
+        registry.release("reduced", last_used=5)
+    # both are evicted because the wrapper was last used at 5.
+    assert "base" not in registry and "reduced" not in registry
+
+
+def test_embed():
+    function = MagicMock(return_value=[[1.0]])
+    embedding_function_registry.get("test_embed", lambda: function)
+    try:
+        assert embed(function, ["hello"]) == [[1.0]]
+        function.assert_called_once_with(["hello"])
+        # unregistered functions are called directly.
+        assert embed(lambda x: [[2.0]], ["hello"]) == [[2.0]]
+    finally:
+        embedding_function_registry.clear()
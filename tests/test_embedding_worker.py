@@ -0,0 +1,143 @@
+import asyncio
+import os
+import socket
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.embedding_worker import (
+    EmbeddingWorker,
+    WorkerEmbeddingFunction,
+    get_arg_parser,
+    request_embeddings,
+)
+
+
+def fake_embedding_function(texts):
+    return [[float(len(i)), 1.0] for i in texts]
+
+
+@pytest.mark.asyncio
+async def test_embedding_worker():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "worker.sock")
+        worker = EmbeddingWorker(socket_path, idle_timeout=0.5)
+        with patch(
+            "vectorcode.common.get_embedding_function",
+            return_value=fake_embedding_function,
+        ) as mock_get_embedding_function:
+            server = asyncio.create_task(worker.serve())
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+
+            embeddings = await asyncio.to_thread(
+                request_embeddings,
+                socket_path,
+                "FooEmbeddingFunction",
+                {"model_name": "bar"},
+                ["a", "abc"],
+            )
+            assert embeddings == [[1.0, 1.0], [3.0, 1.0]]
+            configs = mock_get_embedding_function.call_args.args[0]
+            assert configs.embedding_function == "FooEmbeddingFunction"
+            assert configs.embedding_params == {"model_name": "bar"}
+
+            mock_get_embedding_function.side_effect = ValueError("no such model")
+            with pytest.raises(RuntimeError):
+                await asyncio.to_thread(
+                    request_embeddings, socket_path, "Foo", {}, ["a"]
+                )
+
+            # shuts down after being idle.
+            assert await asyncio.wait_for(server, 10) == 0
+            assert not os.path.exists(socket_path)
+
+
+def test_worker_embedding_function_fallback():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "worker.sock")
+        configs = Config(
+            embedding_function="FooEmbeddingFunction", embedding_worker=True
+        )
+        function = WorkerEmbeddingFunction(configs, socket_path)
+        with (
+            patch("vectorcode.embedding_worker.spawn_worker") as mock_spawn_worker,
+            patch(
+                "vectorcode.common.get_embedding_function",
+                return_value=MagicMock(side_effect=fake_embedding_function),
+            ) as mock_get_embedding_function,
+        ):
+            assert [list(i) for i in function(["ab"])] == [[2.0, 1.0]]
+            mock_spawn_worker.assert_called_once_with(socket_path)
+            assert not mock_get_embedding_function.call_args.args[0].embedding_worker
+
+            # the process keeps using the fallback.
+            function(["abc"])
+            mock_spawn_worker.assert_called_once()
+            mock_get_embedding_function.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "error", [RuntimeError("model not found"), TimeoutError("timed out")]
+)
+def test_worker_embedding_function_worker_fails(error):
+    configs = Config(embedding_function="FooEmbeddingFunction", embedding_worker=True)
+    function = WorkerEmbeddingFunction(configs, "/tmp/worker.sock")
+    with (
+        patch("vectorcode.embedding_worker.request_embeddings", side_effect=error),
+        patch("vectorcode.embedding_worker.spawn_worker") as mock_spawn_worker,
+        patch(
+            "vectorcode.common.get_embedding_function",
+            return_value=MagicMock(side_effect=fake_embedding_function),
+        ),
+    ):
+        assert [list(i) for i in function(["ab"])] == [[2.0, 1.0]]
+    # the worker is running.
+    mock_spawn_worker.assert_not_called()
+
+
+def test_request_embeddings_timeout():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "worker.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socket_path)
+            # a hung worker: it accepts the connection but never responds.
+            server.listen()
+            with (
+                patch("vectorcode.embedding_worker.WORKER_REQUEST_TIMEOUT", 0.1),
+                pytest.raises(TimeoutError),
+            ):
+                request_embeddings(socket_path, "FooEmbeddingFunction", {}, ["a"])
+
+
+def test_worker_embedding_function_uses_worker():
+    configs = Config(embedding_function="FooEmbeddingFunction", embedding_worker=True)
+    function = WorkerEmbeddingFunction(configs, "/tmp/worker.sock")
+    with patch(
+        "vectorcode.embedding_worker.request_embeddings", return_value=[[1.0, 2.0]]
+    ) as mock_request:
+        assert [list(i) for i in function(["hello"])] == [[1.0, 2.0]]
+    mock_request.assert_called_once_with(
+        "/tmp/worker.sock", "FooEmbeddingFunction", {}, ["hello"]
+    )
+
+
+def test_get_embedding_function_with_worker():
+    from vectorcode.common import get_embedding_function
+    from vectorcode.embedding_registry import embedding_function_registry
+
+    try:
+        function = get_embedding_function(
+            Config(embedding_function="FooEmbeddingFunction", embedding_worker=True)
+        )
+        assert isinstance(function, WorkerEmbeddingFunction)
+    finally:
+        embedding_function_registry.clear()
+
+
+def test_get_arg_parser():
+    args = get_arg_parser().parse_args(["--socket", "/tmp/foo.sock"])
+    assert args.socket == "/tmp/foo.sock"
+    assert args.idle_timeout == 600
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.governor import (
+    BACKGROUND_NICENESS,
+    QueryTracker,
+    apply_governor,
+    get_background_threads,
+    get_indexing_concurrency,
+    limit_threads,
+    lower_priority,
+    yield_to_queries,
+)
+
+
+def test_get_indexing_concurrency():
+    with patch("os.cpu_count", return_value=16):
+        assert get_indexing_concurrency(Config()) == 16
+        assert get_background_threads(Config()) == 4
+        assert get_indexing_concurrency(Config(background_indexing=True)) == 4
+        assert (
+            get_indexing_concurrency(
+                Config(background_indexing=True, background_threads=2)
+            )
+            == 2
+        )
+    with patch("os.cpu_count", return_value=None):
+        assert get_indexing_concurrency(Config(background_indexing=True)) == 1
+
+
+def test_limit_threads():
+    torch = MagicMock()
+    with (
+        patch.dict(os.environ, {}),
+        patch.dict("sys.modules", {"torch": torch}),
+    ):
+        limit_threads(3)
+        assert os.environ["OMP_NUM_THREADS"] == "3"
+        assert os.environ["RAYON_NUM_THREADS"] == "3"
+    torch.set_num_threads.assert_called_once_with(3)
+
+
+def test_lower_priority():
+    process = MagicMock()
+    process.nice.return_value = 0
+    with (
+        patch("vectorcode.governor.psutil.Process", return_value=process),
+        patch("vectorcode.governor.psutil.WINDOWS", False),
+        patch("vectorcode.governor.psutil.LINUX", True),
+    ):
+        lower_priority()
+    process.nice.assert_called_with(BACKGROUND_NICENESS)
+    process.ionice.assert_called_once()
+
+    # don't raise the priority of a process that's already niced.
+    process.reset_mock()
+    process.nice.return_value = 19
+    with (
+        patch("vectorcode.governor.psutil.Process", return_value=process),
+        patch("vectorcode.governor.psutil.WINDOWS", False),
+        patch("vectorcode.governor.psutil.LINUX", False),
+    ):
+        lower_priority()
+    process.nice.assert_called_with(19)
+    process.ionice.assert_not_called()
+
+
+def test_apply_governor():
+    with (
+        patch("vectorcode.governor.limit_threads") as mock_limit_threads,
+        patch("vectorcode.governor.lower_priority") as mock_lower_priority,
+    ):
+        assert not apply_governor(Config())
+        mock_limit_threads.assert_not_called()
+
+        configs = Config(background_indexing=True, background_threads=2)
+        assert apply_governor(configs)
+        mock_limit_threads.assert_called_once_with(2)
+        mock_lower_priority.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_query_tracker():
+    tracker = QueryTracker()
+    assert tracker.in_flight == 0
+    assert await tracker.wait_until_idle() < 0.05
+
+    async def query():
+        with tracker.track():
+            assert tracker.in_flight == 1
+            await asyncio.sleep(0.2)
+
+    task = asyncio.create_task(query())
+    # the query starts before the indexing resumes.
+    assert await tracker.wait_until_idle() >= 0.1
+    assert task.done()
+    assert tracker.in_flight == 0
+
+    with tracker.track():
+        assert await tracker.wait_until_idle(max_pause=0.1) < 1
+
+
+@pytest.mark.asyncio
+async def test_yield_to_queries():
+    with patch("vectorcode.governor.query_tracker") as mock_tracker:
+        await yield_to_queries(Config())
+        mock_tracker.wait_until_idle.assert_not_called()
+
+        async def wait_until_idle():
+            return 0.5
+
+        mock_tracker.wait_until_idle.side_effect = wait_until_idle
+        await yield_to_queries(Config(background_indexing=True))
+        mock_tracker.wait_until_idle.assert_called_once()
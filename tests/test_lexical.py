@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.lexical import (
+    LexicalIndex,
+    build_match_expression,
+    get_lexical_index,
+)
+from vectorcode.sqlite_index import close_indices
+
+
+@pytest.fixture
+def lexical_index(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    index.add(
+        ["id1", "id2", "id3"],
+        [
+            "def get_reranker(configs):\n    pass",
+            "class RerankerBase(ABC): ...",
+            "src/vectorcode/subcommands/query/reranker/__init__.py",
+        ],
+        [
+            {"path": "/repo/a.py", "start": 1, "end": 2},
+            {"path": "/repo/b.py", "start": 3, "end": 3},
+            {"path": "/repo/c.py"},
+        ],
+    )
+    yield index
+    index.close()
+
+
+def test_build_match_expression():
+    assert build_match_expression("get_reranker") == '"get reranker"'
+    assert build_match_expression('foo "bar"') == '"foo" OR "bar"'
+    assert build_match_expression("foo.bar(baz)") == '"foo bar baz"'
+    assert build_match_expression("  ()  ") == ""
+
+
+def test_lexical_index_search(lexical_index):
+    hits = lexical_index.search("get_reranker", 10)
+    assert [i.id for i in hits] == ["id1"]
+    assert hits[0].path == "/repo/a.py"
+    assert hits[0].start == 1 and hits[0].end == 2
+    assert hits[0].document.startswith("def get_reranker")
+
+    hits = lexical_index.search("reranker", 10)
+    assert {i.id for i in hits} == {"id1", "id3"}
+    assert all(hits[i].score >= hits[i + 1].score for i in range(len(hits) - 1))
+
+
+def test_lexical_index_search_filters(lexical_index):
+    assert lexical_index.search("reranker", 10, chunk_only=True)[0].id == "id1"
+    assert lexical_index.search("reranker", 10, exclude_paths=["/repo/a.py"])[0].id == (
+        "id3"
+    )
+    assert len(lexical_index.search("reranker", 1)) == 1
+    assert lexical_index.search("reranker", 0) == []
+    assert lexical_index.search("!!!", 10) == []
+
+
+def test_lexical_index_delete(lexical_index):
+    assert lexical_index.count() == 3
+    assert lexical_index.has_path("/repo/a.py")
+    lexical_index.delete(["/repo/a.py"])
+    assert not lexical_index.has_path("/repo/a.py")
+    assert lexical_index.count() == 2
+    assert lexical_index.search("get_reranker", 10) == []
+
+
+def test_get_lexical_index(index_dir):
+    configs = Config(project_root=index_dir)
+    assert get_lexical_index(configs, make_if_missing=True) is None
+
+    configs.lexical_index = True
+    assert get_lexical_index(configs) is None
+
+    index = get_lexical_index(configs, make_if_missing=True)
+    assert isinstance(index, LexicalIndex)
+    assert os.path.isfile(index.db_path)
+    assert get_lexical_index(configs) is index
+
+    close_indices(os.path.basename(os.path.dirname(index.db_path)))
+    new_index = get_lexical_index(configs)
+    assert new_index is not None and new_index is not index
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
@@ -7,6 +8,7 @@ from pygls.server import LanguageServer
 from vectorcode import __version__
 from vectorcode.cli_utils import CliAction, Config, QueryInclude
 from vectorcode.lsp_main import (
+    QUERY_RESULT_NOTIFICATION,
     execute_command,
     lsp_start,
     make_caches,
@@ -123,6 +125,131 @@ async def test_execute_command_query(mock_language_server, mock_config):
         mock_language_server.progress.end.assert_called()
 
 
+@pytest.mark.asyncio
+async def test_execute_command_query_evicts_idle_models(mock_language_server):
+    from chromadb.api import AsyncClientAPI
+    from chromadb.utils import embedding_functions
+
+    from vectorcode.common import __COLLECTION_CACHE
+    from vectorcode.embedding_registry import (
+        embedding_function_registry,
+        make_embedding_key,
+    )
+
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+    configs = [
+        Config(
+            action=CliAction.query,
+            embedding_function="SentenceTransformerEmbeddingFunction",
+            embedding_params={"model_name": f"model_{i}"},
+            project_root=f"/test/project_{i}",
+            query=["test"],
+        )
+        for i in range(2)
+    ]
+    mock_client = MagicMock(spec=AsyncClientAPI)
+    mock_client.get_collection.return_value = MagicMock()
+    with (
+        patch(
+            "vectorcode.lsp_main.parse_cli_args", new_callable=AsyncMock
+        ) as mock_parse_cli_args,
+        patch("vectorcode.lsp_main.get_client", return_value=mock_client),
+        patch("vectorcode.lsp_main.build_query_results", return_value=[]),
+        patch("vectorcode.lsp_main.try_server", return_value=True),
+        patch("vectorcode.lsp_main.cached_project_configs", {}),
+        patch.object(embedding_functions, "SentenceTransformerEmbeddingFunction"),
+        patch.object(embedding_function_registry, "ttl", 0),
+    ):
+        from vectorcode.lsp_main import cached_project_configs
+
+        mock_parse_cli_args.side_effect = configs
+        for config in configs:
+            cached_project_configs[config.project_root] = config
+            await execute_command(mock_language_server, ["query", "test"])
+        # the model of the first project was unloaded when its collection went idle.
+        assert make_embedding_key(configs[0]) not in embedding_function_registry
+        assert make_embedding_key(configs[1]) in embedding_function_registry
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+
+
+@pytest.mark.asyncio
+async def test_execute_command_query_stream(mock_language_server, mock_config):
+    async def fake_results(*_):
+        yield {"path": "/test/file1.txt"}
+        yield {"path": "/test/file2.txt"}
+
+    mock_config.stream = True
+    with (
+        patch(
+            "vectorcode.lsp_main.parse_cli_args", new_callable=AsyncMock
+        ) as mock_parse_cli_args,
+        patch("vectorcode.lsp_main.get_client", new_callable=AsyncMock),
+        patch("vectorcode.lsp_main.get_collection", new_callable=AsyncMock),
+        patch("vectorcode.lsp_main.iter_query_results", side_effect=fake_results),
+        patch("vectorcode.lsp_main.try_server", return_value=True),
+        patch("vectorcode.lsp_main.cached_project_configs", {}),
+    ):
+        from vectorcode.lsp_main import cached_project_configs
+
+        mock_parse_cli_args.return_value = mock_config
+        cached_project_configs["/test/project"] = mock_config
+        mock_config.merge_from = AsyncMock(return_value=mock_config)
+
+        result = await execute_command(mock_language_server, ["query", "test"])
+
+        assert result == []
+        notifications = mock_language_server.send_notification.call_args_list
+        assert {i.args[0] for i in notifications} == {QUERY_RESULT_NOTIFICATION}
+        assert [i.args[1]["result"] for i in notifications] == [
+            {"path": "/test/file1.txt"},
+            {"path": "/test/file2.txt"},
+        ]
+        assert (
+            notifications[0].args[1]["token"]
+            == mock_language_server.progress.begin.call_args.args[0]
+        )
+        mock_language_server.progress.end.assert_called()
+
+
+@pytest.mark.asyncio
+async def test_execute_command_query_stream_messages(mock_config):
+    async def fake_results(*_):
+        yield {"path": "/test/file1.txt"}
+        yield {"path": "/test/file2.txt"}
+
+    ls = LanguageServer(name="test-server", version=__version__)
+    ls.lsp.transport = MagicMock()
+    ls.lsp._send_only_body = True
+    mock_config.stream = True
+    with (
+        patch("vectorcode.lsp_main.parse_cli_args", return_value=mock_config),
+        patch("vectorcode.lsp_main.get_client", new_callable=AsyncMock),
+        patch("vectorcode.lsp_main.get_collection", new_callable=AsyncMock),
+        patch("vectorcode.lsp_main.iter_query_results", side_effect=fake_results),
+        patch("vectorcode.lsp_main.try_server", return_value=True),
+        patch("vectorcode.lsp_main.cached_project_configs", {}),
+        patch.object(ls.progress, "create_async", new_callable=AsyncMock),
+    ):
+        from vectorcode.lsp_main import cached_project_configs
+
+        cached_project_configs["/test/project"] = mock_config
+        mock_config.merge_from = AsyncMock(return_value=mock_config)
+        assert await execute_command(ls, ["query", "test"]) == []
+
+    # decode the messages as the client receives them.
+    messages = [json.loads(i.args[0]) for i in ls.lsp.transport.write.call_args_list]
+    progress = [i["params"] for i in messages if i["method"] == "$/progress"]
+    assert [i["value"]["kind"] for i in progress] == ["begin", "end"]
+    assert [
+        i["params"] for i in messages if i["method"] == QUERY_RESULT_NOTIFICATION
+    ] == [
+        {"token": progress[0]["token"], "result": {"path": "/test/file1.txt"}},
+        {"token": progress[0]["token"], "result": {"path": "/test/file2.txt"}},
+    ]
+
+
 @pytest.mark.asyncio
 async def test_execute_command_query_default_proj_root(
     mock_language_server, mock_config
@@ -225,6 +352,7 @@ async def test_execute_command_vectorise(mock_language_server, mock_config: Conf
     mock_config.recursive = True
     mock_config.include_hidden = False
     mock_config.force = False  # To test exclude_paths_by_spec path
+    mock_config.background_indexing = True
 
     # Files that load_files_from_include will return and expand_globs will process
     dummy_initial_files = ["file_a.py", "file_b.txt"]
@@ -268,6 +396,8 @@ async def test_execute_command_vectorise(mock_language_server, mock_config: Conf
         patch(
             "vectorcode.lsp_main.remove_orphanes", new_callable=AsyncMock
         ) as mock_remove_orphanes,
+        patch("vectorcode.governor.limit_threads") as mock_limit_threads,
+        patch("vectorcode.governor.lower_priority") as mock_lower_priority,
     ):
         from unittest.mock import ANY
 
@@ -323,6 +453,10 @@ async def test_execute_command_vectorise(mock_language_server, mock_config: Conf
         mock_exclude_paths_by_spec.assert_not_called()  # Because mock_find_exclude_specs returns empty list (no specs to exclude by)
         mock_client.get_max_batch_size.assert_called_once()
 
+        # the server keeps its thread pools and priority for the queries.
+        mock_limit_threads.assert_not_called()
+        mock_lower_priority.assert_not_called()
+
         # Check chunked_add calls
         assert mock_chunked_add.call_count == len(dummy_expanded_files)
         for file_path in dummy_expanded_files:
@@ -335,6 +469,7 @@ async def test_execute_command_vectorise(mock_language_server, mock_config: Conf
                 mock_config,
                 100,  # max_batch_size
                 ANY,  # semaphore
+                None,  # batcher (embedding_batch_tokens is disabled)
             )
         # Check progress report calls
         assert mock_language_server.progress.report.call_count == len(
@@ -421,6 +556,24 @@ async def test_lsp_start_with_project_root():
             assert DEFAULT_PROJECT_ROOT == "/test/project"
 
 
+@pytest.mark.asyncio
+async def test_lsp_start_warm_up():
+    with (
+        patch(
+            "sys.argv", ["lsp_main.py", "--project_root", "/test/project", "--warm-up"]
+        ),
+        patch(
+            "vectorcode.lsp_main.get_project_config", return_value=Config()
+        ) as mock_get_project_config,
+        patch("asyncio.to_thread") as mock_to_thread,
+    ):
+        await lsp_start()
+        mock_get_project_config.assert_called_once_with("/test/project")
+        from vectorcode.lsp_main import warm_up_reranker
+
+        mock_to_thread.assert_any_call(warm_up_reranker, Config())
+
+
 @pytest.mark.asyncio
 async def test_lsp_start_find_project_root_none():
     with patch("sys.argv", ["lsp_main.py"]):
@@ -110,6 +110,27 @@ async def test_async_main_cli_action_chunks(monkeypatch):
     mock_chunks.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_async_main_cli_action_prepare(monkeypatch):
+    mock_cli_args = MagicMock(
+        no_stderr=False, project_root=".", action=CliAction.prepare
+    )
+    monkeypatch.setattr(
+        "vectorcode.main.parse_cli_args", AsyncMock(return_value=mock_cli_args)
+    )
+    mock_prepare = AsyncMock(return_value=0)
+    monkeypatch.setattr("vectorcode.subcommands.prepare", mock_prepare)
+    monkeypatch.setattr("vectorcode.main.get_project_config", AsyncMock())
+    mock_try_server = AsyncMock(return_value=True)
+    monkeypatch.setattr("vectorcode.common.try_server", mock_try_server)
+
+    return_code = await async_main()
+    assert return_code == 0
+    mock_prepare.assert_called_once()
+    # the models are prepared without the database.
+    mock_try_server.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_async_main_cli_action_version(monkeypatch, capsys):
     mock_cli_args = MagicMock(
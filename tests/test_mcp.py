@@ -126,6 +126,145 @@ async def test_query_tool_success():
         assert "<path>rel/path.py</path>\n<content>file content</content>" in result
 
 
+@pytest.mark.asyncio
+async def test_query_tool_blends_prefix_symbols():
+    from vectorcode.chunking import Symbol
+
+    symbols = [
+        Symbol("foo", "function", "/valid/path/exact.py", 1, 1),
+        Symbol("foo_prefix", "function", "/valid/path/prefix.py", 1, 1),
+    ]
+    with (
+        patch("os.path.isdir", return_value=True),
+        patch(
+            "vectorcode.mcp_main.get_project_config",
+            return_value=Config(project_root="/valid/path", reranker=None),
+        ),
+        patch("vectorcode.mcp_main.get_client"),
+        patch("vectorcode.mcp_main.get_collection"),
+        patch("vectorcode.mcp_main.get_symbol_results", return_value=symbols),
+        patch(
+            "vectorcode.mcp_main.get_query_result_files",
+            return_value=["/valid/path/file1.py", "/valid/path/exact.py"],
+        ),
+        patch("builtins.open", mock_open(read_data="content")),
+        patch("os.path.isfile", return_value=True),
+    ):
+        result = await query_tool(
+            n_query=3, query_messages=["foo"], project_root="/valid/path"
+        )
+    assert [i.split("</path>")[0] for i in result] == [
+        "<path>exact.py",
+        "<path>file1.py",
+        "<path>prefix.py",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_query_tool_evicts_idle_models(tmp_path):
+    from chromadb.api import AsyncClientAPI
+    from chromadb.utils import embedding_functions
+
+    from vectorcode.common import __COLLECTION_CACHE
+    from vectorcode.embedding_registry import (
+        embedding_function_registry,
+        make_embedding_key,
+    )
+
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+    configs = [
+        Config(
+            embedding_function="SentenceTransformerEmbeddingFunction",
+            embedding_params={"model_name": f"model_{i}"},
+            project_root=str(tmp_path / f"project_{i}"),
+            reranker=None,
+        )
+        for i in range(2)
+    ]
+    mock_client = MagicMock(spec=AsyncClientAPI)
+    mock_client.get_collection.return_value = MagicMock()
+    with (
+        patch("vectorcode.mcp_main.get_project_config", side_effect=configs),
+        patch("vectorcode.mcp_main.get_client", return_value=mock_client),
+        patch("vectorcode.mcp_main.get_symbol_results", return_value=[]),
+        patch("vectorcode.mcp_main.get_query_result_files", return_value=[]),
+        patch.object(embedding_functions, "SentenceTransformerEmbeddingFunction"),
+        patch.object(embedding_function_registry, "ttl", 0),
+    ):
+        for config in configs:
+            os.makedirs(str(config.project_root))
+            await query_tool(
+                n_query=1,
+                query_messages=["keyword"],
+                project_root=str(config.project_root),
+            )
+        # the model of the first project was unloaded when its collection went idle.
+        assert make_embedding_key(configs[0]) not in embedding_function_registry
+        assert make_embedding_key(configs[1]) in embedding_function_registry
+    __COLLECTION_CACHE.clear()
+    embedding_function_registry.clear()
+
+
+@pytest.mark.asyncio
+async def test_query_tool_other_project_roots():
+    with (
+        patch("os.path.isdir", return_value=True),
+        patch("vectorcode.mcp_main.get_project_config") as mock_get_project_config,
+        patch("vectorcode.mcp_main.get_client"),
+        patch("vectorcode.mcp_main.get_collection"),
+        patch(
+            "vectorcode.mcp_main.get_multi_project_results"
+        ) as mock_get_multi_project_results,
+    ):
+        mock_get_project_config.return_value = Config(project_root="/valid/path")
+        mock_get_multi_project_results.return_value = [
+            {"project": "/lib", "path": "lib.py", "document": "lib content"}
+        ]
+
+        result = await query_tool(
+            n_query=2,
+            query_messages=["keyword1"],
+            project_root="/valid/path",
+            other_project_roots=["/lib"],
+        )
+
+        query_config = mock_get_multi_project_results.call_args.args[0]
+        assert query_config.query_projects == ["/lib"]
+        assert result == [
+            "<project>/lib</project>\n<path>lib.py</path>\n<content>lib content</content>"
+        ]
+
+
+@pytest.mark.asyncio
+async def test_query_tool_char_budget():
+    with (
+        patch("os.path.isdir", return_value=True),
+        patch("vectorcode.mcp_main.get_project_config") as mock_get_project_config,
+        patch("vectorcode.mcp_main.get_client"),
+        patch("vectorcode.mcp_main.get_collection"),
+        patch("vectorcode.mcp_main.get_packed_results") as mock_get_packed_results,
+    ):
+        mock_get_project_config.return_value = Config(project_root="/valid/path")
+        mock_get_packed_results.return_value = [
+            {"path": "small.py", "document": "small content"},
+            {"path": "large.py", "chunk": "foo", "start_line": 3, "end_line": 4},
+        ]
+
+        result = await query_tool(
+            n_query=2,
+            query_messages=["keyword1"],
+            project_root="/valid/path",
+            char_budget=1000,
+        )
+
+        assert mock_get_packed_results.call_args.args[1].char_budget == 1000
+        assert result == [
+            "<path>small.py</path>\n<content>small content</content>",
+            "<path>large.py</path>\n<lines>3-4</lines>\n<content>foo</content>",
+        ]
+
+
 @pytest.mark.asyncio
 async def test_query_tool_collection_access_failure():
     with (
@@ -358,3 +497,5 @@ def test_args_parsing():
     parsed = parse_cli_args(args)
     assert parsed.n_results == 15
     assert parsed.ls_on_start
+    assert not parsed.warm_up
+    assert parse_cli_args(["--warm-up"]).warm_up
@@ -0,0 +1,118 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.common import _make_embedding_function
+from vectorcode.model_artifacts import (
+    ARTIFACT_MARKER,
+    CROSS_ENCODER,
+    SENTENCE_TRANSFORMER,
+    find_artifact,
+    get_artifact_path,
+    prepare_artifact,
+    prepare_onnx_cross_encoder,
+    prepare_sentence_transformer,
+    resolve_embedding_params,
+)
+
+
+@pytest.fixture
+def artifact_dir(tmp_path):
+    with patch("vectorcode.model_artifacts.ARTIFACT_DIR", str(tmp_path)):
+        yield str(tmp_path)
+
+
+def test_get_artifact_path(artifact_dir):
+    path = get_artifact_path(CROSS_ENCODER, "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    assert path.startswith(os.path.join(artifact_dir, CROSS_ENCODER))
+    assert os.path.basename(path).startswith("cross-encoder--ms-marco-MiniLM-L-6-v2-")
+    assert get_artifact_path(CROSS_ENCODER, "a/b") != get_artifact_path(
+        CROSS_ENCODER, "a--b"
+    )
+
+
+def test_prepare_artifact(artifact_dir):
+    def save(path):
+        with open(os.path.join(path, "model.safetensors"), "w") as fout:
+            fout.write("weights")
+
+    assert find_artifact(CROSS_ENCODER, "model") is None
+    path = prepare_artifact(CROSS_ENCODER, "model", save)
+    assert find_artifact(CROSS_ENCODER, "model") == path
+    assert os.path.isfile(os.path.join(path, "model.safetensors"))
+    assert os.path.isfile(os.path.join(path, ARTIFACT_MARKER))
+
+    # the existing artifact is kept unless forced.
+    save_again = MagicMock()
+    assert prepare_artifact(CROSS_ENCODER, "model", save_again) == path
+    save_again.assert_not_called()
+    prepare_artifact(CROSS_ENCODER, "model", save_again, force=True)
+    save_again.assert_called_once()
+    assert not os.path.isfile(os.path.join(path, "model.safetensors"))
+
+
+def test_prepare_artifact_failure(artifact_dir):
+    def save(path):
+        raise RuntimeError("download failed")
+
+    with pytest.raises(RuntimeError):
+        prepare_artifact(CROSS_ENCODER, "model", save)
+    assert find_artifact(CROSS_ENCODER, "model") is None
+    assert os.listdir(os.path.join(artifact_dir, CROSS_ENCODER)) == []
+
+
+def test_prepare_sentence_transformer(artifact_dir):
+    with patch("sentence_transformers.SentenceTransformer") as mock_model:
+        path = prepare_sentence_transformer("all-MiniLM-L6-v2")
+    mock_model.assert_called_once_with(
+        "all-MiniLM-L6-v2", device="cpu", trust_remote_code=False
+    )
+    mock_model.return_value.save.assert_called_once()
+    assert mock_model.return_value.save.call_args.kwargs["safe_serialization"]
+    assert find_artifact(SENTENCE_TRANSFORMER, "all-MiniLM-L6-v2") == path
+
+
+def test_prepare_onnx_cross_encoder(artifact_dir, tmp_path):
+    model_dir = tmp_path / "model"
+    (model_dir / "onnx").mkdir(parents=True)
+    (model_dir / "onnx" / "model.onnx").write_text("graph")
+    with patch("transformers.AutoTokenizer.from_pretrained") as mock_tokenizer:
+        path = prepare_onnx_cross_encoder(str(model_dir), "onnx/model.onnx")
+    mock_tokenizer.return_value.save_pretrained.assert_called_once()
+    with open(os.path.join(path, "onnx", "model.onnx")) as fin:
+        assert fin.read() == "graph"
+
+
+def test_resolve_embedding_params(artifact_dir):
+    params = {"model_name": "my-model", "device": "cpu"}
+    assert resolve_embedding_params("OllamaEmbeddingFunction", params) is params
+    assert (
+        resolve_embedding_params("SentenceTransformerEmbeddingFunction", params)
+        is params
+    )
+
+    path = prepare_artifact(SENTENCE_TRANSFORMER, "my-model", lambda _: None)
+    assert resolve_embedding_params("SentenceTransformerEmbeddingFunction", params) == {
+        "model_name": path,
+        "device": "cpu",
+    }
+    # the default model of chromadb.
+    default_path = prepare_artifact(
+        SENTENCE_TRANSFORMER, "all-MiniLM-L6-v2", lambda _: None
+    )
+    assert resolve_embedding_params("SentenceTransformerEmbeddingFunction", {}) == {
+        "model_name": default_path
+    }
+
+    with patch(
+        "chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction"
+    ) as mock_ef:
+        _make_embedding_function(
+            Config(
+                embedding_function="SentenceTransformerEmbeddingFunction",
+                embedding_params=params,
+            )
+        )
+    mock_ef.assert_called_once_with(model_name=path, device="cpu")
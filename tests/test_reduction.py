@@ -0,0 +1,191 @@
+import os
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.common import get_embedding_function, remove_index_dir
+from vectorcode.embedding_registry import embedding_function_registry
+from vectorcode.reduction import (
+    PROJECTION_DIGEST_KEY,
+    Calibration,
+    ProjectionMissingError,
+    ReducedEmbeddingFunction,
+    calibrate,
+    calibrate_from_files,
+    fit_pca,
+    get_calibration_digest,
+    measure_recall,
+    save_projection_digest,
+    truncate,
+)
+
+
+def fake_embedding_function(texts):
+    """Deterministic 8-dimensional embeddings that mostly vary in the first 2 dimensions."""
+    rows = []
+    for text in texts:
+        rng = numpy.random.default_rng(abs(hash(text)) % 2**32)
+        row = rng.normal(size=8) * numpy.array([10, 5, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1])
+        rows.append(row + 3)
+    return numpy.array(rows)
+
+
+@pytest.fixture
+def projection_dir(tmp_path):
+    with patch("vectorcode.common.GLOBAL_INDEX_DIR", str(tmp_path)):
+        yield str(tmp_path)
+
+
+def test_truncate():
+    reduced = truncate(numpy.array([[3.0, 4.0, 5.0], [0.0, 0.0, 1.0]]), 2)
+    numpy.testing.assert_allclose(reduced, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_fit_pca():
+    samples = fake_embedding_function([f"doc{i}" for i in range(50)])
+    calibration = fit_pca(samples, 2)
+    reduced = calibration.transform(samples)
+    assert reduced.shape == (50, 2)
+    numpy.testing.assert_allclose(numpy.linalg.norm(reduced, axis=1), 1, rtol=1e-5)
+    assert measure_recall(samples, reduced, k=5) > measure_recall(
+        samples, truncate(samples[:, ::-1], 2), k=5
+    )
+
+    # fewer samples than dimensions: the remaining components are zeros.
+    calibration = fit_pca(samples[:3], 5)
+    assert calibration.components is not None
+    assert calibration.components.shape == (5, 8)
+    assert not calibration.components[3:].any()
+
+
+def test_measure_recall():
+    vectors = numpy.eye(4) + 0.1
+    assert measure_recall(vectors, vectors, k=2) == 1.0
+    assert measure_recall(vectors[:1], vectors[:1]) == 1.0
+
+
+def test_calibration_save_load(tmp_path):
+    path = str(tmp_path / "projection.npz")
+    Calibration(recall=0.5, mean=numpy.zeros(3), components=numpy.eye(3)[:2]).save(path)
+    loaded = Calibration.load(path)
+    assert loaded.recall == 0.5
+    assert loaded.components is not None and loaded.components.shape == (2, 3)
+    Calibration(recall=0.75).save(path)
+    assert Calibration.load(path).components is None
+
+
+@pytest.mark.asyncio
+async def test_reduced_embedding_function_pca(projection_dir):
+    configs = Config(
+        embedding_function="Fake",
+        embedding_dimensions=2,
+        embedding_reduction="pca",
+        project_root=projection_dir,
+    )
+    ef = ReducedEmbeddingFunction(configs, fake_embedding_function)
+    with pytest.raises(ProjectionMissingError):
+        ef(["foo"])
+
+    recall = await calibrate(ef, [f"doc{i}" for i in range(100)])
+    assert recall is not None and 0 <= recall <= 1
+    assert ef.calibration_path is not None
+    # the projection lives with the local indices of the collection.
+    assert os.path.isfile(ef.calibration_path)
+    assert os.path.dirname(ef.calibration_path).startswith(projection_dir)
+    # already calibrated.
+    assert await calibrate(ef, ["foo"]) is None
+
+    embeddings = ReducedEmbeddingFunction(configs, fake_embedding_function)(
+        ["foo", "bar"]
+    )
+    assert len(embeddings) == 2 and len(embeddings[0]) == 2
+
+    # the projection is removed with the collection.
+    remove_index_dir(os.path.basename(os.path.dirname(ef.calibration_path)))
+    assert ef.calibration is None
+    with pytest.raises(ProjectionMissingError):
+        ef(["foo"])
+
+
+@pytest.mark.asyncio
+async def test_reduced_embedding_function_without_project():
+    ef = ReducedEmbeddingFunction(
+        Config(embedding_dimensions=2, embedding_reduction="pca"),
+        fake_embedding_function,
+    )
+    assert ef.calibration_path is None
+    assert await calibrate(ef, [f"doc{i}" for i in range(20)]) is not None
+    assert len(ef(["foo"])[0]) == 2
+
+
+@pytest.mark.asyncio
+async def test_save_projection_digest(projection_dir):
+    ef = ReducedEmbeddingFunction(
+        Config(
+            embedding_dimensions=2,
+            embedding_reduction="pca",
+            project_root=projection_dir,
+        ),
+        fake_embedding_function,
+    )
+    collection = MagicMock()
+    collection.metadata = {"path": projection_dir, "hnsw:space": "cosine"}
+    collection._client._modify = AsyncMock()
+    await save_projection_digest(collection, ef)
+    collection._client._modify.assert_not_called()
+
+    await calibrate(ef, [f"doc{i}" for i in range(20)])
+    await save_projection_digest(collection, ef)
+    # the existing keys are kept.
+    metadata = {
+        "path": projection_dir,
+        "hnsw:space": "cosine",
+        PROJECTION_DIGEST_KEY: get_calibration_digest(ef.calibration_path),
+    }
+    collection._client._modify.assert_awaited_once_with(
+        id=collection.id, new_metadata=metadata
+    )
+    collection._update_model_after_modify_success.assert_called_once_with(
+        None, metadata
+    )
+
+
+def test_reduced_embedding_function_truncate(projection_dir):
+    ef = ReducedEmbeddingFunction(
+        Config(embedding_dimensions=3), MagicMock(return_value=[[3.0, 0, 4.0, 1.0]])
+    )
+    numpy.testing.assert_allclose(ef(["foo"])[0], [0.6, 0, 0.8])
+    with pytest.raises(ValueError):
+        ReducedEmbeddingFunction(
+            Config(embedding_dimensions=3, embedding_reduction="foo"), MagicMock()
+        )
+
+
+@pytest.mark.asyncio
+async def test_calibrate_from_files(projection_dir, tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("\n".join(f"line {i}" for i in range(200)))
+    configs = Config(
+        embedding_function="SentenceTransformerEmbeddingFunction",
+        embedding_dimensions=4,
+        project_root=projection_dir,
+    )
+    assert await calibrate_from_files(Config(), [str(source)]) is None
+    embedding_function_registry.clear()
+    with (
+        patch(
+            "vectorcode.common._make_embedding_function",
+            return_value=fake_embedding_function,
+        ),
+        patch(
+            "vectorcode.chunking.TreeSitterChunker.chunk",
+            side_effect=lambda path: open(path).read().splitlines(),
+        ),
+    ):
+        assert isinstance(get_embedding_function(configs), ReducedEmbeddingFunction)
+        recall = await calibrate_from_files(configs, [str(source)])
+        assert recall is not None
+        assert await calibrate_from_files(configs, [str(source)]) is None
+    embedding_function_registry.clear()
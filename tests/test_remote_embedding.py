@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import numpy
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.common import _make_embedding_function
+from vectorcode.embedding_registry import embed
+from vectorcode.remote_embedding import (
+    RemoteEmbeddingError,
+    RemoteEmbeddingFunction,
+    backoff_delay,
+    parse_retry_after,
+)
+
+
+class StandIn:
+    """A local stand-in for an embedding API. The embedding of a text is `[len(text)]`."""
+
+    def __init__(self, delay: float = 0, failures: int = 0, status: int = 429):
+        self.delay = delay
+        self.failures = failures
+        self.status = status
+        self.requests: list[dict] = []
+        self.headers: list[dict] = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stand_in.lock:
+                    stand_in.requests.append(body)
+                    stand_in.headers.append(dict(self.headers))
+                    stand_in.active += 1
+                    stand_in.max_active = max(stand_in.max_active, stand_in.active)
+                    fail = stand_in.failures > 0
+                    stand_in.failures -= 1
+                time.sleep(stand_in.delay)
+                with stand_in.lock:
+                    stand_in.active -= 1
+                if fail:
+                    self.send_response(stand_in.status)
+                    self.send_header("Retry-After", "0")
+                    response = b"{}"
+                else:
+                    self.send_response(200)
+                    embeddings = [[float(len(i))] for i in body["input"]]
+                    if self.path == "/api/embed":
+                        data = {"embeddings": embeddings}
+                    else:
+                        # the items may come in any order.
+                        data = {
+                            "data": [
+                                {"index": i, "embedding": e}
+                                for i, e in reversed(list(enumerate(embeddings)))
+                            ]
+                        }
+                    response = json.dumps(data).encode()
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn(delay=0.05)
+    yield server
+    server.close()
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after("-1") == 0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+    assert 0 <= backoff_delay(10, 0.5, 2) <= 2
+
+
+def test_remote_embedding_concurrent_batches(stand_in):
+    ef = RemoteEmbeddingFunction(
+        url=stand_in.url, api_key="secret", batch_size=2, max_concurrency=4
+    )
+    texts = ["a" * i for i in range(1, 9)]
+    try:
+        embeddings = ef(texts)
+    finally:
+        ef.close()
+    assert [float(i[0]) for i in embeddings] == [float(len(i)) for i in texts]
+    assert isinstance(embeddings[0], numpy.ndarray)
+    assert len(stand_in.requests) == 4
+    assert all(len(i["input"]) == 2 for i in stand_in.requests)
+    assert stand_in.requests[0]["model"] == "nomic-embed-text"
+    assert stand_in.headers[0]["Authorization"] == "Bearer secret"
+    # the batches were in flight at the same time.
+    assert stand_in.max_active > 1
+
+
+def test_remote_embedding_ollama(stand_in):
+    ef = RemoteEmbeddingFunction(url=stand_in.url, api_type="ollama", model_name="m")
+    try:
+        assert [float(i[0]) for i in embed(ef, ["foo", "ab"])] == [3.0, 2.0]
+    finally:
+        ef.close()
+    assert stand_in.requests == [{"model": "m", "input": ["foo", "ab"]}]
+
+
+def test_remote_embedding_retry():
+    server = StandIn(failures=2, status=429)
+    ef = RemoteEmbeddingFunction(url=server.url, backoff_base=0.01)
+    try:
+        assert [float(i[0]) for i in ef(["foo"])] == [3.0]
+    finally:
+        ef.close()
+        server.close()
+    assert len(server.requests) == 3
+
+
+def test_remote_embedding_errors():
+    server = StandIn(failures=10, status=503)
+    ef = RemoteEmbeddingFunction(url=server.url, max_retries=1, backoff_base=0.01)
+    try:
+        with pytest.raises(RemoteEmbeddingError):
+            ef(["foo"])
+        assert len(server.requests) == 2
+    finally:
+        ef.close()
+        server.close()
+
+    # client errors are not retried.
+    server = StandIn(failures=10, status=400)
+    ef = RemoteEmbeddingFunction(url=server.url, backoff_base=0.01)
+    try:
+        with pytest.raises(RemoteEmbeddingError):
+            ef(["foo"])
+        assert len(server.requests) == 1
+    finally:
+        ef.close()
+        server.close()
+
+    with pytest.raises(ValueError):
+        RemoteEmbeddingFunction(api_type="foo")
+
+
+def test_make_remote_embedding_function():
+    with patch.dict("os.environ", {"TEST_API_KEY": "key"}):
+        ef = _make_embedding_function(
+            Config(
+                embedding_function="RemoteEmbeddingFunction",
+                embedding_params={
+                    "url": "http://localhost:1/",
+                    "api_key_env": "TEST_API_KEY",
+                },
+            )
+        )
+    assert isinstance(ef, RemoteEmbeddingFunction)
+    assert ef.endpoint == "http://localhost:1/embeddings"
+    assert ef.api_key == "key"
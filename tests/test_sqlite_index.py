@@ -0,0 +1,56 @@
+import os
+
+from vectorcode.cli_utils import Config
+from vectorcode.sqlite_index import SQLiteIndex, close_indices, open_index
+
+
+class DummyIndex(SQLiteIndex):
+    SCHEMA = "CREATE TABLE IF NOT EXISTS items (name TEXT PRIMARY KEY);"
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+def test_open_index(index_dir):
+    configs = Config(project_root=index_dir)
+    assert open_index(configs, "dummy.sqlite3", DummyIndex) is None
+
+    index = open_index(configs, "dummy.sqlite3", DummyIndex, make_if_missing=True)
+    assert isinstance(index, DummyIndex)
+    assert index.count() == 0
+    assert os.path.isfile(index.db_path)
+    assert open_index(configs, "dummy.sqlite3", DummyIndex) is index
+
+
+def test_close_indices(index_dir):
+    indices = [
+        open_index(
+            Config(project_root=os.path.join(index_dir, name)),
+            "dummy.sqlite3",
+            DummyIndex,
+            make_if_missing=True,
+        )
+        for name in ("project_a", "project_b")
+    ]
+    assert indices[0] is not None and indices[1] is not None
+    close_indices(os.path.basename(os.path.dirname(indices[0].db_path)))
+
+    # only the indices of that collection are closed and dropped from the cache.
+    assert (
+        open_index(
+            Config(project_root=os.path.join(index_dir, "project_a")),
+            "dummy.sqlite3",
+            DummyIndex,
+        )
+        is not indices[0]
+    )
+    assert indices[1].count() == 0
+    assert (
+        open_index(
+            Config(project_root=os.path.join(index_dir, "project_b")),
+            "dummy.sqlite3",
+            DummyIndex,
+        )
+        is indices[1]
+    )
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from vectorcode.chunking import Symbol
+from vectorcode.cli_utils import Config
+from vectorcode.symbols import (
+    SymbolIndex,
+    get_symbol_index,
+    get_symbol_name,
+)
+
+
+@pytest.fixture
+def symbol_index(tmp_path):
+    index = SymbolIndex(str(tmp_path / "symbols.sqlite3"))
+    index.add(
+        "/repo/a.py",
+        [
+            Symbol("get_reranker", "function", "/repo/a.py", 1, 5),
+            Symbol("get_reranker_class", "function", "/repo/a.py", 7, 9),
+        ],
+    )
+    index.add(
+        "/repo/b.py",
+        [
+            Symbol("RerankerBase", "class", "/repo/b.py", 1, 20),
+            Symbol("get_reranker", "method", "/repo/b.py", 3, 4),
+        ],
+    )
+    index.add("/repo/c.py", [])
+    yield index
+    index.close()
+
+
+def test_get_symbol_name():
+    assert get_symbol_name("get_reranker") == "get_reranker"
+    assert get_symbol_name(" vectorcode.common.get_collection ") == "get_collection"
+    assert get_symbol_name("Foo::bar") == "bar"
+    assert get_symbol_name("$el") == "$el"
+    assert get_symbol_name("how to rerank") is None
+    assert get_symbol_name("foo()") is None
+    assert get_symbol_name("123") is None
+
+
+def test_symbol_index_lookup(symbol_index):
+    symbols = symbol_index.lookup("get_reranker", 10)
+    assert [(i.path, i.start) for i in symbols] == [
+        ("/repo/a.py", 1),
+        ("/repo/b.py", 3),
+        ("/repo/a.py", 7),
+    ]
+    assert symbols[1].kind == "method"
+    assert len(symbol_index.lookup("get_reranker", 1)) == 1
+    assert symbol_index.lookup("get_reranker", 0) == []
+    assert [i.name for i in symbol_index.lookup("Reranker", 10)] == ["RerankerBase"]
+    assert symbol_index.lookup("reranker", 10) == []
+
+
+def test_symbol_index_lookup_exclude(symbol_index):
+    symbols = symbol_index.lookup("get_reranker", 10, exclude_paths=["/repo/a.py"])
+    assert [i.path for i in symbols] == ["/repo/b.py"]
+
+
+def test_symbol_index_delete(symbol_index):
+    assert symbol_index.has_path("/repo/c.py")
+    assert not symbol_index.has_path("/repo/d.py")
+    symbol_index.delete(["/repo/a.py", "/repo/c.py"])
+    assert not symbol_index.has_path("/repo/a.py")
+    assert not symbol_index.has_path("/repo/c.py")
+    assert [i.path for i in symbol_index.lookup("get_reranker", 10)] == ["/repo/b.py"]
+
+
+def test_get_symbol_index(index_dir):
+    configs = Config(project_root=index_dir)
+    assert get_symbol_index(configs, make_if_missing=True) is None
+
+    configs.symbol_index = True
+    assert get_symbol_index(configs) is None
+
+    index = get_symbol_index(configs, make_if_missing=True)
+    assert isinstance(index, SymbolIndex)
+    assert os.path.isfile(index.db_path)
+    assert get_symbol_index(configs) is index